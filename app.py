@@ -1,173 +1,133 @@
 import streamlit as st
-import boto3
 import os
-import pandas as pd
-import time
 from datetime import datetime
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-import getpass
-
-
-def read_config(config_file="product_configs.xlsx"):
-    """Reads product-to-account mapping from an Excel file."""
-    config_df = pd.read_excel(config_file)
-    return config_df.set_index('Product').to_dict('index')
-
-
-def fetch_credentials_via_selenium(account_id):
-    """Fetches AWS credentials dynamically using Selenium and Chrome SSO."""
-    username = getpass.getuser()
-    profile_path = fr'D:\Users\{username}\AppData\Local\Google\Chrome\User Data\Default'
-    chrome_path = "C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe"
-    options = Options()
-    options.add_argument("--start-maximized")
-    options.add_argument(f"--user-data-dir={profile_path}")
-
-    # Disable the sandboxing feature that can cause this issue
-    options.add_argument('--no-sandbox')
-
-    # Disable GPU hardware acceleration (sometimes helps with the crash)
-    options.add_argument('--disable-gpu')
-
-    options.add_argument('--disable-dev-shm-usage')
-
-    # Disable the DevToolsActivePort file issue
-    # options.add_argument('--remote-debugging-port=9222')
-
-    # options.add_argument('--headless')
-
-    options.binary_location = chrome_path
-    options.add_argument("--restart")
-    options.add_argument("--flag-switches-begin")
-    options.add_argument("--flag-switches-end")
-
-    driver = webdriver.Chrome(options=options)
-    try:
-        driver.get("https://d-90670e2182.awsapps.com/start/#/?tab=accounts")  
-
-        # Locate the account list div
-        wait = WebDriverWait(driver, 60)
-
-        account_list_div = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "div[data-testid='account-list']")))
-
-        # Find all account buttons
-        account_buttons = account_list_div.find_elements(By.CSS_SELECTOR, ".tkbnebnefszuGESxQTeA")
-
-        for button in account_buttons:
-            try:
-                # Find the div containing account information
-                account_info_div = button.find_element(By.CSS_SELECTOR, ".awsui_child_18582_whr0e_149:nth-of-type(2)")
-                # changing lbexh to whr0e on 20250515
-                account_p = account_info_div.find_element(By.CSS_SELECTOR, "p.awsui_color-text-body-secondary_18wu0_1gtn5_317")
-                # changing 1yxfb to fxrr2 on 20250515
-                # changing fxrr2_302 to khxlc_316 on 20251120
-                # changing khxlc to 3h5y5 on 20260121
-                account_text = account_p.find_element(By.CSS_SELECTOR, ".awsui_child_18582_whr0e_149:nth-of-type(1)").text
-                # changing finding by div tag to css class 
-
-                # Extract account ID and name
-                account_id_in_button = account_text.strip()
-
-                if account_id_in_button == account_id:
-                    button.click()
-
-                    # Find and click the access keys button
-                    access_keys_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "a[data-analytics='accounts-list-item-credential-modal-button']")))
-                    access_keys_button.click()
-
-                    # Locate input fields for access keys and secret keys
-                    time.sleep(3)
-                    keys_to_copy = driver.find_elements(By.CSS_SELECTOR, "input.awsui_input_2rhyz_i63ab_149.awsui_input-readonly_2rhyz_i63ab_203")
-                    # changing 6kb1z to 7gdci on 20250515
-                    # changed 7gdci to 8c1nk on 20251006
-                    # changed 8c1nk to 1dhxm and 196 to 203 on 20251120
-                    # changed 1dhxm to mfjkh on 20260121
-                    # changed mfjkh to 3fiyi on 20260224
-
-                    access_key = keys_to_copy[2].get_attribute("value")
-                    secret_key = keys_to_copy[3].get_attribute("value")
-                    session_token = keys_to_copy[4].get_attribute("value")
-                    driver.quit()
-                    break
-
-            except Exception as e:
-                continue  # Skip non-matching buttons
-
-    except Exception as e:
-        print(e)  
-    return access_key, secret_key, session_token
-
-
-def list_s3_files(bucket_name, folder_path, s3_client):
-    """Lists all files in a specific S3 folder."""
-    files_list = []
-    paginator = s3_client.get_paginator('list_objects_v2')
-    page_iterator = paginator.paginate(Bucket=bucket_name, Prefix=folder_path)
-    for page in page_iterator:
-        files = page.get('Contents')
-        for file in files:
-            files_list.append(file.get('Key')) 
-    return files_list
-
-
-def filter_files_by_date(files, start_date, end_date, product, s3_path_given):
-    """Filters files by date range based on their names and ensures they are .txt files with 'transaction' in the name."""
-    filtered_files = []
-    for file in files:
+from s3_engine import DEFAULT_CONCURRENCY, create_s3_client
+from jobs import DownloadJob
+from archive import archive_downloader, available_archive_formats
+from downloader import (account_id_for, default_download_folder, fetch_product_credentials, read_config,
+                        run_download, run_products)
+from credentials import invalidate_credentials, is_credential_error
+from metrics import RunMetrics, to_json_line, to_prometheus
+
+
+def product_job(product, product_config, local_folder, max_workers, archive_suffix=None, **criteria):
+    """Returns the background job body that downloads one product into local_folder, or into one archive there."""
+    if archive_suffix:
+        archive_name = os.path.basename(os.path.normpath(local_folder)) + archive_suffix
+        criteria['download'] = archive_downloader(archive_name)
+
+    def run(job):
+        account_id = account_id_for(product_config)
+        metrics = RunMetrics()
+        job.add_log("Fetching credentials...")
         try:
-            file_name = os.path.basename(file) 
-            if product.split()[0] in ['FNBO', 'CP']: 
-                date_str = file_name.split('.')[0][-8:]  # Extract date part
-                file_date = datetime.strptime(date_str, '%Y%m%d').date()
-            elif product.split()[0] == 'NF':
-                date_str = file_name.split(".")[0][-10:]
-                file_date = datetime.strptime(date_str, '%Y_%m_%d').date()
-
-            if start_date <= file_date <= end_date:
-                if s3_path_given:
-                    filtered_files.append(file)
-                else:
-                    if "transaction" in file_name:
-                        filtered_files.append(file)
-        except ValueError:
-            continue  # Skip files that don't match the date format
-    return filtered_files
-
-def filter_files_by_criteria(files, matching_text):
-    print("Inside criteria match function")
-    filtered_files = []
-    for file in files:
-        if matching_text.strip() in os.path.basename(file):
-            filtered_files.append(file)
-    return filtered_files
-
-def filter_files_by_exact_matches(files, exact_names):
-    print("Inside exact Match Function")
-    filtered_files = []
-    file_list = [name.strip() for name in exact_names.split(",")]
-    print(file_list)
-    for file in files:
-        # print(file, " name is checked")
-        file_name = os.path.basename(file)
-        if (file_name.split(".")[0] in file_list) or (file_name in file_list):
-            # print(file, " is being appended")
-            filtered_files.append(file)
-    return filtered_files
-
-
-def download_files(files, bucket_name, local_folder, s3_client):
-    """Downloads specified files from S3 to a local folder."""
-    print("Inside Downloads")
-    if not os.path.exists(local_folder):
-        os.makedirs(local_folder, exist_ok=True)
-    for file in files:
-        local_file_path = os.path.join(local_folder, os.path.basename(file))
-        s3_client.download_file(bucket_name, file, local_file_path)
-        st.write(f"Downloaded: {file}")
+            with metrics.phase('credentials'):
+                credentials = fetch_product_credentials(account_id)
+            s3_client = create_s3_client(*credentials, max_workers=max_workers, max_attempts=1)
+            counts, stats = job.section(product)
+            stats = run_download(product, product_config, local_folder, s3_client, max_workers=max_workers,
+                                 on_result=job.on_result, log=job.add_log, counts=counts, stats=stats,
+                                 cancel=job.cancelled, metrics=metrics, **criteria)
+            if archive_suffix:
+                job.artifacts.append(os.path.join(local_folder, archive_name))
+            return stats
+        except Exception as e:
+            if is_credential_error(e):
+                invalidate_credentials(account_id)
+            raise
+    return run
+
+
+def products_job(products, config, local_folder, max_workers, archive_suffix=None, **criteria):
+    """Returns the background job body that downloads several products in parallel into local_folder.
+
+    With archive_suffix each product is written to one archive in its subfolder.
+    """
+    if archive_suffix:
+        criteria['download'] = archive_downloader("files" + archive_suffix)
+
+    def run(job):
+        results = run_products(products, config, local_folder, max_workers,
+                               on_result=lambda product, key, error: job.on_result(key, error),
+                               log=lambda product, message: job.add_log(f"{product}: {message}"),
+                               progress=job.sections, cancel=job.cancelled, **criteria)
+        if archive_suffix:
+            job.artifacts += [os.path.join(local_folder, product.replace(' ', '_'), "files" + archive_suffix)
+                              for product, stats in results.items() if 'error' not in stats]
+        errors = [f"{product}: {stats['error']}" for product, stats in results.items() if 'error' in stats]
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        return results
+    return run
+
+
+def show_job(job):
+    """Renders one job's progress, its recent files and a cancel button."""
+    progress = job.progress()
+    with st.container(border=True):
+        st.write(f"**{job.name}**: {job.status}")
+        if progress['matched']:
+            st.progress(min(progress['done'] / progress['matched'], 1.0))
+        eta = f", about {progress['eta_seconds']:.0f}s left" if progress['eta_seconds'] is not None else ""
+        notes = f", {progress['retries']} requests retried" if progress['retries'] else ""
+        if progress['cache_hits']:
+            notes += f", {progress['cache_hits']} files ({progress['cache_bytes_saved'] / 1e6:.1f} MB) from cache"
+        st.write(f"{progress['done']} of {progress['matched']} files "
+                 f"({progress['downloaded']} downloaded, {progress['skipped']} skipped, {progress['failed']} failed), "
+                 f"{progress['bytes'] / 1e6:.1f} MB at {progress['throughput_mb_s']:.1f} MB/s in "
+                 f"{progress['seconds']:.0f}s{eta}{notes}")
+        if job.running:
+            if st.button("Cancel", key=f"cancel_{id(job)}"):
+                job.cancel()
+        elif job.status == 'failed':
+            st.error(f"An error occurred: {job.error}")
+        elif job.status == 'done' and not progress['matched']:
+            st.warning("No files found for the selected criteria.")
+        elif progress['failed']:
+            st.warning(f"Download completed with {progress['failed']} failed files.")
+        elif job.status == 'done':
+            st.success("Download completed.")
+        if not job.running:
+            for path in job.artifacts:
+                show_artifact(job, path)
+        with st.expander("Recent files"):
+            st.code("\n".join(job.log) or "Starting...")
+        run_metrics = job.run_metrics()
+        if run_metrics:
+            show_run_metrics(job, run_metrics)
+
+
+def show_artifact(job, path):
+    """Offers a job's archive for download, reading it into memory only once asked to and until it is saved."""
+    prepared = st.session_state.setdefault('prepared_downloads', {})
+    key = f"save_{id(job)}_{path}"
+    label = f"{os.path.basename(path)} ({os.path.getsize(path) / 1e6:.1f} MB)"
+    if key not in prepared:
+        if not st.button(f"Prepare download of {label}", key=f"prepare_{key}"):
+            return
+        with open(path, 'rb') as f:
+            prepared[key] = f.read()
+    st.download_button(f"Save {label}", prepared[key], file_name=os.path.basename(path), key=key,
+                       on_click=lambda: prepared.pop(key, None))
+
+
+def show_run_metrics(job, run_metrics):
+    """Shows where each finished run spent its time, with the metrics to save as JSON lines or Prometheus text."""
+    with st.expander("Run metrics"):
+        for product, summary in run_metrics.items():
+            phases = ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in summary['phases'].items())
+            latency = ""
+            if summary['latency_p50_seconds'] is not None:
+                latency = (f", {summary['latency_p50_seconds'] * 1000:.0f} ms per file "
+                           f"(p95 {summary['latency_p95_seconds'] * 1000:.0f} ms)")
+            st.write(f"**{product}**: {phases}; {sum(summary['requests'].values())} S3 requests "
+                     f"({summary['pages_listed']} listing pages), {summary['retries']} retried{latency}")
+        st.json(run_metrics, expanded=False)
+        st.download_button("Save as JSON lines", "".join(to_json_line(summary, {'product': product}) + "\n"
+                                                         for product, summary in run_metrics.items()),
+                           file_name="run_metrics.jsonl", key=f"metrics_json_{id(job)}")
+        st.download_button("Save as Prometheus text", to_prometheus(run_metrics), file_name="run_metrics.prom",
+                           key=f"metrics_prom_{id(job)}")
 
 # Main Streamlit App
 st.title("S3 File Downloader")
@@ -176,9 +136,30 @@ st.title("S3 File Downloader")
 config = read_config()
 
 # Select product
-product = st.selectbox("Select a Product:", list(config.keys()))
-s3_download_folder = st.text_input("Enter the s3 folder path (leave blank for transaction folder)")
+multi_product = st.checkbox("Download several products at once",
+                            help="Lists and downloads the selected products in parallel, each into its own subfolder")
+if multi_product:
+    products = st.multiselect("Select Products:", list(config.keys()))
+    product = None
+    s3_download_folder = ""
+else:
+    product = st.selectbox("Select a Product:", list(config.keys()))
+    s3_download_folder = st.text_input("Enter the s3 folder path (leave blank for transaction folder)")
 user_folder = st.text_input("Enter the local download folder path (leave blank to create a folder with latest date and time)")
+concurrency = st.number_input("Parallel downloads", min_value=1, max_value=64, value=DEFAULT_CONCURRENCY)
+archive_suffix = None
+if st.checkbox("Download into one archive", help="Streams the files straight into a single compressed archive instead of separate files"):
+    archive_suffix = st.selectbox("Archive format", available_archive_formats())
+sync_folder = st.checkbox("Only download new or changed files",
+                          help="Skips files already in the local folder above whose size and timestamp or ETag match S3")
+resume_run = st.checkbox("Resume the unfinished download in this folder",
+                         help="Retries only the files the last run into the local folder above did not finish, without listing S3 again")
+use_listing_index = st.checkbox("Use cached folder listing", value=True,
+                                help="Keeps a local index of the folder and only lists files added since the last run")
+use_cache = st.checkbox("Reuse files downloaded before",
+                        help="Takes files already downloaded on this machine, by anyone, from the local cache instead of S3 when they are unchanged")
+largest_first = st.checkbox("Largest files first",
+                            help="Waits for the whole listing, shows the total size, then downloads the biggest files first so none is left running alone at the end")
 
 st.markdown( 
     """ 
@@ -224,69 +205,51 @@ else:
 # Form for submitting and downloading files
 start_btn = st.button("Download Files")
 
-if start_btn:
-    # Fetch and process the form data
-    if product:
-        account_details = config[product]
-        account_id = account_details['AccountId'].replace('"', "")
-        
-        if s3_download_folder:
-            folder_path = s3_download_folder.split("/", 3)[-1]
-            bucket_name = s3_download_folder.split("/", 3)[-2]
-            s3_path_given = True
-        else:
-            folder_path = account_details['FolderPath']
-            bucket_name = account_details['BucketName']
-            s3_path_given = False
-
-        # Fetch AWS credentials dynamically
-        st.write("Fetching credentials...")
-        try:
-            aws_access_key_id, aws_secret_access_key, session_token = fetch_credentials_via_selenium(account_id)
-            st.success("Credentials fetched successfully.")
-        except Exception as e:
-            st.error(f"Failed to fetch credentials: {e}")
-            st.stop()
-
-        try:
-            st.write("Connecting to s3 client...")
-            # Initialize S3 client
-            s3_client = boto3.client('s3',
-                                    aws_access_key_id=aws_access_key_id,
-                                    aws_secret_access_key=aws_secret_access_key,
-                                    aws_session_token=session_token)
-            
-            # List files in S3 folder
-            all_files = list_s3_files(bucket_name, folder_path, s3_client)
-
-            st.write(f"{len(all_files)} Found in Bucket")
-
-            st.write("Filtering required files...")
-            
-            # Filter files based on criteria
-            if criteria == 'Date Range':
-                filtered_files = filter_files_by_date(all_files, start_date, end_date, product, s3_path_given)
-            elif criteria == 'Search Criteria':
-                filtered_files = filter_files_by_criteria(all_files, matching_text)
-            elif criteria == "File Names":
-                filtered_files = filter_files_by_exact_matches(all_files, exact_names)
-            elif criteria == 'All Files':
-                filtered_files = all_files[1:]
-
-            if user_folder.strip():
-                download_folder = user_folder
-            else:
-                download_folder = product.split()[0]+"_"+datetime.now().strftime("%Y%m%d_%H%M%S")
-                os.makedirs(download_folder, exist_ok=True)
-
-            print(filtered_files)
-
-            if filtered_files:
-                st.write(f"Found {len(filtered_files)} files. Downloading...")
-                download_files(filtered_files, bucket_name, download_folder, s3_client)
-                st.success("Download completed.")
-            else:
-                st.warning("No files found for the selected criteria.")
-
-        except Exception as e:
-            st.error(f"An error occurred: {e}")
\ No newline at end of file
+if start_btn and resume_run and not user_folder.strip():
+    st.warning("Enter the local download folder of the run to resume.")
+    st.stop()
+
+if start_btn and archive_suffix and (resume_run or sync_folder):
+    st.warning("Resume and only downloading changed files work with folders, not archives.")
+    st.stop()
+
+if start_btn and not resume_run and criteria is None:
+    st.warning("Select how to download files.")
+    st.stop()
+
+criteria_args = {'start_date': start_date, 'end_date': end_date, 'matching_text': matching_text,
+                 'exact_names': exact_names, 'sync': sync_folder, 'resume': resume_run,
+                 'use_listing_index': use_listing_index, 'archive_suffix': archive_suffix,
+                 'largest_first': largest_first, 'use_cache': use_cache}
+
+# Downloads run as background jobs kept in the session, so the page stays usable while they run
+if 'jobs' not in st.session_state:
+    st.session_state.jobs = []
+
+if start_btn and multi_product:
+    if not products:
+        st.warning("Select at least one product.")
+        st.stop()
+    download_folder = user_folder if user_folder.strip() else default_download_folder("Products")
+    st.session_state.jobs.append(DownloadJob(f"{', '.join(products)} into {download_folder}",
+                                             products_job(products, config, download_folder, concurrency,
+                                                          **criteria_args)))
+elif start_btn and product:
+    download_folder = user_folder if user_folder.strip() else default_download_folder(product)
+    st.session_state.jobs.append(DownloadJob(f"{product} into {download_folder}",
+                                             product_job(product, config[product], download_folder, concurrency,
+                                                         s3_path=s3_download_folder or None, **criteria_args)))
+
+
+@st.fragment(run_every=1 if any(job.running for job in st.session_state.jobs) else None)
+def show_jobs():
+    for job in reversed(st.session_state.jobs):
+        show_job(job)
+    # Once nothing is running, rerun the whole page so this fragment stops polling
+    if not any(job.running for job in st.session_state.jobs) and st.session_state.get('jobs_polling'):
+        st.session_state.jobs_polling = False
+        st.rerun()
+    st.session_state.jobs_polling = any(job.running for job in st.session_state.jobs)
+
+
+show_jobs()
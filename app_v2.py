@@ -1,183 +1,26 @@
 import streamlit as st
-import boto3
 import os
-import pandas as pd
-import time
 from datetime import datetime
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-import getpass
+from s3_engine import DEFAULT_CONCURRENCY, create_s3_client, date_format_for_product, download_files_concurrently, iter_s3_objects
+from filters import compile_filter
+from downloader import account_id_for, fetch_product_credentials, read_config
+from credentials import invalidate_credentials, is_credential_error
 
 
-def read_config(config_file="product_configs.xlsx"):
-    """Reads product-to-account mapping from an Excel file."""
-    config_df = pd.read_excel(config_file)
-    return config_df.set_index('Product').to_dict('index')
-
-
-def fetch_credentials_via_selenium(account_id):
-    """Fetches AWS credentials dynamically using Selenium and Chrome SSO."""
-    username = getpass.getuser()
-    profile_path = fr'D:\Users\{username}\AppData\Local\Google\Chrome\User Data\Default'
-    chrome_path = "C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe"
-    options = Options()
-    options.add_argument("--start-maximized")
-    options.add_argument(f"--user-data-dir={profile_path}")
-
-    # Disable the sandboxing feature that can cause this issue
-    options.add_argument('--no-sandbox')
-
-    # Disable GPU hardware acceleration (sometimes helps with the crash)
-    options.add_argument('--disable-gpu')
-
-    options.add_argument('--disable-dev-shm-usage')
-
-    # Disable the DevToolsActivePort file issue
-    # options.add_argument('--remote-debugging-port=9222')
-
-    # options.add_argument('--headless')
-
-    options.binary_location = chrome_path
-    options.add_argument("--restart")
-    options.add_argument("--flag-switches-begin")
-    options.add_argument("--flag-switches-end")
-
-    driver = webdriver.Chrome(options=options)
-    try:
-        driver.get("https://d-90670e2182.awsapps.com/start/#/?tab=accounts")  
-
-        # Locate the account list div
-        wait = WebDriverWait(driver, 60)
-
-        account_list_div = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "div[data-testid='account-list']")))
-
-        # Find all account buttons
-        account_buttons = account_list_div.find_elements(By.CSS_SELECTOR, ".tkbnebnefszuGESxQTeA")
-
-        for button in account_buttons:
-            try:
-                # Find the div containing account information
-                account_info_div = button.find_element(By.CSS_SELECTOR, ".awsui_child_18582_whr0e_149:nth-of-type(2)")
-                # changing lbexh to whr0e on 20250515
-                account_p = account_info_div.find_element(By.CSS_SELECTOR, "p.awsui_color-text-body-secondary_18wu0_1gtn5_317")
-                # changing 1yxfb to fxrr2 on 20250515
-                # changing fxrr2_302 to khxlc_316 on 20251120
-                # changing khxlc to 3h5y5 on 20260121
-                account_text = account_p.find_element(By.CSS_SELECTOR, ".awsui_child_18582_whr0e_149:nth-of-type(1)").text
-                # changing finding by div tag to css class 
-
-                # Extract account ID and name
-                account_id_in_button = account_text.strip()
-
-                if account_id_in_button == account_id:
-                    button.click()
-
-                    # Find and click the access keys button
-                    access_keys_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "a[data-analytics='accounts-list-item-credential-modal-button']")))
-                    access_keys_button.click()
-
-                    # Locate input fields for access keys and secret keys
-                    time.sleep(3)
-                    keys_to_copy = driver.find_elements(By.CSS_SELECTOR, "input.awsui_input_2rhyz_i63ab_149.awsui_input-readonly_2rhyz_i63ab_203")
-                    # changing 6kb1z to 7gdci on 20250515
-                    # changed 7gdci to 8c1nk on 20251006
-                    # changed 8c1nk to 1dhxm and 196 to 203 on 20251120
-                    # changed 1dhxm to mfjkh on 20260121
-                    # changed mfjkh to 3fiyi on 20260224
-
-                    access_key = keys_to_copy[2].get_attribute("value")
-                    secret_key = keys_to_copy[3].get_attribute("value")
-                    session_token = keys_to_copy[4].get_attribute("value")
-                    driver.quit()
-                    break
-
-            except Exception as e:
-                continue  # Skip non-matching buttons
-
-    except Exception as e:
-        print(e)  
-    return access_key, secret_key, session_token
-
-def list_s3_files(bucket_name, folder_path, s3_client):
-    """Lists all files in a specific S3 folder."""
-    files_list = []
-    paginator = s3_client.get_paginator('list_objects_v2')
-    page_iterator = paginator.paginate(Bucket=bucket_name, Prefix=folder_path)
-    for page in page_iterator:
-        files = page.get('Contents')
-        for file in files:
-            files_list.append(file.get('Key')) 
-    return files_list
-
-
-def filter_files_by_date(files, start_date, end_date, product, s3_path_given):
-    """Filters files by date range based on their names and ensures they are .txt files with 'transaction' in the name."""
-    print("Inside date filter function")
-    filtered_files = []
-    for file in files:
-        try:
-            file_name = os.path.basename(file) 
-            if product.split()[0] in ['FNBO', 'CP']: 
-                date_str = file_name.split('.')[0][-8:]  # Extract date part
-                file_date = datetime.strptime(date_str, '%Y%m%d').date()
-            elif product.split()[0] == 'NF':
-                date_str = file_name.split(".")[0][-10:]
-                file_date = datetime.strptime(date_str, '%Y_%m_%d').date()
-            if start_date <= file_date <= end_date:
-                if s3_path_given:
-                    filtered_files.append(file)
-                    # print(file)
-                else:
-                    if "transaction" in file_name:
-                        filtered_files.append(file)
-                        # print(file)
-        except ValueError:
-            continue  # Skip files that don't match the date format
-    return filtered_files
-
-def filter_files_by_criteria(files, matching_text):
-    print("Inside criteria match function")
-    print(matching_text)
-    print(len(files))
-    filtered_files = []
-    for file in files:
-        if matching_text.strip() in os.path.basename(file):
-            filtered_files.append(file)
-            # print(file)
-    return filtered_files
-
-def filter_files_by_exact_matches(files, exact_names):
-    print("Inside exact Match Function")
-    filtered_files = []
-    file_list = [name.strip() for name in exact_names.split(",")]
-    print(file_list)
-    for file in files:
-        # print(file, " name is checked")
-        file_name = os.path.basename(file)
-        if (file_name.split(".")[0] in file_list) or (file_name in file_list):
-            # print(file, " is being appended")
-            filtered_files.append(file)
-    return filtered_files
+def download_files(files, bucket_name, local_folder, s3_client, max_workers=DEFAULT_CONCURRENCY):
+    """Downloads specified files from S3 to a local folder using parallel workers."""
+    print("Inside Downloads")
 
-def filter_files_by_file_type(files, file_types_selected):
-    if len(file_types_selected):
-        filtered_files = [f for f in files if f.split(".")[-1] in file_types_selected]
-        return filtered_files
-    return files
+    def report(file, error):
+        if error is None:
+            st.write(f"Downloaded: {file}")
+        else:
+            st.write(f"Failed: {file} ({error})")
 
-
-def download_files(files, bucket_name, local_folder, s3_client):
-    """Downloads specified files from S3 to a local folder."""
-    print("Inside Downloads")
-    if not os.path.exists(local_folder):
-        os.makedirs(local_folder, exist_ok=True)
-    for file in files:
-        local_file_path = os.path.join(local_folder, os.path.basename(file))
-        s3_client.download_file(bucket_name, file, local_file_path)
-        st.write(f"Downloaded: {file}")
+    stats = download_files_concurrently(files, bucket_name, local_folder, s3_client, max_workers, on_result=report)
+    st.write(f"{stats['downloaded']} downloaded, {len(stats['failed'])} failed, "
+             f"{stats['bytes'] / 1e6:.1f} MB in {stats['seconds']:.1f}s ({stats['throughput_mb_s']:.1f} MB/s)")
+    return stats
 
 # Main Streamlit App
 st.title("S3 File Downloader")
@@ -189,6 +32,7 @@ config = read_config()
 product = st.selectbox("Select a Product:", list(config.keys()))
 s3_download_folder = st.text_input("Enter the s3 folder path (leave blank for transaction folder)")
 user_folder = st.text_input("Enter the local download folder path (leave blank to create a folder with latest date and time)")
+concurrency = st.number_input("Parallel downloads", min_value=1, max_value=64, value=DEFAULT_CONCURRENCY)
 
 file_type_options = ["txt", "json", "abc"]
 file_types = st.segmented_control("Type of file to download", file_type_options, selection_mode="multi", help="leave blank for all file types")
@@ -230,7 +74,7 @@ if start_btn:
     # Fetch and process the form data
     if product:
         account_details = config[product]
-        account_id = account_details['AccountId'].replace('"', "")
+        account_id = account_id_for(account_details)
         
         if s3_download_folder:
             folder_path = s3_download_folder.split("/", 3)[-1]
@@ -241,10 +85,15 @@ if start_btn:
             bucket_name = account_details['BucketName']
             s3_path_given = False
 
+        date_format = date_format_for_product(product, account_details)
+        if daterange_criteria and not date_format:
+            st.error(f"No DatePattern configured for {product} in product_configs.xlsx.")
+            st.stop()
+
         # Fetch AWS credentials dynamically
         st.write("Fetching credentials...")
         try:
-            aws_access_key_id, aws_secret_access_key, session_token = fetch_credentials_via_selenium(account_id)
+            aws_access_key_id, aws_secret_access_key, session_token = fetch_product_credentials(account_id)
             st.success("Credentials fetched successfully.")
         except Exception as e:
             st.error(f"Failed to fetch credentials: {e}")
@@ -253,41 +102,27 @@ if start_btn:
         try:
             st.write("Connecting to s3 client...")
             # Initialize S3 client
-            s3_client = boto3.client('s3',
-                                    aws_access_key_id=aws_access_key_id,
-                                    aws_secret_access_key=aws_secret_access_key,
-                                    aws_session_token=session_token)
+            s3_client = create_s3_client(aws_access_key_id, aws_secret_access_key, session_token,
+                                         max_workers=concurrency, max_attempts=1)
             
             # List files in S3 folder
-            all_files = list_s3_files(bucket_name, folder_path, s3_client)
+            all_files = list(iter_s3_objects(bucket_name, folder_path, s3_client))
 
             st.write(f"{len(all_files)} Found in Bucket")
 
             st.write("Filtering required files...")
 
-            filtered_files_all = []
-            
-            # Filter files based on criteria
-            if daterange_criteria:
-                print("Inside daterange_criteria")
-                filtered_files_all.append(filter_files_by_date(all_files, start_date, end_date, product, s3_path_given))
+            if not (daterange_criteria or partial_filename_criteria or exact_filename_criteria or all_files_criteria):
+                st.warning("Select at least one criteria.")
+                st.stop()
 
-            if partial_filename_criteria:
-                print("Inside partial_filename_criteria")
-                filtered_files_all.append(filter_files_by_criteria(all_files, matching_text))
-
-            if exact_filename_criteria:
-                print("Inside exact_filename_criteria")
-                filtered_files_all.append(filter_files_by_exact_matches(all_files, exact_names))
-                
-            if all_files_criteria:
-                print("Inside all_files_criteria")
-                filtered_files_all.append(all_files[1:])
-        
-
-            filtered_files = list(set.intersection(*map(set, filtered_files_all)))
-
-            filtered_files = filter_files_by_file_type(filtered_files, file_types)
+            # All selected criteria compiled into one predicate, checked in a single pass over the listing
+            matches = compile_filter(
+                start_date=start_date, end_date=end_date,
+                date_format=date_format,
+                require_text="transaction" if daterange_criteria and not s3_path_given else None,
+                matching_text=matching_text, exact_names=exact_names, file_types=file_types)
+            filtered_files = [file['Key'] for file in all_files if matches(file)]
 
             print("Filtered Files Distinct:", filtered_files)
 
@@ -299,10 +134,15 @@ if start_btn:
 
             if filtered_files:
                 st.write(f"Found {len(filtered_files)} files. Downloading...")
-                download_files(filtered_files, bucket_name, download_folder, s3_client)
-                st.success("Download completed.")
+                stats = download_files(filtered_files, bucket_name, download_folder, s3_client, concurrency)
+                if stats['failed']:
+                    st.warning(f"Download completed with {len(stats['failed'])} failed files.")
+                else:
+                    st.success("Download completed.")
             else:
                 st.warning("No files found for the selected criteria.")
 
         except Exception as e:
+            if is_credential_error(e):
+                invalidate_credentials(account_id)
             st.error(f"An error occurred: {e}")
\ No newline at end of file
@@ -0,0 +1,194 @@
+"""Stream S3 objects straight into one zip or tar archive, without writing the files themselves to disk.
+
+    download = archive_downloader("FNBO_20240301.zip")
+    stats = download(files, bucket_name, local_folder, s3_client, max_workers)
+
+Objects are fetched by a pool of workers and written by the calling thread in listing order, so the
+archive is the same from run to run. Supported formats, by file name: .zip, .tar.gz / .tgz, and
+.tar.zst when the zstandard package is installed.
+"""
+import os
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from retries import AdaptiveLimiter, call_with_retries
+from s3_engine import _CHUNK_SIZE, DEFAULT_CONCURRENCY, _timestamp
+
+
+ARCHIVE_FORMATS = ('.zip', '.tar.gz', '.tgz', '.tar.zst')
+
+# Objects up to this size are read into memory by the workers; larger bodies are streamed by the writer.
+BUFFER_LIMIT = 8 * 1024 * 1024
+
+
+def available_archive_formats():
+    """Returns the archive suffixes that can be written with the packages installed."""
+    return [suffix for suffix in ARCHIVE_FORMATS if suffix != '.tar.zst' or zstandard is not None]
+
+
+def archive_format(archive_path):
+    """Returns the archive suffix of archive_path, or raises ValueError for an unsupported one."""
+    for suffix in ARCHIVE_FORMATS:
+        if archive_path.lower().endswith(suffix):
+            if suffix == '.tar.zst' and zstandard is None:
+                raise ValueError("Writing .tar.zst archives needs zstandard: pip install zstandard")
+            return suffix
+    raise ValueError(f"Unsupported archive {archive_path!r}, use one of {', '.join(ARCHIVE_FORMATS)}")
+
+
+def _fetch(s3_client, bucket_name, entry):
+    """GETs an object, returning (body bytes or an unread stream, size, LastModified)."""
+    request = {'Bucket': bucket_name, 'Key': entry['Key']}
+    if entry.get('VersionId'):
+        request['VersionId'] = entry['VersionId']
+    response = s3_client.get_object(**request)
+    size = response.get('ContentLength', entry.get('Size'))
+    body = response['Body']
+    if size is None or size <= BUFFER_LIMIT:
+        body = body.read()
+        size = len(body)
+    return body, size, response.get('LastModified') or entry.get('LastModified')
+
+
+class _ArchiveWriter:
+    """Adds members to a zip or tar archive, from bytes or a readable stream of known size."""
+
+    def __init__(self, archive_path):
+        self.suffix = archive_format(archive_path)
+        self.raw = None
+        if self.suffix == '.zip':
+            self.archive = zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED)
+        elif self.suffix == '.tar.zst':
+            self.raw = open(archive_path, 'wb')
+            self.compressed = zstandard.ZstdCompressor().stream_writer(self.raw)
+            self.archive = tarfile.open(fileobj=self.compressed, mode='w|')
+        else:
+            self.archive = tarfile.open(archive_path, 'w:gz')
+
+    def add(self, name, body, size, last_modified):
+        mtime = _timestamp(last_modified) if last_modified is not None else time.time()
+        if self.suffix == '.zip':
+            info = zipfile.ZipInfo(name, time.localtime(mtime)[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            # size may be unknown or the compressed size exceed it; ZIP64 headers cost a few bytes
+            with self.archive.open(info, 'w', force_zip64=True) as member:
+                if isinstance(body, bytes):
+                    member.write(body)
+                else:
+                    for chunk in iter(lambda: body.read(_CHUNK_SIZE), b''):
+                        member.write(chunk)
+            return
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = mtime
+        if isinstance(body, bytes):
+            body = _BytesReader(body)
+        self.archive.addfile(info, body)
+
+    def close(self):
+        self.archive.close()
+        if self.raw is not None:
+            self.compressed.close()
+            self.raw.close()
+
+
+class _BytesReader:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def read(self, size=-1):
+        end = len(self.data) if size < 0 else self.offset + size
+        chunk = self.data[self.offset:end].tobytes()
+        self.offset += len(chunk)
+        return chunk
+
+
+def download_to_archive(files, bucket_name, archive_path, s3_client, max_workers=DEFAULT_CONCURRENCY,
+                        on_result=None, stats=None, executor=None):
+    """Downloads files into one archive at archive_path with parallel GETs and a single ordered writer.
+
+    files may be keys or listing entries from any iterable, pulled lazily with at most
+    2 * max_workers objects fetched ahead of the writer. Members are named after the file name
+    (or LocalName). An object that fails to fetch is left out and reported like in
+    download_files_concurrently; a failure part way through streaming a large object's body aborts
+    the archive, as the member can't be taken back. on_result, stats, GET retries and a shared
+    executor (one cap on requests across several runs) work as there too.
+    """
+    if stats is None:
+        stats = {}
+    limiter = AdaptiveLimiter(max_workers)
+    stats.update({'downloaded': 0, 'skipped': 0, 'skipped_bytes': 0, 'failed': {}, 'bytes': 0,
+                  'first_file_seconds': None})
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(os.path.abspath(archive_path)), exist_ok=True)
+    writer = _ArchiveWriter(archive_path)
+    queued = deque()
+
+    def write_next():
+        key, name, future = queued.popleft()
+        try:
+            body, size, last_modified = future.result()
+        except Exception as e:
+            stats['failed'][key] = str(e)
+            error = e
+        else:
+            writer.add(name, body, size, last_modified)
+            stats['downloaded'] += 1
+            stats['bytes'] += size
+            error = None
+        if stats['first_file_seconds'] is None:
+            stats['first_file_seconds'] = time.perf_counter() - started
+        stats.update(limiter.stats())
+        if on_result:
+            on_result(key, error)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for file in files:
+            entry = file if isinstance(file, dict) else {'Key': file}
+            version_id = entry.get('VersionId')
+            key = f"{entry['Key']}?versionId={version_id}" if version_id else entry['Key']
+            name = entry.get('LocalName') or os.path.basename(entry['Key'])
+            future = executor.submit(call_with_retries, limiter, _fetch, s3_client, bucket_name, entry)
+            queued.append((key, name, future))
+            if len(queued) >= 2 * max_workers:
+                write_next()
+        while queued:
+            write_next()
+    finally:
+        # After an aborted archive, fetches not started yet are dropped rather than left on a shared pool
+        for _, _, future in queued:
+            future.cancel()
+        if own_executor:
+            executor.shutdown()
+        writer.close()
+
+    stats['seconds'] = time.perf_counter() - started
+    stats['throughput_mb_s'] = stats['bytes'] / 1e6 / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+def archive_downloader(archive_name):
+    """Returns a drop-in for download_files_concurrently that writes local_folder/archive_name instead of files.
+
+    Manifest resume and sync don't apply to an archive and are ignored. A shared executor is used
+    as by download_files_concurrently, so archives in a multi-product run stay under its one cap.
+    """
+    archive_format(archive_name)
+
+    def download(files, bucket_name, local_folder, s3_client, max_workers=DEFAULT_CONCURRENCY, on_result=None,
+                 manifest=None, sync=False, executor=None, stats=None, **kwargs):
+        return download_to_archive(files, bucket_name, os.path.join(local_folder, archive_name), s3_client,
+                                   max_workers, on_result=on_result, stats=stats, executor=executor)
+    return download
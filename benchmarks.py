@@ -0,0 +1,881 @@
+"""Benchmarks for the S3 downloader against a local S3 stand-in.
+
+By default a moto server is started in-process (pip install "moto[server]").
+Pass --endpoint-url to run against an already running MinIO or other S3-compatible endpoint.
+
+    python benchmarks.py download --small 500 --large 4
+    python benchmarks.py listing --keys 500000
+    python benchmarks.py names --keys 500000 --names 10
+    python benchmarks.py pipeline --keys 1000000
+    python benchmarks.py filters --keys 1000000
+    python benchmarks.py async --objects 50000 --concurrency 16 64 --max-in-flight 256
+    python benchmarks.py config --repeat 20
+    python benchmarks.py archive --objects 2000 --object-size 262144
+    python benchmarks.py ranged --size-mb 1024 --part-sizes-mb 8 16 32 64
+    python benchmarks.py faults --objects 2000 --error-rate 0.05
+    python benchmarks.py makespan --objects 1000 --large 2 --max-size-mb 256
+    python benchmarks.py suite --keys 10000 100000 1000000 --output results.json --compare baseline.json
+
+`suite` is the one to run before and after a performance change: it seeds the FNBO, CP and NF
+folder layouts and saves listing, filter and download rates and peak memory as JSON.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from s3_engine import (DEFAULT_CONCURRENCY, create_s3_client, download_files_concurrently, iter_s3_files,
+                       iter_s3_objects, iter_s3_objects_by_date, iter_s3_objects_by_name, list_s3_files,
+                       list_s3_files_by_date, order_largest_first)
+from filters import compile_filter, filter_keys_vectorized
+from s3_async import async_downloader
+from archive import download_to_archive
+from retries import MAX_ATTEMPTS
+import downloader
+
+
+BENCH_BUCKET = "s3-downloader-bench"
+
+
+def start_local_s3():
+    """Starts a moto server on a free local port and returns (server, endpoint_url)."""
+    from moto.server import ThreadedMotoServer
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+class MotoProcess:
+    """A moto server in its own process, so its memory doesn't count towards the benchmark's."""
+
+    def __init__(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        self.process = subprocess.Popen([sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.endpoint_url = f"http://127.0.0.1:{port}"
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("moto server did not start, is moto[server] installed?")
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def bench_client(endpoint_url, max_workers=DEFAULT_CONCURRENCY):
+    return create_s3_client("testing", "testing", "testing",
+                            max_workers=max_workers, endpoint_url=endpoint_url)
+
+
+def seed_objects(s3_client, bucket_name, keys, size, max_workers=32):
+    """Uploads one object of `size` random bytes per key."""
+    try:
+        s3_client.create_bucket(Bucket=bucket_name)
+    except s3_client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    body = os.urandom(size)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda key: s3_client.put_object(Bucket=bucket_name, Key=key, Body=body), keys))
+
+
+def seed_large_object(s3_client, bucket_name, key, size):
+    """Uploads `size` random bytes to key via a multipart upload from a temporary file."""
+    try:
+        s3_client.create_bucket(Bucket=bucket_name)
+    except s3_client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        for _ in range(0, size, 64 * 1024 * 1024):
+            f.write(os.urandom(min(64 * 1024 * 1024, size - f.tell())))
+    try:
+        s3_client.upload_file(f.name, bucket_name, key)
+    finally:
+        os.remove(f.name)
+
+
+def iter_synthetic_transaction_keys(count, folder="Amerifirst/originations/hil_transaction/",
+                                    first_day=date(2020, 1, 1), stems=250):
+    """Yields an FNBO-style layout: `stems` merchant file families with one dated file per day each."""
+    day = first_day
+    while count > 0:
+        for merchant in range(min(stems, count)):
+            yield f"{folder}m{merchant:04d}_hil_transaction_{day:%Y%m%d}.txt"
+        count -= stems
+        day += timedelta(days=1)
+
+
+def synthetic_transaction_keys(count, folder="Amerifirst/originations/hil_transaction/", **kwargs):
+    return list(iter_synthetic_transaction_keys(count, folder, **kwargs))
+
+
+# The production folder layouts: bucket, folder, filename date pattern, file families per day and
+# how a family's file for a day is named.
+PRODUCT_LAYOUTS = {
+    "FNBO": ("ssp-dps-prod", "Amerifirst/originations/hil_transaction/", "%Y%m%d", 250,
+             lambda family, day: f"m{family:04d}_hil_transaction_{day:%Y%m%d}.txt"),
+    "CP": ("clp-lo-prod-s3-skeps", "skeps/originations/daily_files/transaction/", "%Y%m%d", 40,
+           lambda family, day: f"cp_{family:03d}_transaction_{day:%Y%m%d}.csv"),
+    "NF": ("nf-lo-prod-s3-skeps", "nf_daily_files/transaction/", "%Y_%m_%d", 8,
+           lambda family, day: f"nf_transaction_{family}_{day:%Y_%m_%d}.txt"),
+}
+
+
+def iter_layout_keys(layout, count, first_day=date(2020, 1, 1)):
+    """Yields count keys of a PRODUCT_LAYOUTS layout, day by day; a smaller count yields a prefix of a larger one."""
+    _, folder, _, families, name = PRODUCT_LAYOUTS[layout]
+    day = first_day
+    while count > 0:
+        for family in range(min(families, count)):
+            yield folder + name(family, day)
+        count -= families
+        day += timedelta(days=1)
+
+
+def current_rss():
+    """Resident memory of this process in bytes, or None where it can't be read (psutil helps on Windows)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PeakRSS:
+    """Samples resident memory on a thread while the with block runs; peak_mb holds the highest seen."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = current_rss()
+        self.stopped = threading.Event()
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        if self.peak is not None:
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / 1e6, 1) if self.peak is not None else None
+
+
+def count_list_requests(s3_client):
+    """Counts ListObjectsV2 responses and their body bytes made through s3_client."""
+    counts = {"pages": 0, "bytes": 0}
+    lock = threading.Lock()
+
+    def after_call(http_response, **kwargs):
+        with lock:
+            counts["pages"] += 1
+            counts["bytes"] += len(http_response.content)
+
+    s3_client.meta.events.register("after-call.s3.ListObjectsV2", after_call)
+    return counts
+
+
+class SyntheticListingClient:
+    """Stands in for an S3 client: pages synthetic keys lazily and "downloads" empty files.
+
+    Each page costs page_latency seconds, so the listing itself has realistic duration
+    without needing a server holding millions of keys.
+    """
+
+    def __init__(self, keys, page_latency=0.0):
+        self.keys = keys
+        self.page_latency = page_latency
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None, **kwargs):
+        """Returns the next page of up to 1000 keys; pages are handed out in order, as a listing asks for them."""
+        if ContinuationToken is None:
+            self.remaining = iter(self.keys)
+            self.next_key = next(self.remaining, None)
+        page = []
+        while self.next_key is not None and len(page) < 1000:
+            page.append({"Key": self.next_key, "Size": 0})
+            self.next_key = next(self.remaining, None)
+        time.sleep(self.page_latency)
+        response = {"Contents": page, "IsTruncated": self.next_key is not None}
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1]["Key"]
+        return response
+
+    def download_file(self, bucket_name, key, local_file_path):
+        open(local_file_path, "wb").close()
+
+
+class _FaultBody:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def inject_faults(s3_client, error_rate, seed=0):
+    """Makes a share error_rate of s3_client's GetObject calls fail before reaching the server.
+
+    Faults are split evenly between 503 SlowDown, 500 InternalError and a dropped connection.
+    Returns a dict counting the faults injected.
+    """
+    from botocore.awsrequest import AWSResponse
+    from botocore.exceptions import ConnectionClosedError
+
+    rng = random.Random(seed)
+    injected = {"slow_down": 0, "internal_error": 0, "connection_closed": 0}
+    lock = threading.Lock()
+
+    def before_send(request, **kwargs):
+        with lock:
+            roll = rng.random()
+        if roll >= error_rate:
+            return None
+        fault = ("slow_down", "internal_error", "connection_closed")[int(roll / error_rate * 3)]
+        with lock:
+            injected[fault] += 1
+        if fault == "connection_closed":
+            raise ConnectionClosedError(endpoint_url=request.url)
+        status, code = (503, "SlowDown") if fault == "slow_down" else (500, "InternalError")
+        body = f"<Error><Code>{code}</Code><Message>Injected</Message></Error>".encode()
+        return AWSResponse(request.url, status, {"Content-Type": "application/xml"}, _FaultBody(body))
+
+    s3_client.meta.events.register("before-send.s3.GetObject", before_send)
+    return injected
+
+
+def download_serially(files, bucket_name, local_folder, s3_client):
+    """The original one-key-at-a-time loop, kept as the baseline."""
+    os.makedirs(local_folder, exist_ok=True)
+    for file in files:
+        s3_client.download_file(bucket_name, file, os.path.join(local_folder, os.path.basename(file)))
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - started
+
+
+def run_download_benchmark(args, endpoint_url):
+    s3_client = bench_client(endpoint_url, args.concurrency)
+    small = [f"bench/small/file_{i:06d}.txt" for i in range(args.small)]
+    large = [f"bench/large/file_{i:03d}.bin" for i in range(args.large)]
+    seed_objects(s3_client, BENCH_BUCKET, small, args.small_size)
+    seed_objects(s3_client, BENCH_BUCKET, large, args.large_size)
+
+    results = {}
+    for label, files in (("small", small), ("large", large)):
+        if not files:
+            continue
+        workdir = tempfile.mkdtemp(prefix="s3bench_")
+        try:
+            serial = timed(download_serially, files, BENCH_BUCKET, os.path.join(workdir, "serial"), s3_client)
+            pooled = timed(download_files_concurrently, files, BENCH_BUCKET, os.path.join(workdir, "pooled"),
+                           s3_client, args.concurrency)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        results[label] = {"objects": len(files), "serial_seconds": round(serial, 3),
+                          "pooled_seconds": round(pooled, 3), "speedup": round(serial / pooled, 2)}
+    return results
+
+
+def run_async_benchmark(args, endpoint_url):
+    s3_client = bench_client(endpoint_url, max(args.concurrency))
+    folder = "bench/tiny/"
+    seed_objects(s3_client, BENCH_BUCKET, [f"{folder}file_{i:06d}.txt" for i in range(args.objects)],
+                 args.object_size, max_workers=64)
+    # List once up front, so both backends are timed on the downloads alone
+    files = list(iter_s3_objects(BENCH_BUCKET, folder, s3_client))
+
+    runs = {f"threads_{workers}": (download_files_concurrently, bench_client(endpoint_url, workers), workers)
+            for workers in args.concurrency}
+    for in_flight in args.max_in_flight:
+        runs[f"async_{in_flight}"] = (async_downloader(("testing", "testing", "testing"), in_flight, endpoint_url),
+                                      None, in_flight)
+    results = {}
+    for label, (download, client, workers) in runs.items():
+        workdir = tempfile.mkdtemp(prefix="s3bench_")
+        try:
+            stats = download(files, BENCH_BUCKET, workdir, client, workers)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        results[label] = {"objects": len(files), "downloaded": stats["downloaded"], "failed": len(stats["failed"]),
+                          "seconds": round(stats["seconds"], 3),
+                          "objects_per_second": round(stats["downloaded"] / stats["seconds"], 1)}
+    return results
+
+
+def run_archive_benchmark(args, endpoint_url):
+    s3_client = bench_client(endpoint_url, args.concurrency)
+    folder = "bench/archive/"
+    seed_objects(s3_client, BENCH_BUCKET, [f"{folder}file_{i:06d}.txt" for i in range(args.objects)],
+                 args.object_size)
+    files = list(iter_s3_objects(BENCH_BUCKET, folder, s3_client))
+
+    workdir = tempfile.mkdtemp(prefix="s3bench_")
+    try:
+        # Download to a folder, then zip it, as done by hand before
+        started = time.perf_counter()
+        stats = download_files_concurrently(files, BENCH_BUCKET, os.path.join(workdir, "folder"), s3_client,
+                                            args.concurrency)
+        folder_archive = os.path.join(workdir, "folder.zip")
+        with zipfile.ZipFile(folder_archive, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name in os.listdir(os.path.join(workdir, "folder")):
+                archive.write(os.path.join(workdir, "folder", name), name)
+        folder_seconds = time.perf_counter() - started
+
+        streamed_archive = os.path.join(workdir, "streamed.zip")
+        streamed = download_to_archive(files, BENCH_BUCKET, streamed_archive, s3_client, args.concurrency)
+        return {
+            "folder_then_zip": {"downloaded": stats["downloaded"], "seconds": round(folder_seconds, 3),
+                                "disk_bytes_written": stats["bytes"] + os.path.getsize(folder_archive),
+                                "disk_bytes_read": stats["bytes"]},
+            "streamed_zip": {"downloaded": streamed["downloaded"], "seconds": round(streamed["seconds"], 3),
+                             "disk_bytes_written": os.path.getsize(streamed_archive), "disk_bytes_read": 0},
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def skewed_sizes(count, max_size, large=2, seed=0):
+    """Returns count object sizes: `large` extracts of max_size, the rest heavy-tailed (Pareto) from 16 KB up."""
+    rng = random.Random(seed)
+    return [min(max_size, int(16 * 1024 * rng.paretovariate(1.1))) for _ in range(count - large)] + [max_size] * large
+
+
+def run_makespan_benchmark(args, endpoint_url):
+    s3_client = bench_client(endpoint_url, args.concurrency)
+    folder = "bench/skewed/"
+    max_size = args.max_size_mb * 1024 * 1024
+    # Sorted ascending, so in listing order the biggest files come last, as when a large extract lands late
+    sizes = sorted(skewed_sizes(args.objects, max_size, args.large))
+    data = os.urandom(max_size)
+    try:
+        s3_client.create_bucket(Bucket=BENCH_BUCKET)
+    except s3_client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        list(executor.map(lambda item: s3_client.put_object(Bucket=BENCH_BUCKET, Key=f"{folder}file_{item[0]:06d}.bin",
+                                                            Body=data[:item[1]]), enumerate(sizes)))
+    files = list(iter_s3_objects(BENCH_BUCKET, folder, s3_client))
+
+    runs = {"listing_order": (files, False), "largest_first": (order_largest_first(files), False),
+            "largest_first_batched": (order_largest_first(files), True)}
+    results = {}
+    for label, (ordered, batch_small_files) in runs.items():
+        workdir = tempfile.mkdtemp(prefix="s3bench_")
+        try:
+            # Ranged downloads are off, to show the ordering alone
+            stats = download_files_concurrently(ordered, BENCH_BUCKET, workdir, s3_client, args.concurrency,
+                                                large_object_threshold=max_size + 1,
+                                                batch_small_files=batch_small_files)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        results[label] = {"objects": len(files), "total_mb": round(sum(sizes) / 1e6, 1),
+                          "largest_mb": round(max(sizes) / 1e6, 1), "downloaded": stats["downloaded"],
+                          "makespan_seconds": round(stats["seconds"], 3), "mb_s": round(stats["throughput_mb_s"], 1)}
+    return results
+
+
+def run_listing_benchmark(args, endpoint_url):
+    folder = "Amerifirst/originations/hil_transaction/"
+    seed_client = bench_client(endpoint_url)
+    # A few long-running families, the layout narrowing skips through; FNBO's 250 short ones
+    # list no faster than the full folder
+    keys = synthetic_transaction_keys(args.keys, folder, stems=max(1, args.keys // args.days))
+    seed_objects(seed_client, BENCH_BUCKET, keys, 0)
+    start_date = date.fromisoformat(args.start_date)
+    end_date = date.fromisoformat(args.end_date)
+    low, high = f"{start_date:%Y%m%d}", f"{end_date:%Y%m%d}"
+
+    results = {}
+    for label in ("full_listing", "narrowed_listing"):
+        s3_client = bench_client(endpoint_url)
+        counts = count_list_requests(s3_client)
+        started = time.perf_counter()
+        if label == "full_listing":
+            listed = list_s3_files(BENCH_BUCKET, folder, s3_client)
+        else:
+            listed = list_s3_files_by_date(BENCH_BUCKET, folder, s3_client, start_date, end_date, "%Y%m%d")
+        seconds = time.perf_counter() - started
+        matched = [key for key in listed if low <= key[-12:-4] <= high]
+        results[label] = {"keys_listed": len(listed), "keys_matched": len(matched), "list_pages": counts["pages"],
+                          "bytes_fetched": counts["bytes"], "seconds": round(seconds, 3)}
+    return results
+
+
+def count_requests(s3_client):
+    """Counts the requests s3_client makes, by operation name."""
+    counts = {}
+    lock = threading.Lock()
+
+    def after_call(model, **kwargs):
+        with lock:
+            counts[model.name] = counts.get(model.name, 0) + 1
+
+    s3_client.meta.events.register("after-call.s3", after_call)
+    return counts
+
+
+def run_names_benchmark(args, endpoint_url):
+    folder = "Amerifirst/originations/hil_transaction/"
+    seed_client = bench_client(endpoint_url)
+    keys = synthetic_transaction_keys(args.keys, folder)
+    seed_objects(seed_client, BENCH_BUCKET, keys, 0)
+    # Half the names with their extension (HEAD), half without (prefix listing), spread over the folder
+    picked = [keys[i * len(keys) // args.names][len(folder):] for i in range(args.names)]
+    names = ",".join(name if i % 2 else name.split(".")[0] for i, name in enumerate(picked))
+    matches = compile_filter(exact_names=names)
+
+    results = {}
+    for label in ("full_listing", "by_name"):
+        s3_client = bench_client(endpoint_url)
+        requests = count_requests(s3_client)
+        started = time.perf_counter()
+        if label == "full_listing":
+            listed = iter_s3_objects(BENCH_BUCKET, folder, s3_client)
+        else:
+            listed = iter_s3_objects_by_name(BENCH_BUCKET, folder, s3_client, names)
+        matched = [file["Key"] for file in listed if matches(file)]
+        results[label] = {"names": args.names, "keys_in_folder": len(keys), "keys_matched": len(matched),
+                          "requests": requests, "seconds": round(time.perf_counter() - started, 3)}
+    return results
+
+
+def run_pipeline_benchmark(args, endpoint_url):
+    folder = "Amerifirst/originations/hil_transaction/"
+    middle_day = date(2020, 1, 1) + timedelta(days=args.keys // 500)
+    low, high = f"{middle_day:%Y%m%d}", f"{middle_day + timedelta(days=2):%Y%m%d}"
+
+    def matches(key):
+        return low <= key[-12:-4] <= high
+
+    results = {}
+    for label in ("staged", "streamed"):
+        s3_client = SyntheticListingClient(iter_synthetic_transaction_keys(args.keys, folder), args.page_latency)
+        workdir = tempfile.mkdtemp(prefix="s3bench_")
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            if label == "staged":
+                matched = [key for key in list_s3_files(BENCH_BUCKET, folder, s3_client) if matches(key)]
+                listed_seconds = time.perf_counter() - started
+                stats = download_files_concurrently(matched, BENCH_BUCKET, workdir, s3_client)
+                first_file = listed_seconds + stats["first_file_seconds"]
+            else:
+                stats = download_files_concurrently(
+                    (key for key in iter_s3_files(BENCH_BUCKET, folder, s3_client) if matches(key)),
+                    BENCH_BUCKET, workdir, s3_client)
+                first_file = stats["first_file_seconds"]
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+        results[label] = {"keys_listed": args.keys, "files_downloaded": stats["downloaded"],
+                          "seconds": round(time.perf_counter() - started, 3),
+                          "first_file_seconds": round(first_file, 3), "peak_memory_mb": round(peak / 1e6, 1)}
+    return results
+
+
+def strptime_filter(keys, start_date, end_date):
+    """The original per-key filter: basename, slice and datetime.strptime for every key."""
+    matched = []
+    for key in keys:
+        try:
+            file_name = os.path.basename(key)
+            file_date = datetime.strptime(file_name.split('.')[0][-8:], '%Y%m%d').date()
+            if start_date <= file_date <= end_date and "transaction" in file_name:
+                matched.append(key)
+        except ValueError:
+            continue
+    return matched
+
+
+def run_filters_benchmark(args, endpoint_url):
+    keys = synthetic_transaction_keys(args.keys)
+    entries = [{"Key": key} for key in keys]
+    start_date = date(2020, 1, 1) + timedelta(days=args.keys // 500)
+    end_date = start_date + timedelta(days=30)
+    criteria = {"start_date": start_date, "end_date": end_date, "date_format": "%Y%m%d",
+                "require_text": "transaction"}
+
+    def compiled():
+        matches = compile_filter(**criteria)
+        return [file["Key"] for file in entries if matches(file)]
+
+    runs = {"strptime": lambda: strptime_filter(keys, start_date, end_date), "compiled": compiled}
+    try:
+        import pandas  # noqa: F401
+        runs["vectorized"] = lambda: filter_keys_vectorized(keys, **criteria)
+    except ImportError:
+        pass
+
+    results = {}
+    for label, run in runs.items():
+        started = time.perf_counter()
+        matched = run()
+        seconds = time.perf_counter() - started
+        results[label] = {"keys": len(keys), "keys_matched": len(matched), "seconds": round(seconds, 3),
+                          "ns_per_key": round(seconds * 1e9 / len(keys), 1)}
+    return results
+
+
+def run_config_benchmark(args, endpoint_url):
+    """Per-rerun cost of loading product_configs.xlsx: parsing it every time vs the mtime-keyed caches."""
+    import pandas as pd
+
+    def per_call_ms(func):
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            func()
+        return round((time.perf_counter() - started) * 1000 / args.repeat, 2)
+
+    cache_file = os.path.splitext(args.config)[0] + ".cache.json"
+    results = {"read_excel_ms": per_call_ms(lambda: pd.read_excel(args.config).set_index('Product').to_dict('index'))}
+
+    def cold():
+        downloader._config_cache.clear()
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        downloader.read_config(args.config)
+    results["parse_and_write_cache_ms"] = per_call_ms(cold)
+
+    def new_process():
+        downloader._config_cache.clear()
+        downloader.read_config(args.config)
+    results["json_cache_ms"] = per_call_ms(new_process)
+    results["memory_cache_ms"] = per_call_ms(lambda: downloader.read_config(args.config))
+
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return results
+    # Whole-script reruns of the app as a widget interaction would trigger them, without clicking Download
+    app = AppTest.from_file(args.app, default_timeout=60)
+    app.run()
+    results["app_rerun_ms"] = per_call_ms(app.run)
+    downloader.read_config = lambda config_file=args.config: \
+        pd.read_excel(config_file).set_index('Product').to_dict('index')
+    results["app_rerun_parsing_every_time_ms"] = per_call_ms(app.run)
+    return results
+
+
+def run_ranged_benchmark(args, endpoint_url):
+    s3_client = bench_client(endpoint_url, args.concurrency)
+    size = args.size_mb * 1024 * 1024
+    keys = [f"bench/ranged/extract_{i:02d}.bin" for i in range(args.objects)]
+    for key in keys:
+        seed_large_object(s3_client, BENCH_BUCKET, key, size)
+    objects = [obj for obj in iter_s3_objects(BENCH_BUCKET, "bench/ranged/", s3_client) if obj["Key"] in keys]
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="s3bench_")
+    try:
+        seconds = timed(download_serially, keys, BENCH_BUCKET, os.path.join(workdir, "default"), s3_client)
+        results["boto3_download_file"] = {"seconds": round(seconds, 3),
+                                          "mb_s": round(len(keys) * size / 1e6 / seconds, 1)}
+        for part_size_mb in args.part_sizes_mb:
+            local_folder = os.path.join(workdir, f"parts_{part_size_mb}")
+            stats = download_files_concurrently(objects, BENCH_BUCKET, local_folder, s3_client, args.concurrency,
+                                                large_object_threshold=0, part_size=part_size_mb * 1024 * 1024)
+            results[f"ranged_{part_size_mb}mb_parts"] = {"seconds": round(stats["seconds"], 3),
+                                                         "mb_s": round(stats["throughput_mb_s"], 1),
+                                                         "failed": len(stats["failed"])}
+            shutil.rmtree(local_folder, ignore_errors=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def run_faults_benchmark(args, endpoint_url):
+    """Sustained download throughput when a share of GETs fail, with and without the retry scheduler.
+
+    botocore's own retries are turned off, so every injected fault reaches the scheduler.
+    """
+    seed_client = bench_client(endpoint_url, args.concurrency)
+    folder = "bench/faults/"
+    seed_objects(seed_client, BENCH_BUCKET, [f"{folder}file_{i:06d}.txt" for i in range(args.objects)],
+                 args.object_size)
+    files = list(iter_s3_objects(BENCH_BUCKET, folder, seed_client))
+
+    runs = {"no_faults": (0.0, MAX_ATTEMPTS), "faults_no_retries": (args.error_rate, 1),
+            "faults_with_retries": (args.error_rate, MAX_ATTEMPTS)}
+    results = {}
+    for label, (error_rate, max_attempts) in runs.items():
+        s3_client = create_s3_client("testing", "testing", "testing", max_workers=args.concurrency,
+                                     endpoint_url=endpoint_url, max_attempts=1)
+        injected = inject_faults(s3_client, error_rate)
+        workdir = tempfile.mkdtemp(prefix="s3bench_")
+        try:
+            stats = download_files_concurrently(files, BENCH_BUCKET, workdir, s3_client, args.concurrency,
+                                                max_attempts=max_attempts)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        results[label] = {"objects": len(files), "downloaded": stats["downloaded"], "failed": len(stats["failed"]),
+                          "faults_injected": sum(injected.values()), "retries": stats["retries"],
+                          "throttled": stats["throttled"], "lowest_concurrency": stats["lowest_concurrency"],
+                          "seconds": round(stats["seconds"], 3), "mb_s": round(stats["throughput_mb_s"], 2),
+                          "objects_per_second": round(stats["downloaded"] / stats["seconds"], 1)}
+    return results
+
+
+def run_suite_benchmark(args, endpoint_url):
+    """Listing, filter and download rates and peak memory per product layout, folder size and download mode.
+
+    Each layout's folder grows through args.keys (e.g. 10k, 100k, 1M keys), re-measuring at each
+    size. Keys are empty except the first args.window_days days of files, which get mixed sizes
+    and are what the download modes fetch, so downloads are comparable across folder sizes.
+    """
+    seed_client = bench_client(endpoint_url, 32)
+    rng = random.Random(0)
+    results = {"meta": {"started": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                        "platform": platform.platform(), "endpoint": args.endpoint_url or "moto",
+                        "concurrency": args.concurrency, "keys": args.keys},
+               "layouts": {}}
+    for layout in args.layouts:
+        bucket_name, folder, date_format, families, _ = PRODUCT_LAYOUTS[layout]
+        first_day = date(2020, 1, 1)
+        window = (first_day, first_day + timedelta(days=args.window_days - 1))
+        try:
+            seed_client.create_bucket(Bucket=bucket_name)
+        except seed_client.exceptions.BucketAlreadyOwnedByYou:
+            pass
+        seeded = 0
+        for count in sorted(args.keys):
+            window_files = families * args.window_days
+            # Same heavy-tailed sizes as skewed_sizes for the window's files
+            objects = [(key, min(args.max_object_size, int(16 * 1024 * rng.paretovariate(1.1)))
+                        if seeded + i < window_files else 0)
+                       for i, key in enumerate(list(iter_layout_keys(layout, count))[seeded:])]
+            with ThreadPoolExecutor(max_workers=32) as executor:
+                list(executor.map(lambda item: seed_client.put_object(Bucket=bucket_name, Key=item[0],
+                                                                      Body=os.urandom(item[1])), objects))
+            seeded = count
+            results["layouts"].setdefault(layout, {})[str(count)] = \
+                measure_layout(args, endpoint_url, bucket_name, folder, date_format, window)
+            print(f"{layout} {count} keys done", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            results["compared_to_" + os.path.basename(args.compare)] = compare_results(json.load(f), results)
+    return results
+
+
+def measure_layout(args, endpoint_url, bucket_name, folder, date_format, window):
+    """Measures one seeded folder: full and date-narrowed listing, the filters, then each download mode."""
+    s3_client = bench_client(endpoint_url, args.concurrency)
+    measured = {}
+    with PeakRSS() as rss:
+        started = time.perf_counter()
+        listed = list(iter_s3_objects(bucket_name, folder, s3_client))
+        seconds = time.perf_counter() - started
+    measured["listing"] = {"keys": len(listed), "seconds": round(seconds, 3),
+                           "keys_per_second": round(len(listed) / seconds), "peak_rss_mb": rss.peak_mb}
+    with PeakRSS() as rss:
+        started = time.perf_counter()
+        narrowed = list(iter_s3_objects_by_date(bucket_name, folder, s3_client, *window, date_format,
+                                                args.concurrency))
+        seconds = time.perf_counter() - started
+    measured["narrowed_listing"] = {"keys": len(narrowed), "seconds": round(seconds, 3),
+                                    "keys_per_second": round(len(narrowed) / seconds), "peak_rss_mb": rss.peak_mb}
+
+    criteria = {"start_date": window[0], "end_date": window[1], "date_format": date_format,
+                "require_text": "transaction"}
+    started = time.perf_counter()
+    matches = compile_filter(**criteria)
+    matched = [file for file in listed if matches(file)]
+    seconds = time.perf_counter() - started
+    measured["filter"] = {"keys": len(listed), "matched": len(matched), "seconds": round(seconds, 4),
+                          "keys_per_second": round(len(listed) / seconds) if seconds else None}
+    try:
+        import pandas  # noqa: F401
+        keys = [file["Key"] for file in listed]
+        started = time.perf_counter()
+        filter_keys_vectorized(keys, **criteria)
+        seconds = time.perf_counter() - started
+        measured["filter_vectorized"] = {"keys": len(keys), "seconds": round(seconds, 4),
+                                         "keys_per_second": round(len(keys) / seconds) if seconds else None}
+    except ImportError:
+        pass
+
+    modes = {
+        "threads": lambda workdir: download_files_concurrently(matched, bucket_name, workdir, s3_client,
+                                                               args.concurrency),
+        "largest_first": lambda workdir: download_files_concurrently(order_largest_first(matched), bucket_name,
+                                                                     workdir, s3_client, args.concurrency,
+                                                                     batch_small_files=True),
+        "zip_archive": lambda workdir: download_to_archive(matched, bucket_name, os.path.join(workdir, "files.zip"),
+                                                           s3_client, args.concurrency),
+    }
+    from s3_async import get_session
+    if get_session is not None:
+        download_async = async_downloader(("testing", "testing", "testing"), args.max_in_flight, endpoint_url)
+        modes["async"] = lambda workdir: download_async(matched, bucket_name, workdir)
+    for mode, run in modes.items():
+        workdir = tempfile.mkdtemp(prefix="s3bench_")
+        try:
+            with PeakRSS() as rss:
+                stats = run(workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        measured[f"download_{mode}"] = {"files": stats["downloaded"], "failed": len(stats["failed"]),
+                                        "mb": round(stats["bytes"] / 1e6, 1), "seconds": round(stats["seconds"], 3),
+                                        "mb_s": round(stats["throughput_mb_s"], 1),
+                                        "files_per_second": round(stats["downloaded"] / stats["seconds"], 1),
+                                        "peak_rss_mb": rss.peak_mb}
+    return measured
+
+
+def compare_results(old, new):
+    """Returns new / old for every numeric result present in both runs (rates: higher is better)."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        ratios = {key: compare_results(old[key], new[key]) for key in new if key in old and key != "meta"}
+        return {key: ratio for key, ratio in ratios.items() if ratio not in (None, {})}
+    if isinstance(old, (int, float)) and isinstance(new, (int, float)) and not isinstance(old, bool) and old:
+        return round(new / old, 3)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint-url", help="Use an existing S3-compatible endpoint instead of starting moto")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    download = subparsers.add_parser("download", help="Serial vs pooled download wall-clock time")
+    download.add_argument("--small", type=int, default=500, help="Number of small objects")
+    download.add_argument("--small-size", type=int, default=4 * 1024)
+    download.add_argument("--large", type=int, default=4, help="Number of large objects")
+    download.add_argument("--large-size", type=int, default=64 * 1024 * 1024)
+    download.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    download.set_defaults(run=run_download_benchmark)
+
+    listing = subparsers.add_parser("listing", help="ListObjectsV2 pages and bytes, full vs date-narrowed listing")
+    listing.add_argument("--keys", type=int, default=500000, help="Number of synthetic keys to seed")
+    listing.add_argument("--days", type=int, default=3650, help="Daily files per file family")
+    listing.add_argument("--start-date", default="2024-02-10")
+    listing.add_argument("--end-date", default="2024-03-31")
+    listing.set_defaults(run=run_listing_benchmark)
+
+    names = subparsers.add_parser("names", help="Finding a few exact file names: full listing vs HEAD per name")
+    names.add_argument("--keys", type=int, default=500000, help="Number of synthetic keys to seed")
+    names.add_argument("--names", type=int, default=10, help="Number of file names to look up")
+    names.set_defaults(run=run_names_benchmark)
+
+    makespan = subparsers.add_parser("makespan", help="Listing order vs largest-first on skewed object sizes")
+    makespan.add_argument("--objects", type=int, default=1000)
+    makespan.add_argument("--large", type=int, default=2, help="Objects of --max-size-mb among --objects")
+    makespan.add_argument("--max-size-mb", type=int, default=256)
+    makespan.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    makespan.set_defaults(run=run_makespan_benchmark)
+
+    ranged = subparsers.add_parser("ranged", help="Ranged parallel download of large objects across part sizes")
+    ranged.add_argument("--objects", type=int, default=1)
+    ranged.add_argument("--size-mb", type=int, default=1024)
+    ranged.add_argument("--part-sizes-mb", type=int, nargs="+", default=[8, 16, 32, 64])
+    ranged.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    ranged.set_defaults(run=run_ranged_benchmark)
+
+    pipeline = subparsers.add_parser("pipeline", help="Staged vs streamed list/filter/download, no S3 needed")
+    pipeline.add_argument("--keys", type=int, default=1000000, help="Number of synthetic keys listed")
+    pipeline.add_argument("--page-latency", type=float, default=0.0, help="Simulated seconds per listing page")
+    pipeline.set_defaults(run=run_pipeline_benchmark, local=True)
+
+    filters = subparsers.add_parser("filters", help="Per-key cost of the strptime, compiled and vectorized filters")
+    filters.add_argument("--keys", type=int, default=1000000, help="Number of synthetic keys to filter")
+    filters.set_defaults(run=run_filters_benchmark, local=True)
+
+    config = subparsers.add_parser("config", help="Product config load time per Streamlit rerun, no S3 needed")
+    config.add_argument("--config", default=downloader.DEFAULT_CONFIG_FILE)
+    config.add_argument("--app", default="app.py")
+    config.add_argument("--repeat", type=int, default=20)
+    config.set_defaults(run=run_config_benchmark, local=True)
+
+    archive = subparsers.add_parser("archive", help="Download then zip vs streaming straight into a zip")
+    archive.add_argument("--objects", type=int, default=2000)
+    archive.add_argument("--object-size", type=int, default=256 * 1024)
+    archive.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    archive.set_defaults(run=run_archive_benchmark)
+
+    async_io = subparsers.add_parser("async", help="Thread pool vs asyncio downloads of many tiny objects")
+    async_io.add_argument("--objects", type=int, default=50000)
+    async_io.add_argument("--object-size", type=int, default=4 * 1024)
+    async_io.add_argument("--concurrency", type=int, nargs="+", default=[DEFAULT_CONCURRENCY, 64],
+                          help="Thread pool sizes to try")
+    async_io.add_argument("--max-in-flight", type=int, nargs="+", default=[64, 256],
+                          help="In-flight GETs on the event loop to try")
+    async_io.set_defaults(run=run_async_benchmark)
+
+    faults = subparsers.add_parser("faults", help="Throughput with throttling and dropped connections injected")
+    faults.add_argument("--objects", type=int, default=2000)
+    faults.add_argument("--object-size", type=int, default=64 * 1024)
+    faults.add_argument("--error-rate", type=float, default=0.05, help="Share of GETs that fail")
+    faults.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    faults.set_defaults(run=run_faults_benchmark)
+
+    suite = subparsers.add_parser("suite", help="Listing, filter and download rates and memory as folders grow")
+    suite.add_argument("--keys", type=int, nargs="+", default=[10000, 100000], help="Folder sizes, e.g. up to 1000000")
+    suite.add_argument("--layouts", nargs="+", choices=list(PRODUCT_LAYOUTS), default=list(PRODUCT_LAYOUTS))
+    suite.add_argument("--window-days", type=int, default=7, help="Days of files with content, and downloaded")
+    suite.add_argument("--max-object-size", type=int, default=8 * 1024 * 1024)
+    suite.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    suite.add_argument("--max-in-flight", type=int, default=256, help="In-flight GETs of the async mode")
+    suite.add_argument("--output", help="Save the results to this JSON file")
+    suite.add_argument("--compare", help="Results JSON of an earlier run to print ratios against")
+    suite.set_defaults(run=run_suite_benchmark, moto_process=True)
+
+    args = parser.parse_args()
+    server = None
+    endpoint_url = args.endpoint_url
+    if not endpoint_url and getattr(args, "moto_process", False):
+        server = MotoProcess()
+        endpoint_url = server.endpoint_url
+    elif not endpoint_url and not getattr(args, "local", False):
+        server, endpoint_url = start_local_s3()
+    try:
+        print(json.dumps(args.run(args, endpoint_url), indent=2))
+    finally:
+        if server:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Headless batch mode: the same list, filter and download engine as the Streamlit app, for cron jobs.
+
+    python cli.py "FNBO Prod" --start-date 2024-03-01 --end-date 2024-03-31 --dest D:\\exports\\fnbo
+    python cli.py "NF Prod" --match settlement --file-types txt --concurrency 32
+    python cli.py "CP Prod" --resume --dest CP_20240301_020000
+    python cli.py "FNBO Prod" "CP Prod" "NF Prod" --start-date 2024-03-01 --end-date 2024-03-31
+    python cli.py "CP Prod" --match transaction --async-io --max-in-flight 256
+    python cli.py "FNBO Prod" --start-date 2024-03-01 --end-date 2024-03-31 --archive .zip
+    python cli.py "FNBO Prod" --start-date 2024-03-01 --end-date 2024-03-31 --parquet D:\\exports\\fnbo_parquet
+    python cli.py "FNBO Prod" "CP Prod" --match transaction --metrics-file runs.jsonl --prometheus-file s3.prom
+
+Several products run in parallel, each into a subfolder of --dest, sharing --concurrency.
+--parquet parses the matched files in memory into a Parquet dataset (needs pyarrow) instead of
+downloading them.
+
+Credentials come from the credential broker when S3_DOWNLOADER_BROKER_URL is set, otherwise from
+Chrome SSO, and are cached like in the app. Run stats are printed as one JSON object; the exit
+status is 1 when any file or product failed. Each product's stats include 'metrics': time spent
+fetching credentials, listing, filtering and transferring, S3 requests by operation and object
+latency percentiles. --metrics-file appends them as one JSON line per product, --prometheus-file
+writes them in the Prometheus text format.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import date
+
+from archive import archive_downloader, available_archive_formats
+from credentials import invalidate_credentials, is_credential_error
+from downloader import (DEFAULT_CONFIG_FILE, account_id_for, default_download_folder, fetch_product_credentials,
+                        iter_product_files, product_location, read_config, run_download, run_products)
+from metrics import RunMetrics, to_json_line, to_prometheus
+from s3_async import DEFAULT_MAX_IN_FLIGHT, async_downloader
+from s3_engine import DEFAULT_CONCURRENCY, create_s3_client, date_format_for_product, download_files_concurrently
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("products", nargs="+", metavar="product",
+                        help="Product name as listed in the config workbook, e.g. 'FNBO Prod'")
+    parser.add_argument("--config", default=DEFAULT_CONFIG_FILE)
+    parser.add_argument("--s3-path", help="s3://bucket/folder/ to read instead of the product's transaction folder")
+    parser.add_argument("--dest", help="Local download folder (default: product and current date and time)")
+    parser.add_argument("--start-date", type=date.fromisoformat, help="YYYY-MM-DD, by the date in the file name")
+    parser.add_argument("--end-date", type=date.fromisoformat, help="YYYY-MM-DD, by the date in the file name")
+    parser.add_argument("--match", help="Only files whose name contains this text")
+    parser.add_argument("--names", help="Comma separated file names, with or without extension")
+    parser.add_argument("--file-types", nargs="+", help="Only these extensions, e.g. txt json")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--sync", action="store_true", help="Skip files already in --dest that are unchanged in S3")
+    parser.add_argument("--resume", action="store_true", help="Retry only the files the last run into --dest left")
+    parser.add_argument("--listing-index", action="store_true", help="Use the cached folder listing")
+    parser.add_argument("--cache", action="store_true",
+                        help="Reuse files earlier runs on this machine downloaded, from the shared local cache")
+    parser.add_argument("--largest-first", action="store_true",
+                        help="List everything first, print the total size, then download the biggest files first")
+    parser.add_argument("--async-io", action="store_true",
+                        help="Download on one asyncio event loop (needs aiobotocore), for many small files")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="Concurrent GETs with --async-io")
+    parser.add_argument("--archive", choices=available_archive_formats(),
+                        help="Stream the files into one archive of this format in --dest instead of separate files")
+    parser.add_argument("--parquet", metavar="DIR",
+                        help="Load the files into a Parquet dataset at DIR, partitioned by file date, instead")
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help="Append each product's run metrics to PATH as JSON lines")
+    parser.add_argument("--prometheus-file", metavar="PATH",
+                        help="Write the run metrics to PATH in the Prometheus text format, e.g. for node_exporter")
+    args = parser.parse_args(argv)
+    if args.parquet and (args.archive or args.async_io or args.resume or args.sync or args.dest
+                         or len(args.products) > 1):
+        parser.error("--parquet loads a single product and can't be combined with the download options")
+    if args.archive and (args.async_io or args.resume or args.sync):
+        parser.error("--archive can't be combined with --async-io, --resume or --sync")
+    if args.s3_path and len(args.products) > 1:
+        parser.error("--s3-path reads a single folder, give one product")
+    if args.async_io and len(args.products) > 1:
+        parser.error("--async-io downloads a single product")
+    if args.async_io and args.cache:
+        parser.error("--async-io can't be combined with --cache")
+    if args.resume and not args.dest:
+        parser.error("--resume needs the --dest folder of the run to resume")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = read_config(args.config)
+    unknown = [product for product in args.products if product not in config]
+    if unknown:
+        print(f"Unknown product {unknown[0]!r}, expected one of: {', '.join(config)}", file=sys.stderr)
+        return 2
+    criteria = {'start_date': args.start_date, 'end_date': args.end_date, 'matching_text': args.match,
+                'exact_names': args.names, 'file_types': args.file_types, 'sync': args.sync, 'resume': args.resume,
+                'use_listing_index': args.listing_index, 'largest_first': args.largest_first,
+                'use_cache': args.cache}
+
+    if len(args.products) > 1:
+        dest = args.dest or default_download_folder("Products")
+        if args.archive:
+            criteria['download'] = archive_downloader("files" + args.archive)
+        results = run_products(args.products, config, dest, args.concurrency,
+                               log=lambda product, message: print(f"{product}: {message}", file=sys.stderr),
+                               **criteria)
+        print(json.dumps({'dest': dest, 'products': results}, indent=2))
+        export_metrics(args, results)
+        return 1 if any('error' in stats or stats['failed'] for stats in results.values()) else 0
+
+    product = args.products[0]
+    product_config = config[product]
+    account_id = account_id_for(product_config)
+    dest = args.dest or default_download_folder(product)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    metrics = RunMetrics()
+    try:
+        with metrics.phase('credentials'):
+            credentials = fetch_product_credentials(account_id)
+        s3_client = create_s3_client(*credentials, max_workers=args.concurrency, max_attempts=1)
+        if args.parquet:
+            return load_parquet(product, product_config, s3_client, args, log, metrics)
+        if args.async_io:
+            download = async_downloader(credentials, args.max_in_flight)
+        elif args.archive:
+            download = archive_downloader(os.path.basename(os.path.normpath(dest)) + args.archive)
+        else:
+            download = download_files_concurrently
+        stats = run_download(product, product_config, dest, s3_client, s3_path=args.s3_path,
+                             max_workers=args.concurrency, log=log, download=download, metrics=metrics, **criteria)
+    except Exception as e:
+        if is_credential_error(e):
+            invalidate_credentials(account_id)
+        raise
+    stats['product'] = product
+    stats['dest'] = dest
+    print(json.dumps(stats, indent=2))
+    export_metrics(args, {product: stats})
+    return 1 if stats['failed'] else 0
+
+
+def export_metrics(args, results):
+    """Appends each product's run metrics to --metrics-file and writes them all to --prometheus-file."""
+    summaries = {product: stats['metrics'] for product, stats in results.items() if 'metrics' in stats}
+    if args.metrics_file:
+        with open(args.metrics_file, 'a') as f:
+            for product, summary in summaries.items():
+                f.write(to_json_line(summary, {'product': product}) + "\n")
+    if args.prometheus_file:
+        # Written whole and renamed into place, so a collector never reads half a file
+        temporary = args.prometheus_file + ".tmp"
+        with open(temporary, 'w') as f:
+            f.write(to_prometheus(summaries))
+        os.replace(temporary, args.prometheus_file)
+
+
+def load_parquet(product, product_config, s3_client, args, log, metrics):
+    # Imported here so plain downloads don't pay for loading pandas
+    from dataframes import read_options_for_product, write_parquet_dataset
+
+    counts = {}
+    files = iter_product_files(product, product_config, s3_client, start_date=args.start_date,
+                               end_date=args.end_date, matching_text=args.match, exact_names=args.names,
+                               file_types=args.file_types, s3_path=args.s3_path, max_workers=args.concurrency,
+                               use_listing_index=args.listing_index, counts=counts, log=log, metrics=metrics)
+    try:
+        with metrics.count_requests(s3_client), metrics.phase('download'):
+            stats = write_parquet_dataset(files, product_location(product_config, args.s3_path)[0], args.parquet,
+                                          s3_client, read_options_for_product(product_config),
+                                          date_format_for_product(product, product_config), args.concurrency)
+    finally:
+        files.close()
+    stats.update(counts)
+    stats['metrics'] = metrics.summary(stats)
+    stats['product'] = product
+    stats['dest'] = args.parquet
+    print(json.dumps(stats, indent=2))
+    export_metrics(args, {product: stats})
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""Long-lived credential broker: one headless Chrome session serving SSO credentials for many accounts.
+
+    python credential_broker.py --config product_configs.xlsx
+
+Credentials for every AccountId in the config are harvested in a single pass over the portal's
+account list and refreshed before they expire. Point the Streamlit app and batch jobs at the
+broker with S3_DOWNLOADER_BROKER_URL=http://127.0.0.1:8765 and they never launch Chrome themselves.
+
+    GET /credentials/<account_id>        credentials for one account
+    GET /credentials?accounts=<id>,<id>  credentials for several accounts, harvested in one pass
+    GET /health                          accounts currently held
+
+Every request must carry the broker token in an X-Broker-Token header, so other users of a
+shared machine can't read the credentials. It is S3_DOWNLOADER_BROKER_TOKEN when set; otherwise
+a new token is generated at startup and saved to ~/.s3_downloader/broker_token (readable only by
+the user running the broker), where the app and batch jobs of the same user pick it up.
+"""
+import argparse
+import getpass
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from credentials import BROKER_TOKEN, BROKER_TOKEN_FILE, CREDENTIAL_TTL, REFRESH_MARGIN
+
+
+SSO_PORTAL_URL = "https://d-90670e2182.awsapps.com/start/#/?tab=accounts"
+DEFAULT_PORT = 8765
+
+# Portal selectors, also used by sso_login.fetch_credentials_via_selenium. The portal renames
+# its generated classes every few months; update them here only.
+ACCOUNT_LIST_SELECTOR = "div[data-testid='account-list']"
+ACCOUNT_BUTTON_SELECTOR = ".tkbnebnefszuGESxQTeA"
+# changing lbexh to whr0e on 20250515
+ACCOUNT_INFO_SELECTOR = ".awsui_child_18582_whr0e_149:nth-of-type(2)"
+# changing 1yxfb to fxrr2 on 20250515
+# changing fxrr2_302 to khxlc_316 on 20251120
+# changing khxlc to 3h5y5 on 20260121
+ACCOUNT_ID_PARAGRAPH_SELECTOR = "p.awsui_color-text-body-secondary_18wu0_1gtn5_317"
+ACCOUNT_ID_SELECTOR = ".awsui_child_18582_whr0e_149:nth-of-type(1)"
+ACCESS_KEYS_BUTTON_SELECTOR = "a[data-analytics='accounts-list-item-credential-modal-button']"
+# changing 6kb1z to 7gdci on 20250515
+# changed 7gdci to 8c1nk on 20251006
+# changed 8c1nk to 1dhxm and 196 to 203 on 20251120
+# changed 1dhxm to mfjkh on 20260121
+# changed mfjkh to 3fiyi on 20260224
+CREDENTIAL_INPUT_SELECTOR = "input.awsui_input_2rhyz_i63ab_149.awsui_input-readonly_2rhyz_i63ab_203"
+
+
+def create_browser(headless=True):
+    """Starts Chrome on the user's profile, so the SSO session is already signed in."""
+    username = getpass.getuser()
+    options = Options()
+    options.add_argument(fr'--user-data-dir=D:\Users\{username}\AppData\Local\Google\Chrome\User Data\Default')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-gpu')
+    options.add_argument('--disable-dev-shm-usage')
+    if headless:
+        options.add_argument('--headless=new')
+    options.binary_location = "C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe"
+    return webdriver.Chrome(options=options)
+
+
+def harvest_credentials(driver, account_ids):
+    """Reads the access keys of every account in account_ids in one pass over the portal's account list.
+
+    Returns {account_id: (access_key, secret_key, session_token)} for the accounts found.
+    """
+    wanted = set(account_ids)
+    found = {}
+    driver.get(SSO_PORTAL_URL)
+    wait = WebDriverWait(driver, 60)
+    account_list_div = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ACCOUNT_LIST_SELECTOR)))
+
+    for button in account_list_div.find_elements(By.CSS_SELECTOR, ACCOUNT_BUTTON_SELECTOR):
+        if wanted <= found.keys():
+            break
+        try:
+            account_info_div = button.find_element(By.CSS_SELECTOR, ACCOUNT_INFO_SELECTOR)
+            account_p = account_info_div.find_element(By.CSS_SELECTOR, ACCOUNT_ID_PARAGRAPH_SELECTOR)
+            account_id = account_p.find_element(By.CSS_SELECTOR, ACCOUNT_ID_SELECTOR).text.strip()
+            if account_id not in wanted or account_id in found:
+                continue
+
+            button.click()
+            wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, ACCESS_KEYS_BUTTON_SELECTOR))).click()
+            time.sleep(3)
+            keys_to_copy = driver.find_elements(By.CSS_SELECTOR, CREDENTIAL_INPUT_SELECTOR)
+            found[account_id] = tuple(keys_to_copy[i].get_attribute("value") for i in (2, 3, 4))
+
+            # Close the access keys modal and collapse the account, so the next account's
+            # access keys link is the only one on the page
+            ActionChains(driver).send_keys(Keys.ESCAPE).perform()
+            button.click()
+        except Exception:
+            continue  # Skip non-matching buttons
+    return found
+
+
+class CredentialBroker:
+    """Keeps one browser session alive and serves cached credentials for many accounts."""
+
+    def __init__(self, headless=True, ttl=CREDENTIAL_TTL):
+        self.headless = headless
+        self.ttl = ttl
+        self.driver = None
+        self.credentials = {}
+        self.lock = threading.Lock()
+
+    def _is_fresh(self, account_id):
+        # Refresh ahead of the clients' own margin, so they never receive nearly expired keys
+        entry = self.credentials.get(account_id)
+        return entry is not None and entry['Expiration'] - 2 * REFRESH_MARGIN > time.time()
+
+    def _harvest(self, account_ids):
+        for attempt in range(2):
+            try:
+                if self.driver is None:
+                    self.driver = create_browser(self.headless)
+                found = harvest_credentials(self.driver, account_ids)
+                break
+            except WebDriverException:
+                # The browser died or its session went stale; start a new one once
+                self.close()
+                if attempt:
+                    raise
+        expiration = time.time() + self.ttl
+        for account_id, (access_key, secret_key, session_token) in found.items():
+            self.credentials[account_id] = {'AccessKeyId': access_key, 'SecretAccessKey': secret_key,
+                                            'SessionToken': session_token, 'Expiration': expiration}
+
+    def harvest(self, account_ids):
+        """Returns credentials for account_ids, harvesting every stale one in a single browser pass."""
+        with self.lock:
+            stale = [account_id for account_id in account_ids if not self._is_fresh(account_id)]
+            if stale:
+                self._harvest(stale)
+            return {account_id: self.credentials[account_id]
+                    for account_id in account_ids if account_id in self.credentials}
+
+    def refresh_forever(self, interval=60):
+        """Re-harvests known accounts shortly before their credentials expire."""
+        while True:
+            time.sleep(interval)
+            try:
+                self.harvest(list(self.credentials))
+            except Exception as e:
+                print(f"Credential refresh failed: {e}")
+
+    def close(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except WebDriverException:
+                pass
+            self.driver = None
+
+
+def make_handler(broker, token):
+    class BrokerRequestHandler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if not hmac.compare_digest(self.headers.get('X-Broker-Token', '').encode(), token.encode()):
+                return self._send(403, {'error': 'invalid broker token'})
+            url = urlparse(self.path)
+            try:
+                if url.path == '/health':
+                    return self._send(200, {'accounts': sorted(broker.credentials)})
+                if url.path == '/credentials':
+                    account_ids = [a for a in parse_qs(url.query).get('accounts', [''])[0].split(',') if a]
+                    return self._send(200, broker.harvest(account_ids))
+                if url.path.startswith('/credentials/'):
+                    account_id = url.path.rsplit('/', 1)[1]
+                    entry = broker.harvest([account_id]).get(account_id)
+                    if entry is None:
+                        return self._send(404, {'error': f'account {account_id} not found in the SSO portal'})
+                    return self._send(200, entry)
+                return self._send(404, {'error': 'unknown path'})
+            except Exception as e:
+                return self._send(502, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            print(f"{self.address_string()} {format % args}")
+
+    return BrokerRequestHandler
+
+
+def create_token(token_file=BROKER_TOKEN_FILE):
+    """Returns S3_DOWNLOADER_BROKER_TOKEN, or a new random token saved to token_file for this user's clients."""
+    if BROKER_TOKEN:
+        return BROKER_TOKEN
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(os.path.abspath(token_file)), exist_ok=True)
+    temporary = token_file + '.tmp'
+    fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    os.replace(temporary, token_file)
+    return token
+
+
+def read_account_ids(config_file):
+    """Reads the distinct AccountIds from the product config workbook."""
+    from downloader import account_id_for, read_config
+
+    return sorted({account_id_for(product_config) for product_config in read_config(config_file).values()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--config', help="Warm up every AccountId in this product config workbook")
+    parser.add_argument('--accounts', default='', help="Comma separated account IDs to warm up")
+    parser.add_argument('--show-browser', action='store_true', help="Run Chrome with a visible window")
+    args = parser.parse_args()
+
+    broker = CredentialBroker(headless=not args.show_browser)
+    account_ids = [a.strip() for a in args.accounts.split(',') if a.strip()]
+    if args.config:
+        account_ids += read_account_ids(args.config)
+    if account_ids:
+        threading.Thread(target=broker.harvest, args=(account_ids,), daemon=True).start()
+    threading.Thread(target=broker.refresh_forever, daemon=True).start()
+
+    token = create_token()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(broker, token))
+    print(f"Credential broker listening on http://{args.host}:{args.port}"
+          + ("" if BROKER_TOKEN else f", token saved to {BROKER_TOKEN_FILE}"))
+    try:
+        server.serve_forever()
+    finally:
+        broker.close()
+
+
+if __name__ == '__main__':
+    main()
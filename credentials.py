@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+import urllib.request
+
+
+# Credentials copied from the SSO portal are valid for at least an hour.
+CREDENTIAL_TTL = 3600
+
+# Fetch fresh credentials this many seconds before the cached ones expire.
+REFRESH_MARGIN = 5 * 60
+
+# Optional JSON file that keeps cached credentials across app restarts and batch runs.
+CREDENTIAL_CACHE_FILE = os.environ.get('S3_DOWNLOADER_CREDENTIAL_CACHE')
+
+# A running credential_broker.py to ask for credentials instead of launching Chrome per fetch.
+BROKER_URL = os.environ.get('S3_DOWNLOADER_BROKER_URL')
+
+# Shared secret the broker expects in the X-Broker-Token header. When it is not set, the broker
+# generates one at startup and saves it to BROKER_TOKEN_FILE, readable only by its user.
+BROKER_TOKEN = os.environ.get('S3_DOWNLOADER_BROKER_TOKEN')
+BROKER_TOKEN_FILE = os.environ.get('S3_DOWNLOADER_BROKER_TOKEN_FILE',
+                                   os.path.join(os.path.expanduser('~'), '.s3_downloader', 'broker_token'))
+
+# S3 error codes meaning the cached credentials are no longer accepted.
+CREDENTIAL_ERROR_CODES = {'ExpiredToken', 'InvalidAccessKeyId', 'InvalidToken', 'TokenRefreshRequired'}
+
+_cache = {}
+_lock = threading.Lock()
+_loaded_files = set()
+
+
+def _load_cache_file(cache_file):
+    if not cache_file or cache_file in _loaded_files:
+        return
+    _loaded_files.add(cache_file)
+    try:
+        with open(cache_file) as f:
+            _cache.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+
+def _save_cache_file(cache_file):
+    if not cache_file:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    fd = os.open(cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(_cache, f)
+
+
+def get_cached_credentials(account_id, provider, ttl=CREDENTIAL_TTL, margin=REFRESH_MARGIN,
+                           cache_file=CREDENTIAL_CACHE_FILE):
+    """Returns (access_key, secret_key, session_token) for account_id, reusing cached values until near expiry.
+
+    provider(account_id) is only called when nothing usable is cached. It returns the three values,
+    optionally followed by the expiry as epoch seconds; without one the credentials are assumed
+    to last ttl seconds from now. Calls are serialised, so concurrent requests never start
+    two browser sessions on the same Chrome profile.
+    """
+    with _lock:
+        _load_cache_file(cache_file)
+        entry = _cache.get(account_id)
+        if entry and entry['Expiration'] - margin > time.time():
+            return entry['AccessKeyId'], entry['SecretAccessKey'], entry['SessionToken']
+
+        access_key, secret_key, session_token, *expiration = provider(account_id)
+        _cache[account_id] = {'AccessKeyId': access_key, 'SecretAccessKey': secret_key,
+                              'SessionToken': session_token,
+                              'Expiration': expiration[0] if expiration else time.time() + ttl}
+        _save_cache_file(cache_file)
+        return access_key, secret_key, session_token
+
+
+def invalidate_credentials(account_id, cache_file=CREDENTIAL_CACHE_FILE):
+    """Drops the cached credentials for account_id so the next request fetches new ones."""
+    with _lock:
+        _load_cache_file(cache_file)
+        if _cache.pop(account_id, None):
+            _save_cache_file(cache_file)
+
+
+def broker_token():
+    """Returns S3_DOWNLOADER_BROKER_TOKEN, or else the token a broker started by this user saved, or None."""
+    if BROKER_TOKEN:
+        return BROKER_TOKEN
+    try:
+        with open(BROKER_TOKEN_FILE) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _ask_broker(path, broker_url=None, timeout=180):
+    token = broker_token()
+    headers = {'X-Broker-Token': token} if token else {}
+    request = urllib.request.Request(f"{(broker_url or BROKER_URL).rstrip('/')}{path}", headers=headers)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)
+
+
+def fetch_credentials_via_broker(account_id, broker_url=None, timeout=180):
+    """Fetches credentials for account_id from a running credential broker.
+
+    Returns (access_key, secret_key, session_token, expiration), so it can be passed
+    straight to get_cached_credentials as the provider.
+    """
+    entry = _ask_broker(f"/credentials/{account_id}", broker_url, timeout)
+    return entry['AccessKeyId'], entry['SecretAccessKey'], entry['SessionToken'], entry['Expiration']
+
+
+def prefetch_credentials(account_ids, margin=REFRESH_MARGIN, cache_file=CREDENTIAL_CACHE_FILE, broker_url=None):
+    """Caches credentials for every account in account_ids with a single broker request.
+
+    Does nothing without a broker (S3_DOWNLOADER_BROKER_URL) or when every account already has
+    usable cached credentials. A cold broker then harvests all the accounts in one browser pass
+    instead of one per account. Accounts the broker doesn't return are left for
+    get_cached_credentials to fetch (and report) one by one.
+    """
+    if not (broker_url or BROKER_URL):
+        return
+    with _lock:
+        _load_cache_file(cache_file)
+        stale = sorted({account_id for account_id in account_ids
+                        if not (account_id in _cache and _cache[account_id]['Expiration'] - margin > time.time())})
+        if not stale:
+            return
+        entries = _ask_broker(f"/credentials?accounts={','.join(stale)}", broker_url)
+        for account_id, entry in entries.items():
+            _cache[account_id] = {name: entry[name]
+                                  for name in ('AccessKeyId', 'SecretAccessKey', 'SessionToken', 'Expiration')}
+        _save_cache_file(cache_file)
+
+
+def credential_provider(fallback):
+    """Returns the broker client when S3_DOWNLOADER_BROKER_URL is set, otherwise fallback."""
+    return fetch_credentials_via_broker if BROKER_URL else fallback
+
+
+def is_credential_error(error):
+    """True if an exception from boto3 means the credentials were rejected or expired."""
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in CREDENTIAL_ERROR_CODES
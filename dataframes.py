@@ -0,0 +1,178 @@
+"""Load matched S3 text files straight into pandas or a Parquet dataset, without writing the files to disk.
+
+    files = iter_product_files("FNBO Prod", product_config, s3_client, start_date=start, end_date=end)
+    df = load_dataframe(files, bucket_name, s3_client, read_options_for_product(product_config),
+                        date_format_for_product("FNBO Prod", product_config))
+    stats = write_parquet_dataset(files, bucket_name, "fnbo_transactions", s3_client, ...)
+
+Objects are fetched and parsed by a pool of threads and collected in listing order. Each row gets
+the name of the file it came from (source_file) and, with a date pattern, the file's date
+(file_date), which also partitions the Parquet dataset (fnbo_transactions/file_date=2024-03-01/...).
+"""
+import csv
+import io
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from filters import LAST_MODIFIED, compile_date_extractor, last_modified_date
+from retries import AdaptiveLimiter, call_with_retries
+from s3_engine import DEFAULT_CONCURRENCY
+
+
+# Every column is read as text unless the product's ReadOptions say otherwise, so files of the
+# same product always concatenate to the same columns and types.
+DEFAULT_READ_OPTIONS = {'dtype': str, 'keep_default_na': False}
+
+# Files parsed into one batch of Parquet files.
+FILES_PER_BATCH = 64
+
+_SNIFF_BYTES = 64 * 1024
+
+
+def read_options_for_product(product_config):
+    """Returns pandas.read_csv options for a product's text files.
+
+    The optional ReadOptions column of product_configs.xlsx holds them as JSON, for example
+    {"sep": "|", "dtype": {"amount": "float64"}}; they are applied over DEFAULT_READ_OPTIONS.
+    """
+    options = dict(DEFAULT_READ_OPTIONS)
+    extra = (product_config or {}).get('ReadOptions')
+    if isinstance(extra, str) and extra.strip():
+        options.update(json.loads(extra))
+    return options
+
+
+def _sniff_sep(data):
+    """Guesses the delimiter from the start of a file, so the fast C parser can be used."""
+    sample = data[:_SNIFF_BYTES].decode('utf-8', errors='replace')
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',|\t;').delimiter
+    except csv.Error:
+        return ','
+
+
+def _date_extractor(date_format):
+    if not date_format:
+        return None
+    if date_format == LAST_MODIFIED:
+        return last_modified_date
+    extract = compile_date_extractor(date_format)
+    return lambda entry: extract(os.path.basename(entry['Key']))
+
+
+def _fetch_and_parse(s3_client, bucket_name, entry, read_options, extract_date):
+    """GETs one object and parses it into a DataFrame with source_file (and file_date) columns."""
+    data = s3_client.get_object(Bucket=bucket_name, Key=entry['Key'])['Body'].read()
+    options = dict(read_options)
+    if 'sep' not in options and 'delimiter' not in options:
+        options['sep'] = _sniff_sep(data)
+    frame = pd.read_csv(io.BytesIO(data), **options)
+    frame['source_file'] = os.path.basename(entry['Key'])
+    if extract_date is not None:
+        file_date = extract_date(entry)
+        frame['file_date'] = (f"{file_date // 10000:04d}-{file_date // 100 % 100:02d}-{file_date % 100:02d}"
+                              if file_date else None)
+    return frame, len(data)
+
+
+def iter_frames(files, bucket_name, s3_client, read_options=None, date_format=None,
+                max_workers=DEFAULT_CONCURRENCY, on_result=None, stats=None):
+    """Yields a DataFrame per file, in listing order, fetching and parsing up to 2 * max_workers files ahead.
+
+    Files that fail to fetch or parse are skipped and reported through on_result(key, error) and
+    stats['failed'], like download_files_concurrently, after the same retries on throttling and
+    dropped connections; stats also counts files, rows and bytes.
+    """
+    read_options = read_options or DEFAULT_READ_OPTIONS
+    extract_date = _date_extractor(date_format)
+    if stats is None:
+        stats = {}
+    limiter = AdaptiveLimiter(max_workers)
+    stats.update({'downloaded': 0, 'rows': 0, 'bytes': 0, 'failed': {}})
+    queued = deque()
+
+    def take():
+        key, future = queued.popleft()
+        stats.update(limiter.stats())
+        try:
+            frame, size = future.result()
+        except Exception as e:
+            stats['failed'][key] = str(e)
+            if on_result:
+                on_result(key, e)
+            return None
+        stats['downloaded'] += 1
+        stats['rows'] += len(frame)
+        stats['bytes'] += size
+        if on_result:
+            on_result(key, None)
+        return frame
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for file in files:
+            entry = file if isinstance(file, dict) else {'Key': file}
+            future = executor.submit(call_with_retries, limiter, _fetch_and_parse, s3_client, bucket_name, entry,
+                                     read_options, extract_date)
+            queued.append((entry['Key'], future))
+            if len(queued) >= 2 * max_workers:
+                frame = take()
+                if frame is not None:
+                    yield frame
+        while queued:
+            frame = take()
+            if frame is not None:
+                yield frame
+
+
+def load_dataframe(files, bucket_name, s3_client, read_options=None, date_format=None,
+                   max_workers=DEFAULT_CONCURRENCY, on_result=None, stats=None):
+    """Returns all files parsed and concatenated into one DataFrame (empty if nothing matched)."""
+    frames = list(iter_frames(files, bucket_name, s3_client, read_options, date_format, max_workers,
+                              on_result, stats))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def write_parquet_dataset(files, bucket_name, out_dir, s3_client, read_options=None, date_format=None,
+                          max_workers=DEFAULT_CONCURRENCY, on_result=None, stats=None,
+                          files_per_batch=FILES_PER_BATCH):
+    """Parses files into a Parquet dataset at out_dir, partitioned by file_date when there is a date_format.
+
+    Files are written in batches of files_per_batch, so memory holds one batch rather than the
+    whole pull. Needs pyarrow. Returns the iter_frames stats plus 'seconds' and 'batches'.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Writing Parquet needs pyarrow: pip install pyarrow") from None
+
+    if stats is None:
+        stats = {}
+    started = time.perf_counter()
+    partition_cols = ['file_date'] if date_format else None
+    batch = []
+    batches = 0
+
+    def flush():
+        nonlocal batches
+        table = pa.Table.from_pandas(pd.concat(batch, ignore_index=True), preserve_index=False)
+        pq.write_to_dataset(table, out_dir, partition_cols=partition_cols,
+                            basename_template=f"part-{batches:05d}-{{i}}.parquet")
+        batches += 1
+        batch.clear()
+
+    for frame in iter_frames(files, bucket_name, s3_client, read_options, date_format, max_workers, on_result,
+                             stats):
+        batch.append(frame)
+        if len(batch) >= files_per_batch:
+            flush()
+    if batch:
+        flush()
+    stats['batches'] = batches
+    stats['seconds'] = time.perf_counter() - started
+    return stats
@@ -0,0 +1,308 @@
+import json
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from credentials import (credential_provider, get_cached_credentials, invalidate_credentials, is_credential_error,
+                         prefetch_credentials)
+from filters import compile_filter
+from listing_index import iter_indexed_objects, open_listing_index, refresh_listing_index
+from manifest import DownloadManifest
+from metrics import RunMetrics
+from object_cache import ObjectCache
+from s3_engine import (DEFAULT_CONCURRENCY, count_items, create_s3_client, date_format_for_product,
+                       download_files_concurrently, iter_s3_objects, iter_s3_objects_by_date, iter_s3_objects_by_name,
+                       order_largest_first, stop_when, summarize_files)
+from sso_login import fetch_credentials_via_selenium
+
+
+DEFAULT_CONFIG_FILE = "product_configs.xlsx"
+
+# Parsed workbooks by path, with the (mtime, size) they were parsed at.
+_config_cache = {}
+
+# MB/s of the last download from each bucket in this process, for the estimate before a planned run.
+_recent_throughput = {}
+
+
+def _config_signature(config_file):
+    stat = os.stat(config_file)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _parse_config(config_file):
+    import pandas as pd
+
+    config_df = pd.read_excel(config_file)
+    # Empty cells become None rather than NaN, so the config round-trips through JSON
+    config_df = config_df.astype(object).where(config_df.notna(), None)
+    return config_df.set_index('Product').to_dict('index')
+
+
+def read_config(config_file=DEFAULT_CONFIG_FILE):
+    """Reads product-to-account mapping from an Excel file.
+
+    The workbook is parsed once per change: the result is kept in memory for Streamlit reruns and
+    in a JSON file next to it (product_configs.cache.json) for new processes, both keyed by the
+    workbook's mtime and size, so pandas and openpyxl are only loaded after the workbook is edited.
+    """
+    signature = _config_signature(config_file)
+    cached = _config_cache.get(config_file)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    cache_file = os.path.splitext(config_file)[0] + '.cache.json'
+    try:
+        with open(cache_file) as f:
+            data = json.load(f)
+        config = data['config'] if data['signature'] == signature else None
+    except (OSError, ValueError, KeyError):
+        config = None
+    if config is None:
+        config = _parse_config(config_file)
+        try:
+            with open(cache_file + '.tmp', 'w') as f:
+                json.dump({'signature': signature, 'config': config}, f, indent=1, default=str)
+            os.replace(cache_file + '.tmp', cache_file)
+        except OSError:
+            pass  # A read-only folder only costs the next process a parse
+    _config_cache[config_file] = (signature, config)
+    return config
+
+
+def account_id_for(product_config):
+    """Returns the product's AWS account ID without the quotes the workbook stores it with."""
+    return str(product_config['AccountId']).replace('"', "")
+
+
+def fetch_product_credentials(account_id):
+    """Returns cached credentials for the account, asking the broker or Chrome SSO when they are missing or stale."""
+    return get_cached_credentials(account_id, credential_provider(fetch_credentials_via_selenium))
+
+
+def product_location(product_config, s3_path=None):
+    """Returns (bucket_name, folder_path, s3_path_given) for an s3://bucket/folder/ path, or the product's folder."""
+    if s3_path:
+        return s3_path.split("/", 3)[-2], s3_path.split("/", 3)[-1], True
+    return product_config['BucketName'], product_config['FolderPath'], False
+
+
+def default_download_folder(product):
+    """Returns a new folder name made of the product's first word and the current date and time."""
+    return product.split()[0] + "_" + datetime.now().strftime("%Y%m%d_%H%M%S")
+
+
+def iter_product_files(product, product_config, s3_client, start_date=None, end_date=None, matching_text=None,
+                       exact_names=None, file_types=None, s3_path=None, max_workers=DEFAULT_CONCURRENCY,
+                       use_listing_index=False, counts=None, cancel=None, log=print, metrics=None):
+    """Yields the listing entries of a product's files that match the criteria, as the listing arrives.
+
+    The criteria given are combined (a date window, partial text, exact names, file types); with
+    none, every file in the folder matches. Exact names are looked up one by one in S3 (see
+    iter_s3_objects_by_name); otherwise the listing comes from the local index when
+    use_listing_index is set, or from S3, where date ranges list only the matching date prefixes
+    and anything else lists the folder page by page. counts, if given, receives the 'listed' and
+    'matched' totals so far; setting the threading.Event cancel stops the listing. With a metrics.RunMetrics, the time spent
+    waiting on the listing and in the filter is added to its 'listing' and 'filtering' phases.
+    """
+    bucket_name, folder_path, s3_path_given = product_location(product_config, s3_path)
+    date_range = start_date is not None or end_date is not None
+    date_format = date_format_for_product(product, product_config)
+    if date_range and not date_format:
+        raise ValueError(f"No DatePattern configured for {product} in {DEFAULT_CONFIG_FILE}")
+    matches = compile_filter(start_date=start_date, end_date=end_date, date_format=date_format,
+                             require_text="transaction" if date_range and not s3_path_given else None,
+                             matching_text=matching_text, exact_names=exact_names, file_types=file_types)
+    if counts is None:
+        counts = {}
+    if metrics is None:
+        metrics = RunMetrics()
+    matches = metrics.timed_calls(matches, 'filtering')
+
+    def generate():
+        listing_index = None
+        try:
+            if exact_names:
+                # A few direct lookups beat even an incremental index refresh
+                all_files = iter_s3_objects_by_name(bucket_name, folder_path, s3_client, exact_names, max_workers)
+            elif use_listing_index:
+                listing_index = open_listing_index(bucket_name, folder_path, date_format=date_format)
+                with metrics.phase('listing'):
+                    fetched = refresh_listing_index(listing_index, bucket_name, folder_path, s3_client,
+                                                    max_workers=max_workers)
+                log(f"Listing index refreshed ({fetched} new entries)")
+                all_files = iter_indexed_objects(listing_index)
+            elif date_range:
+                all_files = iter_s3_objects_by_date(bucket_name, folder_path, s3_client, start_date, end_date,
+                                                    date_format, max_workers)
+            else:
+                all_files = iter_s3_objects(bucket_name, folder_path, s3_client)
+            all_files = metrics.timed(all_files, 'listing')
+            if cancel is not None:
+                all_files = stop_when(cancel, all_files)
+            all_files = count_items(all_files, counts, 'listed')
+            yield from count_items(filter(matches, all_files), counts, 'matched')
+        finally:
+            if listing_index:
+                listing_index.close()
+    return generate()
+
+
+def run_download(product, product_config, local_folder, s3_client, start_date=None, end_date=None,
+                 matching_text=None, exact_names=None, file_types=None, s3_path=None,
+                 max_workers=DEFAULT_CONCURRENCY, sync=False, resume=False, use_listing_index=False,
+                 on_result=None, log=print, executor=None, download=download_files_concurrently, counts=None,
+                 stats=None, cancel=None, largest_first=False, use_cache=False, metrics=None):
+    """Lists, filters and downloads one product's files into local_folder and returns the run stats.
+
+    Files are selected as in iter_product_files. resume retries only what the folder's manifest
+    has unfinished, without listing S3. The stats are download_files_concurrently's plus 'listed'
+    and 'matched' key counts. log receives progress lines, on_result each file's outcome.
+    A shared executor caps requests across concurrent runs, see run_products. download swaps in
+    another backend with download_files_concurrently's signature, e.g. s3_async.async_downloader.
+
+    To follow a run from another thread, pass dicts as counts (listed/matched so far) and stats
+    (the download counts so far); setting the threading.Event cancel stops listing and submitting
+    files, lets the requests in flight finish and returns the stats so far.
+
+    largest_first waits for the whole listing, then downloads the biggest files first with the
+    small ones batched (see order_largest_first). Before starting it logs the total size and,
+    after an earlier run from the same bucket, an estimated time; counts gets 'planned_bytes'.
+
+    use_cache serves files downloaded by earlier runs on this machine from the shared
+    object_cache.ObjectCache instead of S3, and adds new downloads to it.
+
+    The stats also get 'metrics', the RunMetrics summary of the run: time spent listing, filtering
+    and transferring, S3 requests by operation, and object latency percentiles. Pass metrics to
+    have phases timed by the caller, such as fetching credentials, included in it.
+    """
+    bucket_name = product_location(product_config, s3_path)[0]
+    if counts is None:
+        counts = {}
+    if metrics is None:
+        metrics = RunMetrics()
+    if not resume:
+        files = iter_product_files(product, product_config, s3_client, start_date, end_date, matching_text,
+                                   exact_names, file_types, s3_path, max_workers, use_listing_index, counts,
+                                   cancel, log, metrics)
+
+    os.makedirs(local_folder, exist_ok=True)
+    # The manifest records each file's progress, so reruns into this folder skip finished files
+    manifest = DownloadManifest(local_folder)
+    cache = ObjectCache() if use_cache else None
+    if resume:
+        files = metrics.timed(manifest.iter_unfinished(), 'listing')
+        if cancel is not None:
+            files = stop_when(cancel, files)
+        files = count_items(count_items(files, counts, 'listed'), counts, 'matched')
+    try:
+        with metrics.count_requests(s3_client), metrics.phase('download'):
+            if largest_first:
+                log("Listing and filtering files...")
+                queued = order_largest_first(files)
+                plan = summarize_files(queued)
+                counts['planned_bytes'] = plan['bytes']
+                log(preflight_message(plan, _recent_throughput.get(bucket_name)))
+                if cancel is not None:
+                    queued = stop_when(cancel, queued)
+            else:
+                # Files are filtered as each page arrives, so downloads start after the first page
+                log("Listing, filtering and downloading files...")
+                queued = files
+            stats = download(queued, bucket_name, local_folder, s3_client, max_workers, on_result=on_result,
+                             manifest=manifest, sync=sync, executor=executor, stats=stats,
+                             batch_small_files=largest_first, cache=cache)
+    finally:
+        manifest.close()
+        if cache is not None:
+            cache.close()
+        files.close()
+    if stats['bytes'] and stats.get('throughput_mb_s'):
+        _recent_throughput[bucket_name] = stats['throughput_mb_s']
+    stats.update(counts)
+    stats['metrics'] = metrics.summary(stats)
+    return stats
+
+
+def preflight_message(plan, throughput_mb_s=None):
+    """Describes a planned download (from summarize_files) before it starts, with an ETA when a speed is known."""
+    message = (f"{plan['files']} files, {plan['bytes'] / 1e6:.1f} MB to download "
+               f"(largest {plan['largest_bytes'] / 1e6:.1f} MB)")
+    if throughput_mb_s:
+        message += f", about {plan['bytes'] / 1e6 / throughput_mb_s:.0f}s at the last run's {throughput_mb_s:.1f} MB/s"
+    return message
+
+
+def run_products(products, config, local_folder, max_workers=DEFAULT_CONCURRENCY, on_result=None, log=print,
+                 progress=None, cancel=None, **criteria):
+    """Downloads several products at once, each into a subfolder of local_folder named after it ('FNBO_Prod').
+
+    Credentials are fetched one account at a time first (the SSO fallback drives a single Chrome
+    profile), then every product lists and filters in its own thread while all their downloads share
+    one pool of max_workers, so the whole run never has more than max_workers requests in flight and
+    takes about as long as the slowest product. criteria are passed to run_download for every product.
+
+    log(product, message) and on_result(product, key, error) are called on the calling thread.
+    With a progress dict, progress[product] holds the (counts, stats) dicts run_download fills in
+    as it goes; cancel stops every product, as in run_download.
+    Returns {product: stats}; a product that failed outright has only an 'error' entry. Each
+    product's 'metrics' include the time it spent fetching credentials.
+    """
+    results = {}
+    clients = {}
+    metrics = {}
+    try:
+        # With a broker, a cold start harvests every account in one pass rather than one each
+        prefetch_credentials({account_id_for(config[product]) for product in products})
+    except OSError as e:
+        print(f"Could not prefetch credentials from the broker: {e}")
+    for product in products:
+        account_id = account_id_for(config[product])
+        metrics[product] = RunMetrics()
+        try:
+            log(product, "Fetching credentials...")
+            with metrics[product].phase('credentials'):
+                credentials = fetch_product_credentials(account_id)
+            clients[product] = create_s3_client(*credentials, max_workers=max_workers, max_attempts=1)
+        except Exception as e:
+            results[product] = {'error': str(e)}
+
+    events = queue.Queue()
+    if progress is None:
+        progress = {}
+    for product in clients:
+        progress[product] = ({}, {})
+
+    def run(product):
+        counts, stats = progress[product]
+        try:
+            return run_download(product, config[product], os.path.join(local_folder, product.replace(' ', '_')),
+                                clients[product], max_workers=max_workers,
+                                on_result=lambda key, error: events.put((product, 'result', (key, error))),
+                                log=lambda message: events.put((product, 'log', message)), executor=executor,
+                                counts=counts, stats=stats, cancel=cancel, metrics=metrics[product], **criteria)
+        finally:
+            events.put((product, 'done', None))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            ThreadPoolExecutor(max_workers=len(clients) or 1) as product_executor:
+        futures = {product: product_executor.submit(run, product) for product in clients}
+        running = len(futures)
+        while running:
+            product, kind, payload = events.get()
+            if kind == 'done':
+                running -= 1
+            elif kind == 'log':
+                log(product, payload)
+            elif on_result:
+                on_result(product, *payload)
+
+    for product, future in futures.items():
+        try:
+            results[product] = future.result()
+        except Exception as e:
+            if is_credential_error(e):
+                invalidate_credentials(account_id_for(config[product]))
+            results[product] = {'error': str(e)}
+    return results
@@ -0,0 +1,155 @@
+import re
+from functools import lru_cache
+
+
+# Date pattern meaning "use the object's S3 LastModified date" for files whose names carry no date.
+LAST_MODIFIED = 'LastModified'
+
+# Regex for each date directive allowed in filename date formats.
+_DIRECTIVE_PATTERNS = {'%Y': r'(?P<Y>\d{4})', '%m': r'(?P<m>\d{2})', '%d': r'(?P<d>\d{2})'}
+
+_DAYS_IN_MONTH = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def date_format_regex(date_format):
+    """Translates a strftime date format using %Y, %m and %d into a regex anchored at the end of a name."""
+    parts = re.split(r'(%.)', date_format)
+    for part in parts:
+        if part.startswith('%') and len(part) == 2 and part not in _DIRECTIVE_PATTERNS:
+            raise ValueError(f"Unsupported directive {part} in date pattern {date_format!r}, use %Y, %m and %d")
+    return ''.join(_DIRECTIVE_PATTERNS.get(part) or re.escape(part) for part in parts) + '$'
+
+
+@lru_cache(maxsize=None)
+def compile_date_extractor(date_format):
+    """Compiles a filename date format into a function returning a file name's date as a YYYYMMDD int, or None.
+
+    Like the original strptime-based filter, the date is read from the end of the name before its
+    first dot, but each key costs one precompiled regex search and a little integer arithmetic.
+    Extractors are cached, so each product's pattern is compiled once per process.
+    """
+    search = re.compile(date_format_regex(date_format)).search
+
+    def extract(file_name):
+        match = search(file_name.split('.', 1)[0])
+        if match is None:
+            return None
+        year, month, day = int(match['Y']), int(match['m']), int(match['d'])
+        if not 1 <= month <= 12 or not 1 <= day <= _DAYS_IN_MONTH[month]:
+            return None
+        if month == 2 and day == 29 and (year % 4 or (year % 100 == 0 and year % 400)):
+            return None
+        return year * 10000 + month * 100 + day
+    return extract
+
+
+def _date_int(value):
+    return value.year * 10000 + value.month * 100 + value.day
+
+
+def last_modified_date(file):
+    """Returns a listing entry's LastModified date as a YYYYMMDD int, or None if it has none.
+
+    Accepts the datetime boto3 returns as well as the ISO string stored by the listing index.
+    """
+    value = file.get('LastModified')
+    if not value:
+        return None
+    if isinstance(value, str):
+        return int(value[0:4] + value[5:7] + value[8:10])
+    return _date_int(value)
+
+
+def _parse_names(exact_names):
+    return frozenset(name.strip() for name in exact_names.split(",") if name.strip())
+
+
+def compile_filter(start_date=None, end_date=None, date_format=None, require_text=None, matching_text=None,
+                   exact_names=None, file_types=None, skip_folders=True):
+    """Compiles the chosen criteria into one predicate over listing entries, evaluated in a single pass.
+
+    Every criterion given must hold (the same as intersecting the per-criterion filters):
+    - start_date/end_date: the filename date, read with date_format, lies in the window.
+      date_format LAST_MODIFIED uses the entry's LastModified date instead.
+      Without a date_format no file matches a date window.
+    - require_text / matching_text: substring of the file name.
+    - exact_names: comma separated names, matched with or without extension, via a hash set.
+    - file_types: allowed extensions, e.g. ['txt', 'json'].
+    skip_folders drops the zero-byte 'folder/' marker keys.
+    """
+    checks = []
+    in_window = None
+    if start_date is not None or end_date is not None:
+        if date_format is None:
+            return lambda file: False
+        low = _date_int(start_date) if start_date is not None else 0
+        high = _date_int(end_date) if end_date is not None else 99999999
+        if date_format == LAST_MODIFIED:
+            def in_window(file, file_name):
+                file_date = last_modified_date(file)
+                return file_date is not None and low <= file_date <= high
+        else:
+            extract = compile_date_extractor(date_format)
+
+            def in_window(file, file_name):
+                file_date = extract(file_name)
+                return file_date is not None and low <= file_date <= high
+    for text in (require_text, matching_text and matching_text.strip()):
+        if text:
+            checks.append(lambda file_name, text=text: text in file_name)
+    if exact_names:
+        names = _parse_names(exact_names)
+        checks.append(lambda file_name: file_name in names or file_name.split('.', 1)[0] in names)
+    if file_types:
+        types = frozenset(file_types)
+        checks.append(lambda file_name: file_name.rsplit('.', 1)[-1] in types)
+
+    def matches(file):
+        key = file['Key']
+        if skip_folders and key.endswith('/'):
+            return False
+        file_name = key[key.rfind('/') + 1:]
+        if in_window is not None and not in_window(file, file_name):
+            return False
+        for check in checks:
+            if not check(file_name):
+                return False
+        return True
+    return matches
+
+
+def filter_keys_vectorized(keys, start_date=None, end_date=None, date_format=None, require_text=None,
+                           matching_text=None, exact_names=None, file_types=None, skip_folders=True):
+    """Applies the same criteria as compile_filter to a whole list of keys at once with pandas string ops.
+
+    Worth it for large in-memory key lists (e.g. from the listing index); streaming pipelines should
+    use compile_filter instead. Returns the matching keys in their original order.
+    Keys carry no LastModified, so a LAST_MODIFIED date window needs compile_filter.
+    """
+    import pandas as pd
+
+    keys = pd.Series(keys, dtype=object)
+    names = keys.str.rsplit('/', n=1).str[-1]
+    mask = pd.Series(True, index=keys.index)
+    if skip_folders:
+        mask &= ~keys.str.endswith('/')
+    if start_date is not None or end_date is not None:
+        if date_format is None:
+            return []
+        if date_format == LAST_MODIFIED:
+            raise ValueError("Filtering by LastModified needs listing entries, use compile_filter")
+        parts = names.str.split('.', n=1).str[0].str.extract(date_format_regex(date_format))
+        file_dates = pd.to_datetime(parts['Y'] + parts['m'] + parts['d'], format='%Y%m%d', errors='coerce')
+        if start_date is not None:
+            mask &= file_dates >= pd.Timestamp(start_date)
+        if end_date is not None:
+            mask &= file_dates <= pd.Timestamp(end_date)
+    for text in (require_text, matching_text and matching_text.strip()):
+        if text:
+            mask &= names.str.contains(text, regex=False)
+    if exact_names:
+        names_set = _parse_names(exact_names)
+        mask &= names.isin(names_set) | names.str.split('.', n=1).str[0].isin(names_set)
+    if file_types:
+        mask &= names.str.rsplit('.', n=1).str[-1].isin(list(file_types))
+    return keys[mask].tolist()
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import deque
+
+
+# Recent files and errors kept per job for the UI.
+LOG_SIZE = 200
+
+
+class DownloadJob:
+    """A download running on a background thread, with a compact progress snapshot the UI can poll.
+
+    run(job) does the work on the thread. It passes job.section(name) (a (counts, stats) pair) to
+    run_download or run_products to have their live counts show up in job.progress(), reports
+    files with job.on_result and messages with job.add_log, and stops early once job.cancelled is set.
+    Nothing here touches Streamlit, so a job keeps running while the user moves on to other widgets.
+    """
+
+    def __init__(self, name, run, log_size=LOG_SIZE):
+        self.name = name
+        self.cancelled = threading.Event()
+        self.sections = {}
+        self.log = deque(maxlen=log_size)
+        # Files the job produced for the user to take away, such as archives
+        self.artifacts = []
+        self.status = 'running'
+        self.result = None
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.thread = threading.Thread(target=self._run, args=(run,), name=f"download-{name}", daemon=True)
+        self.thread.start()
+
+    def _run(self, run):
+        try:
+            self.result = run(self)
+            self.status = 'cancelled' if self.cancelled.is_set() else 'done'
+        except Exception as e:
+            self.error = e
+            self.status = 'failed'
+            self.add_log(f"Error: {e}")
+        finally:
+            self.finished = time.time()
+
+    @property
+    def running(self):
+        return self.status == 'running'
+
+    def section(self, name):
+        """Returns the (counts, stats) dicts a run fills in for the part of the job called name."""
+        return self.sections.setdefault(name, ({}, {}))
+
+    def add_log(self, message):
+        self.log.append(f"{time.strftime('%H:%M:%S')} {message}")
+
+    def on_result(self, key, error):
+        if error is None:
+            self.add_log(f"Downloaded: {key}")
+        else:
+            self.add_log(f"Failed: {key} ({error})")
+
+    def cancel(self):
+        self.cancelled.set()
+        self.add_log("Cancelling, waiting for the files in flight...")
+
+    def progress(self):
+        """Totals over all sections: files done, failed, skipped and matched so far, bytes, retries, MB/s and ETA."""
+        totals = {'listed': 0, 'matched': 0, 'downloaded': 0, 'skipped': 0, 'failed': 0, 'bytes': 0, 'retries': 0,
+                  'planned_bytes': 0, 'skipped_bytes': 0, 'cache_hits': 0, 'cache_bytes_saved': 0}
+        for counts, stats in list(self.sections.values()):
+            totals['listed'] += counts.get('listed', 0)
+            totals['matched'] += counts.get('matched', 0)
+            totals['planned_bytes'] += counts.get('planned_bytes', 0)
+            totals['downloaded'] += stats.get('downloaded', 0)
+            totals['skipped'] += stats.get('skipped', 0)
+            totals['failed'] += len(stats.get('failed', ()))
+            totals['bytes'] += stats.get('bytes', 0)
+            totals['skipped_bytes'] += stats.get('skipped_bytes', 0)
+            totals['retries'] += stats.get('retries', 0)
+            totals['cache_hits'] += stats.get('cache_hits', 0)
+            totals['cache_bytes_saved'] += stats.get('cache_bytes_saved', 0)
+        elapsed = (self.finished or time.time()) - self.started
+        done = totals['downloaded'] + totals['skipped'] + totals['failed']
+        totals['done'] = done
+        totals['seconds'] = elapsed
+        totals['throughput_mb_s'] = totals['bytes'] / 1e6 / elapsed if elapsed else 0.0
+        # While the listing is still running the matched count grows, so this ETA is a lower bound.
+        # Planned runs know their total size up front and estimate by bytes instead.
+        if totals['planned_bytes']:
+            rate = totals['bytes'] / elapsed if elapsed else 0
+            remaining = totals['planned_bytes'] - totals['bytes'] - totals['skipped_bytes']
+        else:
+            rate = totals['downloaded'] / elapsed if elapsed else 0
+            remaining = totals['matched'] - done
+        totals['eta_seconds'] = remaining / rate if self.running and rate and remaining > 0 else None
+        return totals
+
+    def run_metrics(self):
+        """Returns {section: metrics summary} for the sections whose run has finished."""
+        return {name: stats['metrics'] for name, (counts, stats) in list(self.sections.items()) if 'metrics' in stats}
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import takewhile
+
+from filters import LAST_MODIFIED
+from s3_engine import _MAX_KEY_CHAR, DEFAULT_CONCURRENCY, _name_stem, iter_s3_objects
+
+
+INDEX_DIR = os.environ.get('S3_DOWNLOADER_INDEX_DIR',
+                           os.path.join(os.path.expanduser('~'), '.s3_downloader', 'index'))
+
+# Re-list the whole prefix at least this often to pick up deletions and overwrites.
+FULL_SYNC_INTERVAL = 6 * 3600
+
+# Above this many filename stems, incremental refreshes only look past the last indexed key.
+MAX_INCREMENTAL_STEMS = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    key TEXT PRIMARY KEY,
+    stem TEXT NOT NULL,
+    size INTEGER,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE INDEX IF NOT EXISTS objects_stem ON objects (stem);
+CREATE TABLE IF NOT EXISTS sync_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last_full_sync REAL,
+    last_refresh REAL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    date_format TEXT
+);
+"""
+
+
+def _date_format(conn):
+    """Returns the filename date format the index's stems are derived with, or None for none."""
+    row = conn.execute("SELECT date_format FROM settings").fetchone()
+    if row is None or not row[0] or row[0] == LAST_MODIFIED or '%Y' not in row[0]:
+        return None
+    return row[0]
+
+
+def _key_stem(key, date_format, folder_path):
+    """Returns the key up to its filename date (see s3_engine._name_stem), or folder_path for undated keys.
+
+    Files of one family, e.g. '.../hil_transaction_<date>.txt', share a stem and sit in one
+    contiguous key range; 'hil_transaction_2_<date>.txt' is a family of its own.
+    """
+    if date_format is None:
+        return folder_path
+    date_length = len(datetime(2000, 1, 1).strftime(date_format))
+    return _name_stem(key, date_format, date_length) or folder_path
+
+
+def open_listing_index(bucket_name, folder_path, index_dir=INDEX_DIR, date_format=None):
+    """Opens, creating if needed, the on-disk listing index for one bucket and folder.
+
+    date_format is the product's filename date pattern, which splits the keys into the filename
+    families listed separately by incremental refreshes. An index built with another pattern is
+    emptied, so the next refresh lists the folder in full.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    digest = hashlib.sha1(f"{bucket_name}/{folder_path}".encode()).hexdigest()[:16]
+    conn = sqlite3.connect(os.path.join(index_dir, f"{bucket_name}_{digest}.sqlite"))
+    conn.executescript(_SCHEMA)
+    row = conn.execute("SELECT date_format FROM settings").fetchone()
+    if row is None or row[0] != date_format:
+        with conn:
+            conn.execute("DELETE FROM objects")
+            conn.execute("DELETE FROM sync_state")
+            conn.execute("INSERT OR REPLACE INTO settings (id, date_format) VALUES (1, ?)", (date_format,))
+    return conn
+
+
+def _store(conn, objects, folder_path):
+    """Inserts or updates listing entries, returning how many were stored."""
+    date_format = _date_format(conn)
+    rows = ((obj['Key'], _key_stem(obj['Key'], date_format, folder_path), obj.get('Size'), obj.get('ETag'),
+             obj['LastModified'].isoformat() if obj.get('LastModified') else None) for obj in objects)
+    before = conn.total_changes
+    conn.executemany("INSERT OR REPLACE INTO objects (key, stem, size, etag, last_modified) VALUES (?, ?, ?, ?, ?)",
+                     rows)
+    return conn.total_changes - before
+
+
+def refresh_listing_index(conn, bucket_name, folder_path, s3_client, full_sync_interval=FULL_SYNC_INTERVAL,
+                          force_full=False, max_workers=DEFAULT_CONCURRENCY):
+    """Brings the index up to date with S3 and returns the number of listing entries fetched.
+
+    Incremental refreshes list each filename stem with StartAfter its largest indexed key, up to
+    the stem's dates in the next year, plus everything after the largest key overall, so only
+    files appended since the last refresh are fetched. Stems come from the date format the index
+    was opened with; without one only the tail after the largest key is listed. Every
+    full_sync_interval seconds (or when force_full is set) the whole folder is re-listed in one
+    transaction to reconcile deletions, overwrites and out-of-order keys.
+    """
+    state = conn.execute("SELECT last_full_sync FROM sync_state").fetchone()
+    now = time.time()
+    full = force_full or state is None or now - state[0] >= full_sync_interval
+
+    with conn:
+        if full:
+            conn.execute("DELETE FROM objects")
+            fetched = _store(conn, iter_s3_objects(bucket_name, folder_path, s3_client), folder_path)
+            conn.execute("INSERT OR REPLACE INTO sync_state (id, last_full_sync, last_refresh) VALUES (1, ?, ?)",
+                         (now, now))
+            return fetched
+
+        last_keys = conn.execute("SELECT stem, MAX(key) FROM objects WHERE stem != ? GROUP BY stem",
+                                 (folder_path,)).fetchall()
+        tail = (folder_path, conn.execute("SELECT MAX(key) FROM objects").fetchone()[0])
+        starts = last_keys + [tail] if len(last_keys) <= MAX_INCREMENTAL_STEMS else [tail]
+        date_format = _date_format(conn)
+
+        def list_after(start):
+            stem, last_key = start
+            listing = iter_s3_objects(bucket_name, stem, s3_client, start_after=last_key)
+            if stem == folder_path:
+                return list(listing)
+            # A sibling family sharing the prefix ('stem2_<date>') sorts after the stem's dates; stop there
+            next_year = datetime(datetime.now().year + 1, 1, 1)
+            end = stem + next_year.strftime(date_format[:date_format.find('%Y') + 2]) + _MAX_KEY_CHAR
+            return list(takewhile(lambda obj: obj['Key'] <= end, listing))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # The tail listing overlaps the last stem's, count each key once
+            objects = {obj['Key']: obj for listing in executor.map(list_after, starts) for obj in listing}
+        fetched = _store(conn, objects.values(), folder_path)
+        conn.execute("UPDATE sync_state SET last_refresh = ?", (now,))
+    return fetched
+
+
+def iter_indexed_objects(conn):
+    """Yields indexed listing entries in key order, shaped like ListObjectsV2 Contents.
+
+    Size, ETag and LastModified are as of the refresh that indexed the key, which may be up to
+    FULL_SYNC_INTERVAL old; entries are marked Indexed so downloads confirm them with a HEAD
+    before relying on them.
+    """
+    for key, size, etag, last_modified in conn.execute(
+            "SELECT key, size, etag, last_modified FROM objects ORDER BY key"):
+        yield {'Key': key, 'Size': size, 'ETag': etag, 'LastModified': last_modified, 'Indexed': True}
+
+
+def iter_indexed_files(conn):
+    """Yields indexed keys in key order."""
+    for (key,) in conn.execute("SELECT key FROM objects ORDER BY key"):
+        yield key
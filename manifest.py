@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import time
+
+
+MANIFEST_NAME = '.s3_download_manifest.sqlite'
+
+# Progress is committed at least this often, so a crash loses at most a few seconds of work.
+COMMIT_INTERVAL = 2.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    key TEXT PRIMARY KEY,
+    bucket TEXT NOT NULL,
+    size INTEGER,
+    etag TEXT,
+    local_path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    bytes_done INTEGER NOT NULL DEFAULT 0,
+    part_size INTEGER,
+    parts_done TEXT NOT NULL DEFAULT '',
+    error TEXT
+);
+"""
+
+
+class DownloadManifest:
+    """Per-folder record of every file a run set out to download and how far it got.
+
+    Statuses are 'pending', 'done' and 'failed'. Large files also record which byte-range
+    parts are complete, so a rerun into the same folder resumes them instead of starting over.
+    Only the thread running the download loop writes to it.
+    """
+
+    def __init__(self, local_folder):
+        os.makedirs(local_folder, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(local_folder, MANIFEST_NAME))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        self.last_commit = time.monotonic()
+
+    def _maybe_commit(self):
+        if time.monotonic() - self.last_commit >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.last_commit = time.monotonic()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT bucket, size, etag, local_path, status, bytes_done, part_size, parts_done "
+                                "FROM files WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        bucket, size, etag, local_path, status, bytes_done, part_size, parts_done = row
+        return {'bucket': bucket, 'size': size, 'etag': etag, 'local_path': local_path, 'status': status,
+                'bytes_done': bytes_done, 'part_size': part_size,
+                'parts_done': {int(part) for part in parts_done.split(',') if part}}
+
+    def is_complete(self, key, size, etag, local_file_path):
+        """True if key was finished by an earlier run and the local copy still matches the listing."""
+        entry = self.get(key)
+        return (entry is not None and entry['status'] == 'done'
+                and (size is None or entry['size'] == size) and (etag is None or entry['etag'] == etag)
+                and os.path.exists(local_file_path) and os.path.getsize(local_file_path) == entry['size'])
+
+    def start(self, bucket, key, size, etag, local_file_path, part_size=None):
+        self.conn.execute("INSERT OR REPLACE INTO files (key, bucket, size, etag, local_path, status, part_size) "
+                          "VALUES (?, ?, ?, ?, ?, 'pending', ?)", (key, bucket, size, etag, local_file_path, part_size))
+        self._maybe_commit()
+
+    def part_done(self, key, index, written):
+        self.conn.execute("UPDATE files SET bytes_done = bytes_done + ?, parts_done = parts_done || ? || ',' "
+                          "WHERE key = ?", (written, index, key))
+        self._maybe_commit()
+
+    def finish(self, key, written, error=None):
+        if error is None:
+            self.conn.execute("UPDATE files SET status = 'done', bytes_done = ?, error = NULL WHERE key = ?",
+                              (written, key))
+        else:
+            self.conn.execute("UPDATE files SET status = 'failed', error = ? WHERE key = ?", (str(error), key))
+        self._maybe_commit()
+
+    def iter_unfinished(self):
+        """Returns an iterator of listing entries (Key, Size, ETag) for files not yet downloaded, for resuming.
+
+        The query runs right away, so the iterator can be consumed from another thread (as the
+        async backend does) while the connection stays with the thread that opened it.
+        """
+        rows = self.conn.execute("SELECT key, size, etag FROM files WHERE status != 'done' ORDER BY key").fetchall()
+        return iter([{'Key': key, 'Size': size, 'ETag': etag} for key, size, etag in rows])
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
+
+    def close(self):
+        self.commit()
+        self.conn.close()
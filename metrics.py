@@ -0,0 +1,201 @@
+"""Per-phase timings and S3 request counts for a download run, exportable as JSON lines or Prometheus text.
+
+    metrics = RunMetrics()
+    with metrics.phase('credentials'):
+        credentials = fetch_product_credentials(account_id)
+    stats = run_download(..., metrics=metrics)     # adds listing, filtering and transfer
+    print(to_prometheus({product: stats['metrics']}))
+
+Listing, filtering and transfer overlap in the streamed pipeline, so listing is the time the
+download loop spent waiting for listing pages, filtering the time spent in the filter, and
+transfer the rest of the download call.
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+# Object latencies kept per run for the percentiles; beyond this a uniform sample is kept.
+LATENCY_SAMPLE_SIZE = 10000
+
+PROMETHEUS_PREFIX = 's3_downloader'
+
+
+class LatencySample:
+    """A bounded uniform sample (reservoir) of latencies in seconds, for percentiles over runs of any size."""
+
+    def __init__(self, size=LATENCY_SAMPLE_SIZE):
+        self.size = size
+        self.values = []
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, value):
+        with self.lock:
+            self.count += 1
+            if len(self.values) < self.size:
+                self.values.append(value)
+            else:
+                index = random.randrange(self.count)
+                if index < self.size:
+                    self.values[index] = value
+
+    def percentile(self, p):
+        """Returns the p-th percentile (0-100) in seconds, or None before any value was added."""
+        with self.lock:
+            values = sorted(self.values)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+class RunMetrics:
+    """Collects one run's phase timings and request counts; summary() combines them with the run stats."""
+
+    def __init__(self):
+        self.phases = {}
+        self.requests = Counter()
+        self.request_errors = Counter()
+        self.started = time.perf_counter()
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        """Adds the time spent in the with block to the phase called name."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def timed_calls(self, func, name):
+        """Returns func wrapped to add the time spent in each call to the phase called name."""
+        def timed_func(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add_time(name, time.perf_counter() - started)
+        return timed_func
+
+    def timed(self, items, name):
+        """Yields items unchanged, adding the time spent waiting for each one to the phase called name."""
+        items = iter(items)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - started)
+                return
+            self.add_time(name, time.perf_counter() - started)
+            yield item
+
+    @contextmanager
+    def count_requests(self, s3_client):
+        """Counts the requests s3_client makes by operation (ListObjectsV2 calls are the pages listed).
+
+        Error responses (404, SlowDown, 500...) and requests that got no response at all both
+        count in request_errors.
+        """
+        # The event name ends in the operation, e.g. after-call-error.s3.GetObject; botocore
+        # passes no model to after-call-error, and an exception raised here would replace the
+        # request's own error (and so its retry)
+        def after_call(event_name, http_response, **kwargs):
+            operation = event_name.rsplit('.', 1)[-1]
+            self.requests[operation] += 1
+            if http_response.status_code >= 300:
+                self.request_errors[operation] += 1
+
+        def after_error(event_name, **kwargs):
+            operation = event_name.rsplit('.', 1)[-1]
+            self.requests[operation] += 1
+            self.request_errors[operation] += 1
+
+        events = s3_client.meta.events
+        events.register('after-call.s3', after_call)
+        events.register('after-call-error.s3', after_error)
+        try:
+            yield
+        finally:
+            events.unregister('after-call.s3', after_call)
+            events.unregister('after-call-error.s3', after_error)
+
+    def summary(self, stats=None):
+        """Returns the phases in seconds and request counts, with the key, file, byte, retry and latency stats."""
+        stats = stats or {}
+        phases = dict(self.phases)
+        if 'download' in phases:
+            # The download call includes the listing and filtering it pulled through
+            download = phases.pop('download')
+            phases['transfer'] = max(0.0, download - phases.get('listing', 0.0) - phases.get('filtering', 0.0))
+        phases['total'] = time.perf_counter() - self.started
+        return {
+            'phases': {name: round(seconds, 3) for name, seconds in phases.items()},
+            'requests': dict(self.requests),
+            'request_errors': dict(self.request_errors),
+            'pages_listed': self.requests.get('ListObjectsV2', 0),
+            'listed': stats.get('listed', 0),
+            'matched': stats.get('matched', 0),
+            'files': {'downloaded': stats.get('downloaded', 0), 'skipped': stats.get('skipped', 0),
+                      'failed': len(stats.get('failed', ()))},
+            'bytes': stats.get('bytes', 0),
+            'retries': stats.get('retries', 0),
+            'latency_p50_seconds': _rounded(stats.get('latency_p50_seconds')),
+            'latency_p95_seconds': _rounded(stats.get('latency_p95_seconds')),
+        }
+
+
+def _rounded(seconds):
+    return None if seconds is None else round(seconds, 4)
+
+
+def to_json_line(summary, labels=None):
+    """Returns one JSON line for a run summary, with a timestamp and labels such as the product."""
+    return json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), **(labels or {}), **summary}, default=str)
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_label_value(value)}"' for name, value in labels.items()) + '}'
+
+
+def to_prometheus(summaries):
+    """Returns {product: run summary} in the Prometheus text format, e.g. for node_exporter's textfile collector."""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+        for product, summary in summaries.items():
+            for labels, value in samples(summary):
+                if value is not None:
+                    lines.append(f"{PROMETHEUS_PREFIX}_{name}{_labels(product=product, **labels)} {value}")
+
+    metric('phase_seconds', 'gauge', "Time the last run spent in each phase.",
+           lambda summary: [({'phase': phase}, seconds) for phase, seconds in summary['phases'].items()])
+    metric('requests', 'gauge', "S3 requests made by the last run, by operation.",
+           lambda summary: [({'operation': operation}, count) for operation, count in summary['requests'].items()])
+    metric('request_errors', 'gauge', "S3 requests of the last run that failed, by operation.",
+           lambda summary: [({'operation': operation}, count)
+                            for operation, count in summary['request_errors'].items()])
+    metric('pages_listed', 'gauge', "Listing pages fetched by the last run.",
+           lambda summary: [({}, summary['pages_listed'])])
+    metric('keys', 'gauge', "Keys the last run listed, and of those matched its criteria.",
+           lambda summary: [({'stage': 'listed'}, summary['listed']), ({'stage': 'matched'}, summary['matched'])])
+    metric('files', 'gauge', "Files of the last run, by outcome.",
+           lambda summary: [({'status': status}, count) for status, count in summary['files'].items()])
+    metric('bytes', 'gauge', "Bytes downloaded by the last run.", lambda summary: [({}, summary['bytes'])])
+    metric('retries', 'gauge', "Requests the last run retried.", lambda summary: [({}, summary['retries'])])
+    metric('object_latency_seconds', 'gauge', "Time to download one object in the last run, by quantile.",
+           lambda summary: [({'quantile': '0.5'}, summary['latency_p50_seconds']),
+                            ({'quantile': '0.95'}, summary['latency_p95_seconds'])])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,163 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+
+CACHE_DIR = os.environ.get('S3_DOWNLOADER_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.s3_downloader', 'cache'))
+
+# Least recently used objects are evicted once the cache holds more than this.
+CACHE_MAX_BYTES = int(float(os.environ.get('S3_DOWNLOADER_CACHE_MAX_GB', '20')) * 1e9)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    id TEXT PRIMARY KEY,
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    version TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_last_used ON objects (last_used);
+"""
+
+
+class ObjectCache:
+    """Local copies of downloaded objects, shared by every run on the machine and keyed by bucket, key and version.
+
+    The version is the listing entry's VersionId, or else its ETag, so an overwritten object is
+    never served from an older copy as long as the entry is current (download_files_concurrently
+    confirms listing index entries with a HEAD first); entries with neither are not cached. Output files are hard
+    links to the cached copy where the file system allows it (so they take no extra space and
+    share their contents: save edits under a new name), and copies otherwise. A cached copy whose
+    size or mtime has changed since it was stored is dropped instead of used. Point
+    S3_DOWNLOADER_CACHE_DIR at a shared folder to share the cache between users.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, link=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.link = link
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cache_dir, 'cache.sqlite'), timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        self.lock = threading.Lock()
+        # Kept up to date by this instance; re-read before evicting, as other runs share the cache
+        self.total_bytes = self._stored_bytes()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    def close(self):
+        self.conn.close()
+
+    def _stored_bytes(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def _object_id(self, bucket_name, entry):
+        version = entry.get('VersionId') or entry.get('ETag')
+        if not version or entry.get('Size') is None:
+            return None, None
+        return hashlib.sha1(f"{bucket_name}/{entry['Key']}/{version}".encode()).hexdigest(), version
+
+    def _path(self, object_id):
+        return os.path.join(self.cache_dir, 'objects', object_id[:2], object_id)
+
+    def _place(self, source, target):
+        """Hard links (or copies) source to target through a temporary name, replacing any existing target."""
+        temporary = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if self.link:
+            try:
+                os.link(source, temporary)
+                os.replace(temporary, target)
+                return
+            except OSError:
+                pass
+        shutil.copyfile(source, temporary)
+        os.replace(temporary, target)
+
+    def fetch(self, bucket_name, entry, local_file_path):
+        """Puts the cached copy of a listing entry at local_file_path and returns True, or returns False on a miss."""
+        object_id, _ = self._object_id(bucket_name, entry)
+        if object_id is None:
+            return False
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime FROM objects WHERE id = ?", (object_id,)).fetchone()
+        path = self._path(object_id)
+        try:
+            stat = os.stat(path) if row else None
+        except FileNotFoundError:
+            stat = None
+        if row and (stat is None or stat.st_size != row[0] or stat.st_mtime != row[1] or row[0] != entry['Size']):
+            self._forget(object_id)
+            row = None
+        if row is not None:
+            try:
+                self._place(path, local_file_path)
+            except OSError:
+                # e.g. evicted by another run in the meantime; download it instead
+                row = None
+        if row is None:
+            self.misses += 1
+            return False
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE objects SET last_used = ? WHERE id = ?", (time.time(), object_id))
+        self.hits += 1
+        self.bytes_saved += row[0]
+        return True
+
+    def store(self, bucket_name, entry, local_file_path):
+        """Adds a freshly downloaded file to the cache, then evicts the least recently used objects over max_bytes."""
+        object_id, version = self._object_id(bucket_name, entry)
+        if object_id is None or entry['Size'] > self.max_bytes:
+            return
+        path = self._path(object_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._place(local_file_path, path)
+        now = time.time()
+        with self.lock, self.conn:
+            self.total_bytes += entry['Size']
+            self.conn.execute("INSERT OR REPLACE INTO objects (id, bucket, key, version, size, mtime, last_used) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (object_id, bucket_name, entry['Key'], version, entry['Size'], os.stat(path).st_mtime,
+                               now))
+        self.evict()
+
+    def _forget(self, object_id):
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT size FROM objects WHERE id = ?", (object_id,)).fetchone()
+            if row:
+                self.total_bytes -= row[0]
+                self.conn.execute("DELETE FROM objects WHERE id = ?", (object_id,))
+        try:
+            os.remove(self._path(object_id))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Removes least recently used objects until the cache is within max_bytes."""
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+            total = self.total_bytes = self._stored_bytes()
+            if total <= self.max_bytes:
+                return
+            victims = []
+            for object_id, size in self.conn.execute("SELECT id, size FROM objects ORDER BY last_used"):
+                if total <= self.max_bytes:
+                    break
+                victims.append(object_id)
+                total -= size
+        for object_id in victims:
+            self._forget(object_id)
+        self.evictions += len(victims)
+
+    def stats(self):
+        return {'cache_hits': self.hits, 'cache_misses': self.misses, 'cache_bytes_saved': self.bytes_saved,
+                'cache_evictions': self.evictions}
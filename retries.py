@@ -0,0 +1,147 @@
+"""Retries for S3 requests, and a concurrency cap that backs off when S3 throttles.
+
+    limiter = AdaptiveLimiter(16)
+    body = call_with_retries(limiter, s3_client.get_object, Bucket=bucket_name, Key=key)
+
+Errors are sorted into three kinds: THROTTLED (SlowDown, 503) halves the number of requests
+allowed in flight and is retried, TRANSIENT (dropped connections, timeouts, 500s) is retried,
+anything else (missing keys, access denied, expired credentials) fails the file at once.
+Retries wait a jittered exponential backoff; the cap creeps back up by one each time a full
+round of requests succeeds.
+"""
+import random
+import threading
+import time
+
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+from botocore.exceptions import HTTPClientError, IncompleteReadError
+
+from credentials import is_credential_error
+
+
+THROTTLED = 'throttled'
+TRANSIENT = 'transient'
+FATAL = 'fatal'
+
+# Attempts per request, the first one included.
+MAX_ATTEMPTS = 5
+
+# Backoff before retry n is a random delay up to min(BACKOFF_CAP, BACKOFF_BASE * 2 ** n) seconds.
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 20.0
+
+# Requests already in flight when S3 starts throttling fail together; only one halving per interval.
+DECREASE_INTERVAL = 1.0
+
+THROTTLE_ERROR_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+                        'TooManyRequestsException', 'ServiceUnavailable', '503'}
+TRANSIENT_ERROR_CODES = {'InternalError', 'RequestTimeout', 'RequestTimeoutException', '500', '502', '504'}
+
+_NETWORK_ERRORS = (BotocoreConnectionError, HTTPClientError, IncompleteReadError, ConnectionError, TimeoutError)
+
+
+def classify_error(error):
+    """Returns THROTTLED, TRANSIENT or FATAL for an exception raised by an S3 request."""
+    if isinstance(error, _NETWORK_ERRORS):
+        return TRANSIENT
+    if is_credential_error(error):
+        return FATAL
+    response = getattr(error, 'response', None) or {}
+    code = response.get('Error', {}).get('Code')
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    if code in THROTTLE_ERROR_CODES or status in (429, 503):
+        return THROTTLED
+    if code in TRANSIENT_ERROR_CODES or (status or 0) >= 500:
+        return TRANSIENT
+    return FATAL
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Seconds to wait before retry number attempt (0 for the first retry), with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AdaptiveLimiter:
+    """Caps the requests in flight, halving the cap on throttling and adding one back per round of successes.
+
+    Used as a context manager around each request, from any number of threads. The cap starts at
+    and never goes above max_limit. retries, throttled and lowest_limit are kept for the run stats.
+    """
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = max_limit
+        self.lowest_limit = max_limit
+        self.in_flight = 0
+        self.successes = 0
+        self.retries = 0
+        self.throttled = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def record(self, kind, retrying=False):
+        """Adjusts the cap after a request ended with an error of kind, or None for a success."""
+        with self.condition:
+            if retrying:
+                self.retries += 1
+            if kind == THROTTLED:
+                self.throttled += 1
+                self.successes = 0
+                now = time.monotonic()
+                if now - self.last_decrease >= DECREASE_INTERVAL:
+                    self.last_decrease = now
+                    self.limit = max(self.min_limit, self.limit // 2)
+                    self.lowest_limit = min(self.lowest_limit, self.limit)
+            elif kind is None:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_limit:
+                    self.successes = 0
+                    self.limit += 1
+                    self.condition.notify()
+
+    def stats(self):
+        return {'retries': self.retries, 'throttled': self.throttled, 'concurrency': self.limit,
+                'lowest_concurrency': self.lowest_limit}
+
+
+def call_with_retries(limiter, func, *args, max_attempts=MAX_ATTEMPTS, **kwargs):
+    """Calls func(*args, **kwargs) inside limiter, retrying throttled and transient errors with backoff.
+
+    func must be safe to repeat, e.g. a GET that rewrites its local file from the start.
+    Raises the last error once it is fatal or max_attempts are used up. limiter may be None to
+    retry without a cap.
+    """
+    attempt = 0
+    while True:
+        try:
+            if limiter is None:
+                result = func(*args, **kwargs)
+            else:
+                with limiter:
+                    result = func(*args, **kwargs)
+        except Exception as e:
+            kind = classify_error(e)
+            retrying = kind != FATAL and attempt + 1 < max_attempts
+            if limiter is not None:
+                limiter.record(kind, retrying)
+            if not retrying:
+                raise
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+        else:
+            if limiter is not None:
+                limiter.record(None)
+            return result
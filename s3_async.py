@@ -0,0 +1,228 @@
+"""Optional asyncio backend: the same listing and download interface as s3_engine on one event loop.
+
+Needs aiobotocore (pip install aiobotocore). A thread per request tops out at a few dozen in-flight
+GETs; here each request is a coroutine, so hundreds of tiny objects can be in flight at once.
+
+    download = async_downloader(credentials, max_in_flight=256)
+    stats = download(files, bucket_name, local_folder, None)    # same call and stats as download_files_concurrently
+"""
+import asyncio
+import os
+import threading
+import time
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:
+    get_session = None
+
+from retries import FATAL, MAX_ATTEMPTS, backoff_delay, classify_error
+from s3_engine import _CHUNK_SIZE, _timestamp, is_unchanged
+
+
+DEFAULT_MAX_IN_FLIGHT = 256
+
+# Items handed from a blocking source (e.g. a listing still paging) to the event loop at once.
+_BATCH_SIZE = 256
+_BATCH_SECONDS = 0.05
+
+
+def create_async_s3_client(aws_access_key_id=None, aws_secret_access_key=None, session_token=None,
+                           max_in_flight=DEFAULT_MAX_IN_FLIGHT, endpoint_url=None):
+    """Returns an aiobotocore S3 client, to be entered with `async with`, pooling max_in_flight connections."""
+    if get_session is None:
+        raise ImportError("The async backend needs aiobotocore: pip install aiobotocore")
+    return get_session().create_client('s3',
+                                       aws_access_key_id=aws_access_key_id,
+                                       aws_secret_access_key=aws_secret_access_key,
+                                       aws_session_token=session_token,
+                                       endpoint_url=endpoint_url or os.environ.get('S3_ENDPOINT_URL'),
+                                       config=AioConfig(max_pool_connections=max_in_flight))
+
+
+async def aiter_s3_objects(bucket_name, folder_path, client, start_after=None):
+    """Yields the listing entry of every object under folder_path as each page arrives, like iter_s3_objects."""
+    paginator = client.get_paginator('list_objects_v2')
+    request = {'Bucket': bucket_name, 'Prefix': folder_path}
+    if start_after:
+        request['StartAfter'] = start_after
+    async for page in paginator.paginate(**request):
+        for entry in page.get('Contents', []):
+            yield entry
+
+
+async def _aiter_from_thread(items):
+    """Yields the items of a blocking iterable, pulled on a worker thread so the event loop keeps running."""
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+        return
+    loop = asyncio.get_running_loop()
+    batches = asyncio.Queue(maxsize=4)
+    stopped = threading.Event()
+
+    def put(batch):
+        asyncio.run_coroutine_threadsafe(batches.put(batch), loop).result()
+
+    def produce():
+        batch, flushed = [], time.monotonic()
+        try:
+            for item in items:
+                batch.append(item)
+                if len(batch) >= _BATCH_SIZE or time.monotonic() - flushed >= _BATCH_SECONDS:
+                    put(batch)
+                    if stopped.is_set():
+                        return
+                    batch, flushed = [], time.monotonic()
+            put(batch)
+            put(None)
+        except Exception as e:
+            put(e)
+
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            batch = await batches.get()
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            for item in batch:
+                yield item
+    finally:
+        # Unblock the producer if the consumer stopped early, so the loop can shut down
+        stopped.set()
+        while not batches.empty():
+            batches.get_nowait()
+    await producer
+
+
+async def _download_one_async(client, bucket_name, entry, local_file_path):
+    """Streams a whole object to local_file_path and returns the number of bytes written."""
+    request = {'Bucket': bucket_name, 'Key': entry['Key']}
+    if entry.get('VersionId'):
+        request['VersionId'] = entry['VersionId']
+    response = await client.get_object(**request)
+    written = 0
+    async with response['Body'] as body:
+        with open(local_file_path, 'wb') as f:
+            while chunk := await body.read(_CHUNK_SIZE):
+                f.write(chunk)
+                written += len(chunk)
+    return written
+
+
+async def _confirm_entry(client, bucket_name, entry):
+    """Returns a listing index entry with the object's current Size, ETag and LastModified, like s3_engine._confirmed."""
+    fresh = {name: value for name, value in entry.items() if name not in ('Indexed', 'Size', 'ETag')}
+    try:
+        response = await client.head_object(Bucket=bucket_name, Key=entry['Key'])
+    except Exception:
+        # Fetched with a plain GET, which reports the real error
+        return fresh
+    fresh.update(Size=response['ContentLength'], ETag=response['ETag'], LastModified=response['LastModified'])
+    return fresh
+
+
+async def _download_with_retries(client, bucket_name, entry, local_file_path, stats):
+    """Runs _download_one_async, retrying throttled and transient errors with backoff like call_with_retries."""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return await _download_one_async(client, bucket_name, entry, local_file_path)
+        except Exception as e:
+            if classify_error(e) == FATAL or attempt + 1 >= MAX_ATTEMPTS:
+                raise
+            stats['retries'] += 1
+            await asyncio.sleep(backoff_delay(attempt))
+
+
+async def download_files_async(files, bucket_name, local_folder, client, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                               on_result=None, manifest=None, sync=False, stats=None):
+    """Downloads files with at most max_in_flight concurrent GETs on the running event loop.
+
+    files may be keys or listing entries from a plain or async iterable, and are pulled lazily.
+    Skipping (manifest, sync), confirming listing index entries, VersionId/LocalName, on_result and
+    stats work as in download_files_concurrently; objects are always fetched with one streamed GET
+    rather than byte ranges, as a coroutine per object is already cheap. Failed GETs are retried with backoff
+    (counted in stats['retries']), but max_in_flight stays fixed.
+    """
+    os.makedirs(local_folder, exist_ok=True)
+    if stats is None:
+        stats = {}
+    stats.update({'downloaded': 0, 'skipped': 0, 'skipped_bytes': 0, 'failed': {}, 'bytes': 0,
+                  'first_file_seconds': None, 'retries': 0})
+    started = time.perf_counter()
+    pending = {}
+
+    def finish(task):
+        key, entry, local_file_path = pending.pop(task)
+        error = task.exception()
+        if error is None:
+            stats['bytes'] += task.result()
+            stats['downloaded'] += 1
+            if sync and entry.get('LastModified') is not None:
+                mtime = _timestamp(entry['LastModified'])
+                os.utime(local_file_path, (mtime, mtime))
+        else:
+            stats['failed'][key] = str(error)
+        if manifest is not None:
+            manifest.finish(key, task.result() if error is None else 0, error)
+        if stats['first_file_seconds'] is None:
+            stats['first_file_seconds'] = time.perf_counter() - started
+        if on_result:
+            on_result(key, error)
+
+    async for file in _aiter_from_thread(files):
+        entry = file if isinstance(file, dict) else {'Key': file}
+        if entry.get('Indexed') and (sync or (manifest is not None and manifest.get(entry['Key']) is not None)):
+            # Listing index entries may be out of date; confirm them before skipping the file
+            entry = file = await _confirm_entry(client, bucket_name, entry)
+        version_id = entry.get('VersionId')
+        key = f"{entry['Key']}?versionId={version_id}" if version_id else entry['Key']
+        local_file_path = os.path.join(local_folder, entry.get('LocalName') or os.path.basename(entry['Key']))
+        size, etag = entry.get('Size'), entry.get('ETag')
+        if ((manifest is not None and manifest.is_complete(key, size, etag, local_file_path))
+                or (sync and is_unchanged(file, local_file_path, manifest))):
+            stats['skipped'] += 1
+            stats['skipped_bytes'] += os.path.getsize(local_file_path)
+            continue
+        if manifest is not None:
+            manifest.start(bucket_name, key, size, etag, local_file_path)
+        task = asyncio.ensure_future(_download_with_retries(client, bucket_name, entry, local_file_path, stats))
+        pending[task] = (key, entry, local_file_path)
+        if len(pending) >= max_in_flight:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for done_task in done:
+                finish(done_task)
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for done_task in done:
+            finish(done_task)
+    if manifest is not None:
+        manifest.commit()
+
+    stats['seconds'] = time.perf_counter() - started
+    stats['throughput_mb_s'] = stats['bytes'] / 1e6 / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+def async_downloader(credentials=(None, None, None), max_in_flight=DEFAULT_MAX_IN_FLIGHT, endpoint_url=None):
+    """Returns a drop-in for download_files_concurrently that runs download_files_async on its own event loop.
+
+    The returned function takes the same arguments; its s3_client, max_workers and executor are
+    ignored in favour of an aiobotocore client made from credentials with max_in_flight connections,
+    and batch_small_files has no effect. The object cache is not supported.
+    """
+    async def run(files, bucket_name, local_folder, on_result, manifest, sync, stats):
+        async with create_async_s3_client(*credentials, max_in_flight=max_in_flight,
+                                          endpoint_url=endpoint_url) as client:
+            return await download_files_async(files, bucket_name, local_folder, client, max_in_flight,
+                                              on_result=on_result, manifest=manifest, sync=sync, stats=stats)
+
+    def download(files, bucket_name, local_folder, s3_client=None, max_workers=None, on_result=None,
+                 manifest=None, sync=False, executor=None, stats=None, cache=None, **kwargs):
+        if cache is not None:
+            raise ValueError("The async backend can't use the object cache")
+        return asyncio.run(run(files, bucket_name, local_folder, on_result, manifest, sync, stats))
+    return download
@@ -1,46 +1,20 @@
-import pandas as pd
-import boto3
 import os
-from botocore.exceptions import ClientError
+from downloader import account_id_for, fetch_product_credentials, read_config, run_download
+from s3_engine import create_s3_client
 
-# Credentials
-AWS_ACCESS_KEY_ID= ""
-AWS_SECRET_ACCESS_KEY= ""
-AWS_SESSION_TOKEN= ""
-
-# S3 connector
-s3 = boto3.client('s3',aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key= AWS_SECRET_ACCESS_KEY, aws_session_token = AWS_SESSION_TOKEN)
-
-# Paginator to handle pagination
-paginator = s3.get_paginator('list_objects_v2') 
+# Credentials come from the credential broker (S3_DOWNLOADER_BROKER_URL) or Chrome SSO, cached between runs
+PRODUCT = "FNBO Prod"
+config = read_config()
+s3 = create_s3_client(*fetch_product_credentials(account_id_for(config[PRODUCT])), max_attempts=1)
 
 # S3 bucket and folder to read from
-BUCKET_NAME = "ssp-dps-prod"
-S3_FOLDER = "Amerifirst/originations/hil_transaction/"
+S3_PATH = "s3://ssp-dps-prod/Amerifirst/originations/hil_transaction/"
 
 # Folder to download data in
 LOCAL_FOLDER = os.path.join(os.getcwd(), 'Data', 'Transactions_Files')
 
-# Create directory if it doesn't exist
-try:
-    os.makedirs(LOCAL_FOLDER, exist_ok=True)
-except Exception as e:
-    print(f"Error creating directory: {e}")
-
-page_iterator = paginator.paginate(Bucket=BUCKET_NAME, Prefix=S3_FOLDER)
-
-# Iterating through the page to list all objects in that bucket folder and download it
-for page in page_iterator:
-    files = page.get("Contents")
-    for file in files:
-        try:
-            s3_file_path = file.get("Key")
-            file_name = os.path.basename(s3_file_path)
-            local_file_path = os.path.join(LOCAL_FOLDER, file_name)
-
-            if "hil_transaction_" in local_file_path and ".txt" in file_name:
-                print(f"Downloading {file_name}")
-                s3.download_file(BUCKET_NAME, s3_file_path, local_file_path)
-
-        except Exception as e:
-            print(f"Error: {e}")
\ No newline at end of file
+# Listing, filtering and downloading share the app's engine, so only new or changed files are fetched
+stats = run_download(PRODUCT, config[PRODUCT], LOCAL_FOLDER, s3, s3_path=S3_PATH, matching_text="hil_transaction_",
+                     file_types=['txt'], sync=True)
+print(f"{stats['matched']} of {stats['listed']} files matched, {stats['downloaded']} downloaded, "
+      f"{stats['skipped']} unchanged, {len(stats['failed'])} failed")
@@ -0,0 +1,631 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from datetime import datetime
+from itertools import takewhile
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import IncompleteReadError
+
+from filters import LAST_MODIFIED, _parse_names
+from metrics import LatencySample
+from retries import MAX_ATTEMPTS, AdaptiveLimiter, call_with_retries
+
+
+DEFAULT_CONCURRENCY = 16
+
+# Filename date formats for products whose config row has no DatePattern, keyed by the
+# first word of the product name.
+PRODUCT_DATE_FORMATS = {'FNBO': '%Y%m%d', 'CP': '%Y%m%d', 'NF': '%Y_%m_%d'}
+
+# Objects at least this large are fetched as parallel byte ranges of PART_SIZE.
+LARGE_OBJECT_THRESHOLD = 64 * 1024 * 1024
+PART_SIZE = 16 * 1024 * 1024
+
+# With batch_small_files, objects under SMALL_FILE_SIZE are fetched SMALL_FILE_BATCH at a time per worker task.
+SMALL_FILE_SIZE = 1024 * 1024
+SMALL_FILE_BATCH = 8
+
+_CHUNK_SIZE = 1024 * 1024
+
+# Sorts after any other character, so StartAfter=prefix + _MAX_KEY_CHAR skips everything under prefix.
+_MAX_KEY_CHAR = '\U0010ffff'
+
+
+def create_s3_client(aws_access_key_id=None, aws_secret_access_key=None, session_token=None,
+                     max_workers=DEFAULT_CONCURRENCY, endpoint_url=None, max_attempts=None):
+    """Creates an S3 client whose connection pool is large enough for max_workers threads.
+
+    endpoint_url (or the S3_ENDPOINT_URL environment variable) points the client at a
+    local S3 stand-in such as moto server or MinIO. max_attempts overrides botocore's own
+    retries; 1 leaves every retry to the download scheduler (see retries.py), which is what the
+    app and the CLI use so the scheduler sees throttling as it happens and no request is
+    retried by both.
+    """
+    config = Config(max_pool_connections=max(max_workers, 10))
+    if max_attempts is not None:
+        config = config.merge(Config(retries={'mode': 'standard', 'total_max_attempts': max_attempts}))
+    return boto3.client('s3',
+                        aws_access_key_id=aws_access_key_id,
+                        aws_secret_access_key=aws_secret_access_key,
+                        aws_session_token=session_token,
+                        endpoint_url=endpoint_url or os.environ.get('S3_ENDPOINT_URL'),
+                        config=config)
+
+
+def iter_s3_objects(bucket_name, folder_path, s3_client, start_after=None):
+    """Yields the listing entry (Key, Size, ETag, LastModified) of every object under folder_path.
+
+    Entries are yielded as each ListObjectsV2 page arrives, so only one page is held in memory.
+    start_after skips every key up to and including it. A page that fails is retried as in
+    retries.call_with_retries.
+    """
+    request = {'Bucket': bucket_name, 'Prefix': folder_path}
+    if start_after:
+        request['StartAfter'] = start_after
+    while True:
+        page = call_with_retries(None, s3_client.list_objects_v2, **request)
+        yield from page.get('Contents', [])
+        if not page.get('IsTruncated'):
+            return
+        request['ContinuationToken'] = page['NextContinuationToken']
+
+
+def iter_s3_files(bucket_name, folder_path, s3_client):
+    """Yields the keys under folder_path as each listing page arrives."""
+    for file in iter_s3_objects(bucket_name, folder_path, s3_client):
+        yield file['Key']
+
+
+def list_s3_files(bucket_name, folder_path, s3_client):
+    """Lists all files in a specific S3 folder."""
+    return list(iter_s3_files(bucket_name, folder_path, s3_client))
+
+
+def count_items(items, counts, name):
+    """Yields items unchanged while counting them into counts[name]."""
+    counts.setdefault(name, 0)
+    for item in items:
+        counts[name] += 1
+        yield item
+
+
+def stop_when(event, items):
+    """Yields items until event (a threading.Event) is set, so a cancelled run stops pulling from its source."""
+    for item in items:
+        if event.is_set():
+            return
+        yield item
+
+
+def date_format_for_product(product, product_config=None):
+    """Returns the date pattern for a product, or None if it has no known pattern.
+
+    The DatePattern column of the product's config row (from product_configs.xlsx) wins, e.g.
+    '%Y%m%d' or 'LastModified'; products without one fall back to PRODUCT_DATE_FORMATS.
+    """
+    pattern = (product_config or {}).get('DatePattern')
+    if isinstance(pattern, str) and pattern.strip():
+        return pattern.strip()
+    return PRODUCT_DATE_FORMATS.get(product.split()[0])
+
+
+def _sorts_by_date(date_format):
+    """True when dates formatted with date_format sort as the dates do: year, then month, then day."""
+    positions = [date_format.find(part) for part in ('%Y', '%m', '%d')]
+    return -1 not in positions and positions == sorted(positions)
+
+
+def _name_stem(key, date_format, date_length):
+    """Returns the key up to its filename date, or None if the filename carries no date."""
+    directory = key[:key.rfind('/') + 1]
+    name = key[len(directory):].split('.')[0]
+    try:
+        datetime.strptime(name[-date_length:], date_format)
+    except ValueError:
+        return None
+    return directory + name[:-date_length]
+
+
+def _list_range(bucket_name, prefix, s3_client, start_after, last):
+    """Lists the entries under prefix after start_after, up to and including key last."""
+    return list(takewhile(lambda entry: entry['Key'] <= last,
+                          iter_s3_objects(bucket_name, prefix, s3_client, start_after=start_after)))
+
+
+def iter_s3_objects_by_date(bucket_name, folder_path, s3_client, start_date, end_date, date_format,
+                            max_workers=DEFAULT_CONCURRENCY):
+    """Yields the listing entries under folder_path, skipping most files dated outside [start_date, end_date].
+
+    Walks the folder a page at a time like iter_s3_objects, but when a page ends inside a family of
+    dated files (same name up to the date), jumps with StartAfter past the rest of that family's
+    dates and lists only the part of the skipped range within the window, in parallel with the walk.
+    So the walk never takes more pages than the full listing, each jump costs at most one small
+    extra request, and a folder of a few long-running families takes a few pages whatever its size.
+    Sibling families such as 'name_2_<date>' sort after 'name_<date>'s dates and are walked into.
+
+    Falls back to the full listing when there is no filename date format (including LastModified
+    dates), the format doesn't sort by date or the window is open on either side. The result is a
+    superset of the matching keys, so the usual date filter still applies.
+    """
+    if (not date_format or date_format == LAST_MODIFIED or start_date is None or end_date is None
+            or not _sorts_by_date(date_format)):
+        yield from iter_s3_objects(bucket_name, folder_path, s3_client)
+        return
+    if start_date > end_date:
+        return
+    first, last = start_date.strftime(date_format), end_date.strftime(date_format)
+    # Just before the first date: no key that starts with it sorts at or before this
+    before_first = first[:-1] + chr(ord(first[-1]) - 1) + _MAX_KEY_CHAR
+    date_length = len(datetime(2000, 1, 1).strftime(date_format))
+    # Where the year starts in a formatted date, e.g. 0 for '%Y%m%d'
+    year_offset = len(datetime(2000, 1, 1).strftime(date_format[:date_format.find('%Y')]))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        skipped = []
+        request = {'Bucket': bucket_name, 'Prefix': folder_path}
+        while True:
+            page = call_with_retries(None, s3_client.list_objects_v2, **request)
+            contents = page.get('Contents', [])
+            yield from contents
+            if not page.get('IsTruncated'):
+                break
+            key = contents[-1]['Key']
+            stem = _name_stem(key, date_format, date_length)
+            if stem is None:
+                request['StartAfter'] = key
+                continue
+            # Past every date of the family in this millennium, e.g. 'name_2999' for 'name_2024...';
+            # a sibling 'name_2_...' sorts after it
+            request['StartAfter'] = key[:len(stem) + year_offset + 1] + '999' + _MAX_KEY_CHAR
+            start_after, stop = max(key, stem + before_first), min(request['StartAfter'], stem + last + _MAX_KEY_CHAR)
+            if start_after < stop:
+                skipped.append(executor.submit(_list_range, bucket_name, stem, s3_client, start_after, stop))
+        for listing in skipped:
+            yield from listing.result()
+
+
+def list_s3_files_by_date(bucket_name, folder_path, s3_client, start_date, end_date, date_format,
+                          max_workers=DEFAULT_CONCURRENCY):
+    """Lists only the keys whose filename date prefix can fall within [start_date, end_date]."""
+    return [file['Key'] for file in iter_s3_objects_by_date(bucket_name, folder_path, s3_client, start_date,
+                                                            end_date, date_format, max_workers)]
+
+
+def _head_entry(bucket_name, key, s3_client):
+    """Returns a listing-style entry for key from a HEAD request, or None if there is no such object."""
+    try:
+        response = call_with_retries(None, s3_client.head_object, Bucket=bucket_name, Key=key)
+    except Exception as e:
+        if (getattr(e, 'response', None) or {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    return {'Key': key, 'Size': response['ContentLength'], 'ETag': response['ETag'],
+            'LastModified': response['LastModified']}
+
+
+def iter_s3_objects_by_name(bucket_name, folder_path, s3_client, exact_names, max_workers=DEFAULT_CONCURRENCY):
+    """Yields the listing entries for comma separated file names without listing the whole folder.
+
+    A name with an extension costs one HEAD of folder_path + name. A name without one is listed
+    as a prefix, which finds it with any extension (and other names starting with it, so the
+    exact-name filter still applies). Requests run in parallel and entries are yielded as each
+    one answers; names that don't exist are left out. Only objects directly in folder_path are
+    found by HEAD, unlike a full listing which also looks in subfolders.
+    """
+    if folder_path and not folder_path.endswith('/'):
+        folder_path += '/'
+
+    def resolve(name):
+        if '.' in name:
+            entry = _head_entry(bucket_name, folder_path + name, s3_client)
+            return [entry] if entry else []
+        return list(iter_s3_objects(bucket_name, folder_path + name, s3_client))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in as_completed([executor.submit(resolve, name) for name in sorted(_parse_names(exact_names))]):
+            yield from future.result()
+
+
+def map_object_versions(bucket_name, folder_path, s3_client, keys=None):
+    """Lists every object version under folder_path once and returns {key: [versions, newest first]}.
+
+    Pages through ListObjectVersions for the whole folder rather than calling it once per key,
+    and matches keys exactly, so a key that is a prefix of another doesn't pick up its versions.
+    keys optionally restricts the map to the given set. Delete markers are not included.
+    """
+    versions = {}
+    request = {'Bucket': bucket_name, 'Prefix': folder_path}
+    while True:
+        page = call_with_retries(None, s3_client.list_object_versions, **request)
+        for version in page.get('Versions', []):
+            if keys is None or version['Key'] in keys:
+                versions.setdefault(version['Key'], []).append(version)
+        if not page.get('IsTruncated'):
+            break
+        request['KeyMarker'] = page['NextKeyMarker']
+        request['VersionIdMarker'] = page['NextVersionIdMarker']
+    for key_versions in versions.values():
+        key_versions.sort(key=lambda version: version['LastModified'], reverse=True)
+    return versions
+
+
+def _size(file):
+    return file.get('Size') or 0 if isinstance(file, dict) else -1
+
+
+def order_largest_first(files):
+    """Returns files sorted by Size, largest first, with bare keys (size unknown) last.
+
+    Starting the biggest files first keeps a large file found late in the listing from running
+    on alone after everything else has finished. The whole listing is read before returning.
+    """
+    return sorted(files, key=_size, reverse=True)
+
+
+def summarize_files(files):
+    """Returns {'files', 'bytes', 'largest_bytes'} for a list of keys or listing entries, sizes unknown counting 0."""
+    sizes = [max(_size(file), 0) for file in files]
+    return {'files': len(sizes), 'bytes': sum(sizes), 'largest_bytes': max(sizes, default=0)}
+
+
+def plan_ranges(size, part_size=PART_SIZE):
+    """Splits an object of size bytes into inclusive (start, end) byte ranges of part_size."""
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+
+def _copy_stream(body, f):
+    written = 0
+    for chunk in iter(lambda: body.read(_CHUNK_SIZE), b''):
+        f.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def _download_one(s3_client, bucket_name, file, local_file_path):
+    """Downloads a whole object and returns the number of bytes written.
+
+    Listing entries are fetched with a single GET; bare keys, whose size is unknown, go through
+    boto3's managed download_file.
+    """
+    if not isinstance(file, dict):
+        s3_client.download_file(bucket_name, file, local_file_path)
+        return os.path.getsize(local_file_path)
+    request = {'Bucket': bucket_name, 'Key': file['Key']}
+    if file.get('VersionId'):
+        request['VersionId'] = file['VersionId']
+    body = s3_client.get_object(**request)['Body']
+    with open(local_file_path, 'wb') as f:
+        return _copy_stream(body, f)
+
+
+def _timed(times, func, *args, **kwargs):
+    """Calls func(*args, **kwargs), appending its (start, end) perf_counter times to the list times."""
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        times.append((start, time.perf_counter()))
+
+
+def _download_batch(limiter, max_attempts, s3_client, bucket_name, batch):
+    """Downloads (file, local_file_path, times) one after another, returning each one's bytes written or error."""
+    outcomes = []
+    for file, local_file_path, times in batch:
+        try:
+            outcomes.append(_timed(times, call_with_retries, limiter, _download_one, s3_client, bucket_name, file,
+                                   local_file_path, max_attempts=max_attempts))
+        except Exception as e:
+            outcomes.append(e)
+    return outcomes
+
+
+def _download_range(s3_client, bucket_name, key, version_id, etag, local_file_path, start, end):
+    """Fetches bytes [start, end] of an object into the same offsets of a preallocated local file.
+
+    IfMatch pins every part to the listed ETag, so an object overwritten mid-download fails
+    instead of producing a file stitched from two versions.
+    """
+    request = {'Bucket': bucket_name, 'Key': key, 'Range': f'bytes={start}-{end}'}
+    if version_id:
+        request['VersionId'] = version_id
+    if etag:
+        request['IfMatch'] = etag
+    body = s3_client.get_object(**request)['Body']
+    # Each part writes through its own handle, so concurrent parts never share a file position
+    with open(local_file_path, 'r+b') as f:
+        f.seek(start)
+        written = _copy_stream(body, f)
+    if written != end - start + 1:
+        # A short body is retried like a dropped connection
+        raise IncompleteReadError(actual_bytes=written, expected_bytes=end - start + 1)
+    return written
+
+
+def _timestamp(last_modified):
+    """Epoch seconds of a LastModified value, either a datetime or the ISO string stored by the listing index."""
+    if isinstance(last_modified, str):
+        last_modified = datetime.fromisoformat(last_modified)
+    return last_modified.timestamp()
+
+
+def is_unchanged(file, local_file_path, manifest=None):
+    """True if the local copy already matches a listing entry, so sync mode can skip it.
+
+    Sizes must match. Then the ETag recorded by the manifest decides when there is one,
+    otherwise the local file must be no older than the object's LastModified.
+    """
+    if not isinstance(file, dict) or file.get('Size') is None:
+        return False
+    try:
+        local = os.stat(local_file_path)
+    except FileNotFoundError:
+        return False
+    if local.st_size != file['Size']:
+        return False
+    entry = manifest.get(file['Key']) if manifest is not None else None
+    if entry and entry['etag'] and file.get('ETag'):
+        return entry['status'] == 'done' and entry['etag'] == file['ETag']
+    return file.get('LastModified') is not None and local.st_mtime >= _timestamp(file['LastModified'])
+
+
+def _confirmed(files, needs_head, s3_client, bucket_name, executor, lookahead):
+    """Yields files in order, the entries needs_head picks replaced by a HEAD of the object.
+
+    Listing index entries can be hours old, so their Size and ETag are confirmed before anything
+    relies on them. Up to lookahead HEADs run ahead on the executor. An entry whose object is gone
+    or whose HEAD fails loses its Size and ETag, so it is fetched with a plain GET that reports the
+    real error.
+    """
+    queue = deque()
+
+    def resolve(item):
+        file, future = item
+        if future is None:
+            return file
+        try:
+            current = future.result()
+        except Exception:
+            current = None
+        if current is None:
+            return {name: value for name, value in file.items() if name not in ('Indexed', 'Size', 'ETag')}
+        return {**{name: value for name, value in file.items() if name != 'Indexed'}, **current}
+
+    for file in files:
+        future = None
+        if isinstance(file, dict) and file.get('Indexed') and needs_head(file):
+            future = executor.submit(_head_entry, bucket_name, file['Key'], s3_client)
+        elif not queue:
+            yield file
+            continue
+        queue.append((file, future))
+        if len(queue) > lookahead:
+            yield resolve(queue.popleft())
+    while queue:
+        yield resolve(queue.popleft())
+
+
+def download_files_concurrently(files, bucket_name, local_folder, s3_client, max_workers=DEFAULT_CONCURRENCY,
+                                on_result=None, large_object_threshold=LARGE_OBJECT_THRESHOLD, part_size=PART_SIZE,
+                                manifest=None, sync=False, executor=None, stats=None, limiter=None,
+                                max_attempts=MAX_ATTEMPTS, batch_small_files=False, cache=None):
+    """Downloads files from S3 to a local folder using a bounded pool of worker threads.
+
+    files may be keys or listing entries (dicts with Key, Size, ETag, and optionally VersionId to fetch
+    a specific version and LocalName to save it under another file name), from any iterable including
+    a generator still being fed by a listing. Entries of at least large_object_threshold bytes are
+    split into part_size byte ranges written in place into a preallocated '.part' file, renamed
+    once complete, and the parts share the same workers as small files, so max_workers caps all
+    in-flight requests together. Work is pulled lazily, at most 2 * max_workers requests are queued
+    at a time and memory stays flat however many keys the source yields.
+
+    on_result(key, error) is called on the calling thread as each file finishes, with error set
+    to None on success. Specific versions are reported as 'key?versionId=...'. A failed key never aborts the rest of the run.
+
+    Every GET (or range) is retried up to max_attempts times when S3 throttles or the connection
+    drops, see retries.call_with_retries, and runs inside limiter, an AdaptiveLimiter that lowers
+    the number of requests in flight while S3 answers SlowDown. By default each run has its own,
+    starting at max_workers.
+
+    With batch_small_files, listing entries under SMALL_FILE_SIZE are handed to the workers
+    SMALL_FILE_BATCH at a time, which saves scheduling overhead when a run ends in thousands of
+    tiny files (as it does after order_largest_first).
+
+    With an object_cache.ObjectCache as cache, listing entries already in it are linked or copied
+    from there instead of downloaded, and everything downloaded is added to it.
+
+    Entries from the listing index (marked Indexed) may be out of date, so they are confirmed with
+    a HEAD before their Size or ETag is relied on: before ranged parts are planned, before a file
+    is skipped as already downloaded and before the cache is looked up. Other entries are fetched with a plain GET, which always
+    returns the current object.
+
+    With a manifest.DownloadManifest, files an earlier run completed are skipped when their size and
+    ETag still match, large files resume from their last completed part, and progress is recorded
+    as it happens so this run can be resumed in turn. With sync, any local file that is_unchanged
+    reports as matching its listing entry is skipped too, and downloaded files take the object's
+    LastModified as their mtime.
+
+    Pass a shared ThreadPoolExecutor as executor to run several downloads (e.g. one per product) at
+    once under one global cap on in-flight requests; it is left running for the caller to shut down.
+    Pass a dict as stats to watch the counts below fill in from another thread while the run goes.
+
+    Returns a dict with 'downloaded', 'skipped', 'skipped_bytes', 'failed' (key -> error message),
+    'bytes', 'seconds', 'throughput_mb_s', 'first_file_seconds' (time until the first download finished),
+    'latency_p50_seconds' and 'latency_p95_seconds' (from the first request of a downloaded file, retries
+    and all its parts included, to the end of its last one; None before any file was downloaded),
+    and the limiter's 'retries', 'throttled', 'concurrency' and 'lowest_concurrency'. Files served
+    from the cache count as downloaded but not in 'bytes'; with a cache the stats also have its
+    'cache_hits', 'cache_misses', 'cache_bytes_saved' and 'cache_evictions' for this run.
+    """
+    os.makedirs(local_folder, exist_ok=True)
+    if stats is None:
+        stats = {}
+    if limiter is None:
+        limiter = AdaptiveLimiter(max_workers)
+    stats.update({'downloaded': 0, 'skipped': 0, 'skipped_bytes': 0, 'failed': {}, 'bytes': 0,
+                  'first_file_seconds': None})
+    stats.update(limiter.stats())
+    if cache is not None:
+        stats.update(cache.stats())
+    started = time.perf_counter()
+    pending = {}
+    latencies = LatencySample()
+
+    def finish(transfer):
+        key, error = transfer['key'], transfer['error']
+        if error is None and transfer['part_path']:
+            if os.path.getsize(transfer['part_path']) != transfer['size']:
+                error = IOError(f"Size mismatch for {key}: expected {transfer['size']} bytes")
+            else:
+                os.replace(transfer['part_path'], transfer['path'])
+        if error is None:
+            if not transfer['cached']:
+                stats['bytes'] += transfer['bytes']
+            if transfer['times']:
+                latencies.add(max(end for _, end in transfer['times']) - min(start for start, _ in transfer['times']))
+            stats['downloaded'] += 1
+            if sync and transfer['last_modified'] is not None:
+                mtime = _timestamp(transfer['last_modified'])
+                os.utime(transfer['path'], (mtime, mtime))
+            if cache is not None and not transfer['cached']:
+                try:
+                    cache.store(bucket_name, transfer['entry'], transfer['path'])
+                except OSError as e:
+                    # The file itself is fine, it just won't be reused
+                    print(f"Could not cache {key}: {e}")
+                stats.update(cache.stats())
+        else:
+            stats['failed'][key] = str(error)
+        if manifest is not None:
+            manifest.finish(key, transfer['bytes'], error)
+        if stats['first_file_seconds'] is None:
+            stats['first_file_seconds'] = time.perf_counter() - started
+        if on_result:
+            on_result(key, error)
+
+    def part_finished(transfer, index, outcome):
+        if isinstance(outcome, Exception):
+            transfer['error'] = transfer['error'] or outcome
+        else:
+            if manifest is not None and index is not None:
+                manifest.part_done(transfer['key'], index, outcome)
+            transfer['bytes'] += outcome
+        transfer['parts_left'] -= 1
+        if transfer['parts_left'] == 0:
+            finish(transfer)
+
+    def collect(done):
+        for future in done:
+            transfer, index = pending.pop(future)
+            if isinstance(transfer, list):
+                for batched, outcome in zip(transfer, future.result()):
+                    part_finished(batched, None, outcome)
+                continue
+            try:
+                outcome = future.result()
+            except Exception as e:
+                outcome = e
+            part_finished(transfer, index, outcome)
+        stats.update(limiter.stats())
+
+    def wait_for_room():
+        if len(pending) >= 2 * max_workers:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    def submit(transfer, index, func, *args):
+        future = executor.submit(_timed, transfer['times'], call_with_retries, limiter, func, *args,
+                                 max_attempts=max_attempts)
+        pending[future] = (transfer, index)
+        wait_for_room()
+
+    batch = []
+
+    def submit_batch():
+        future = executor.submit(_download_batch, limiter, max_attempts, s3_client, bucket_name,
+                                 [(file, transfer['path'], transfer['times']) for transfer, file in batch])
+        pending[future] = ([transfer for transfer, _ in batch], None)
+        batch.clear()
+        wait_for_room()
+
+    def needs_head(entry):
+        return (cache is not None or sync or (entry.get('Size') or 0) >= large_object_threshold
+                or (manifest is not None and manifest.get(entry['Key']) is not None))
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for file in _confirmed(files, needs_head, s3_client, bucket_name, executor, max_workers):
+            entry = file if isinstance(file, dict) else {'Key': file}
+            version_id = entry.get('VersionId')
+            key = f"{entry['Key']}?versionId={version_id}" if version_id else entry['Key']
+            local_file_path = os.path.join(local_folder, entry.get('LocalName') or os.path.basename(entry['Key']))
+            size = entry.get('Size')
+            etag = entry.get('ETag')
+            if ((manifest is not None and manifest.is_complete(key, size, etag, local_file_path))
+                    or (sync and is_unchanged(file, local_file_path, manifest))):
+                stats['skipped'] += 1
+                stats['skipped_bytes'] += os.path.getsize(local_file_path)
+                continue
+
+            transfer = {'key': key, 'path': local_file_path, 'size': size, 'bytes': 0, 'error': None,
+                        'parts_left': 1, 'part_path': None, 'last_modified': entry.get('LastModified'),
+                        'entry': entry, 'cached': False, 'times': []}
+            if cache is not None and cache.fetch(bucket_name, entry, local_file_path):
+                if manifest is not None:
+                    manifest.start(bucket_name, key, size, etag, local_file_path)
+                transfer['cached'] = True
+                transfer['bytes'] = size
+                finish(transfer)
+                stats.update(cache.stats())
+                continue
+            if size is None or size < large_object_threshold:
+                if manifest is not None:
+                    manifest.start(bucket_name, key, size, etag, local_file_path)
+                if batch_small_files and size is not None and size < SMALL_FILE_SIZE:
+                    batch.append((transfer, file))
+                    if len(batch) >= SMALL_FILE_BATCH:
+                        submit_batch()
+                else:
+                    submit(transfer, None, _download_one, s3_client, bucket_name, file, local_file_path)
+                continue
+
+            ranges = plan_ranges(size, part_size)
+            part_path = transfer['part_path'] = local_file_path + '.part'
+            record = manifest.get(key) if manifest is not None else None
+            if (record and record['size'] == size and record['etag'] == etag and record['part_size'] == part_size
+                    and os.path.exists(part_path) and os.path.getsize(part_path) == size):
+                parts_done = record['parts_done']
+            else:
+                parts_done = set()
+                with open(part_path, 'wb') as f:
+                    f.truncate(size)
+                if manifest is not None:
+                    manifest.start(bucket_name, key, size, etag, local_file_path, part_size)
+            transfer['parts_left'] = len(ranges) - len(parts_done)
+            transfer['bytes'] = sum(end - start + 1 for i, (start, end) in enumerate(ranges) if i in parts_done)
+            if not transfer['parts_left']:
+                finish(transfer)
+            for index, (start, end) in enumerate(ranges):
+                if index not in parts_done:
+                    submit(transfer, index, _download_range, s3_client, bucket_name, entry['Key'], version_id, etag,
+                           part_path, start, end)
+        if batch:
+            submit_batch()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    finally:
+        if own_executor:
+            executor.shutdown()
+    if manifest is not None:
+        manifest.commit()
+
+    stats['seconds'] = time.perf_counter() - started
+    stats['throughput_mb_s'] = stats['bytes'] / 1e6 / stats['seconds'] if stats['seconds'] else 0.0
+    stats['latency_p50_seconds'] = latencies.percentile(50)
+    stats['latency_p95_seconds'] = latencies.percentile(95)
+    return stats
@@ -0,0 +1,86 @@
+import getpass
+import time
+
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+
+from credential_broker import (ACCESS_KEYS_BUTTON_SELECTOR, ACCOUNT_BUTTON_SELECTOR, ACCOUNT_ID_PARAGRAPH_SELECTOR,
+                               ACCOUNT_ID_SELECTOR, ACCOUNT_INFO_SELECTOR, ACCOUNT_LIST_SELECTOR,
+                               CREDENTIAL_INPUT_SELECTOR, SSO_PORTAL_URL)
+
+
+def fetch_credentials_via_selenium(account_id):
+    """Fetches AWS credentials dynamically using Selenium and Chrome SSO."""
+    username = getpass.getuser()
+    profile_path = fr'D:\Users\{username}\AppData\Local\Google\Chrome\User Data\Default'
+    chrome_path = "C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe"
+    options = Options()
+    options.add_argument("--start-maximized")
+    options.add_argument(f"--user-data-dir={profile_path}")
+
+    # Disable the sandboxing feature that can cause this issue
+    options.add_argument('--no-sandbox')
+
+    # Disable GPU hardware acceleration (sometimes helps with the crash)
+    options.add_argument('--disable-gpu')
+
+    options.add_argument('--disable-dev-shm-usage')
+
+    # Disable the DevToolsActivePort file issue
+    # options.add_argument('--remote-debugging-port=9222')
+
+    # options.add_argument('--headless')
+
+    options.binary_location = chrome_path
+    options.add_argument("--restart")
+    options.add_argument("--flag-switches-begin")
+    options.add_argument("--flag-switches-end")
+
+    driver = webdriver.Chrome(options=options)
+    try:
+        driver.get(SSO_PORTAL_URL)
+
+        # Locate the account list div
+        wait = WebDriverWait(driver, 60)
+
+        account_list_div = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ACCOUNT_LIST_SELECTOR)))
+
+        # Find all account buttons
+        account_buttons = account_list_div.find_elements(By.CSS_SELECTOR, ACCOUNT_BUTTON_SELECTOR)
+
+        for button in account_buttons:
+            try:
+                # Find the div containing account information
+                account_info_div = button.find_element(By.CSS_SELECTOR, ACCOUNT_INFO_SELECTOR)
+                account_p = account_info_div.find_element(By.CSS_SELECTOR, ACCOUNT_ID_PARAGRAPH_SELECTOR)
+                account_text = account_p.find_element(By.CSS_SELECTOR, ACCOUNT_ID_SELECTOR).text
+
+                # Extract account ID and name
+                account_id_in_button = account_text.strip()
+
+                if account_id_in_button == account_id:
+                    button.click()
+
+                    # Find and click the access keys button
+                    access_keys_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, ACCESS_KEYS_BUTTON_SELECTOR)))
+                    access_keys_button.click()
+
+                    # Locate input fields for access keys and secret keys
+                    time.sleep(3)
+                    keys_to_copy = driver.find_elements(By.CSS_SELECTOR, CREDENTIAL_INPUT_SELECTOR)
+
+                    access_key = keys_to_copy[2].get_attribute("value")
+                    secret_key = keys_to_copy[3].get_attribute("value")
+                    session_token = keys_to_copy[4].get_attribute("value")
+                    driver.quit()
+                    break
+
+            except Exception as e:
+                continue  # Skip non-matching buttons
+
+    except Exception as e:
+        print(e)  
+    return access_key, secret_key, session_token
@@ -0,0 +1,74 @@
+import hashlib
+import io
+import re
+from datetime import date, datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+
+class FakeS3:
+    """Just enough of an S3 client for listings and downloads.
+
+    ListObjectsV2 with Prefix, StartAfter and MaxKeys, HeadObject, and GetObject with Range and
+    IfMatch. Objects put without a body hold b'x'; every put gets a new LastModified and ETag.
+    Listing pages hold at most page_size keys, to walk many pages with few keys.
+    """
+
+    def __init__(self, keys, page_size=1000):
+        self.objects = {}
+        self.page_size = page_size
+        self.list_calls = 0
+        self.head_calls = 0
+        self.get_calls = 0
+        self.clock = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for key in keys:
+            self.put(key)
+
+    @property
+    def keys(self):
+        return sorted(self.objects)
+
+    def put(self, key, body=b'x'):
+        self.clock += timedelta(seconds=1)
+        self.objects[key] = (body, f'"{hashlib.md5(body).hexdigest()}"', self.clock)
+
+    def _entry(self, key):
+        body, etag, last_modified = self.objects[key]
+        return {'Key': key, 'Size': len(body), 'ETag': etag, 'LastModified': last_modified}
+
+    def _object(self, operation, key):
+        if key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}},
+                              operation)
+        return self.objects[key]
+
+    def list_objects_v2(self, Bucket, Prefix='', StartAfter='', MaxKeys=1000, ContinuationToken=None):
+        self.list_calls += 1
+        after = ContinuationToken or StartAfter
+        keys = [key for key in self.keys if key.startswith(Prefix) and key > after]
+        page = keys[:min(MaxKeys, self.page_size)]
+        response = {'Contents': [self._entry(key) for key in page], 'IsTruncated': len(keys) > len(page)}
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def head_object(self, Bucket, Key):
+        self.head_calls += 1
+        self._object('HeadObject', Key)
+        entry = self._entry(Key)
+        return {'ContentLength': entry['Size'], 'ETag': entry['ETag'], 'LastModified': entry['LastModified']}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, VersionId=None):
+        self.get_calls += 1
+        body, etag, last_modified = self._object('GetObject', Key)
+        if IfMatch is not None and IfMatch != etag:
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}, 'ResponseMetadata': {'HTTPStatusCode': 412}},
+                              'GetObject')
+        if Range:
+            start, end = map(int, re.fullmatch(r'bytes=(\d+)-(\d+)', Range).groups())
+            body = body[start:end + 1]
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body), 'ETag': etag, 'LastModified': last_modified}
+
+
+def daily_keys(folder, stem, year, month, days, date_format='%Y%m%d'):
+    return [f"{folder}{stem}{date(year, month, day).strftime(date_format)}.txt" for day in range(1, days + 1)]
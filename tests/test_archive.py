@@ -0,0 +1,33 @@
+import os
+import sys
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import archive_downloader
+from fake_s3 import FakeS3
+
+
+def test_an_archive_fetches_on_the_shared_executor(tmp_path):
+    s3_client = FakeS3([])
+    for i in range(5):
+        s3_client.put(f'hil/report_{i}.txt', b'r' * i)
+    fetched_on = set()
+    get_object = s3_client.get_object
+
+    def recording_get_object(**request):
+        fetched_on.add(threading.current_thread().name)
+        return get_object(**request)
+    s3_client.get_object = recording_get_object
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix='shared') as executor:
+        stats = archive_downloader('reports.zip')(s3_client.keys, 'bucket', str(tmp_path), s3_client, 2,
+                                                  executor=executor)
+        # Left running for the other products of the run
+        assert executor.submit(lambda: 1).result() == 1
+    assert stats['downloaded'] == 5
+    assert fetched_on and all(name.startswith('shared') for name in fetched_on)
+    with zipfile.ZipFile(tmp_path / 'reports.zip') as archive:
+        assert archive.read('report_3.txt') == b'rrr'
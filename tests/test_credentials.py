@@ -0,0 +1,76 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import credentials
+from credentials import get_cached_credentials
+
+
+class FakeProvider:
+    """Hands out numbered credentials, expiring lifetime seconds after the clock's time (or with no expiry)."""
+
+    def __init__(self, clock, lifetime=None):
+        self.clock = clock
+        self.lifetime = lifetime
+        self.calls = 0
+
+    def __call__(self, account_id):
+        self.calls += 1
+        keys = (f'key{self.calls}', f'secret{self.calls}', f'token{self.calls}')
+        return keys if self.lifetime is None else keys + (self.clock.now + self.lifetime,)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(credentials, 'time', SimpleNamespace(time=lambda: clock.now))
+    monkeypatch.setattr(credentials, '_cache', {})
+    monkeypatch.setattr(credentials, '_loaded_files', set())
+    return clock
+
+
+def test_credentials_are_reused_until_their_expiration_less_the_margin(clock):
+    provider = FakeProvider(clock, lifetime=1000)
+    assert get_cached_credentials('123', provider, margin=300, cache_file=None) == ('key1', 'secret1', 'token1')
+
+    clock.now += 699
+    assert get_cached_credentials('123', provider, margin=300, cache_file=None) == ('key1', 'secret1', 'token1')
+    assert provider.calls == 1
+
+    clock.now += 2
+    assert get_cached_credentials('123', provider, margin=300, cache_file=None) == ('key2', 'secret2', 'token2')
+    assert provider.calls == 2
+
+
+def test_credentials_without_an_expiration_last_the_ttl(clock):
+    provider = FakeProvider(clock)
+    get_cached_credentials('123', provider, ttl=600, margin=60, cache_file=None)
+    clock.now += 539
+    get_cached_credentials('123', provider, ttl=600, margin=60, cache_file=None)
+    assert provider.calls == 1
+    clock.now += 2
+    get_cached_credentials('123', provider, ttl=600, margin=60, cache_file=None)
+    assert provider.calls == 2
+
+
+def test_each_account_has_its_own_credentials(clock):
+    provider = FakeProvider(clock, lifetime=3600)
+    assert get_cached_credentials('123', provider, cache_file=None)[0] == 'key1'
+    assert get_cached_credentials('456', provider, cache_file=None)[0] == 'key2'
+    assert get_cached_credentials('123', provider, cache_file=None)[0] == 'key1'
+
+
+def test_the_cache_file_carries_credentials_to_the_next_run(clock, tmp_path, monkeypatch):
+    cache_file = str(tmp_path / 'credentials.json')
+    get_cached_credentials('123', FakeProvider(clock, lifetime=3600), cache_file=cache_file)
+
+    # A new process starts with an empty in-memory cache
+    monkeypatch.setattr(credentials, '_cache', {})
+    monkeypatch.setattr(credentials, '_loaded_files', set())
+    provider = FakeProvider(clock, lifetime=3600)
+    assert get_cached_credentials('123', provider, cache_file=cache_file) == ('key1', 'secret1', 'token1')
+    assert provider.calls == 0
@@ -0,0 +1,73 @@
+import io
+import os
+import socket
+import sys
+import threading
+
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ConnectionClosedError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader import run_download
+from s3_engine import create_s3_client
+
+
+class _Body(io.BytesIO):
+    def stream(self, **kwargs):
+        yield self.getvalue()
+
+
+def serve_without_a_server(s3_client, objects):
+    """Answers s3_client's ListObjectsV2 and GetObject from {key: bytes} in a before-send hook.
+
+    The first GET of each key has its connection dropped. Returns the number of GETs dropped.
+    """
+    dropped = set()
+    lock = threading.Lock()
+
+    def list_objects(request, **kwargs):
+        contents = ''.join(f'<Contents><Key>{key}</Key><LastModified>2024-01-01T00:00:00.000Z</LastModified>'
+                           f'<ETag>"e{len(body)}"</ETag><Size>{len(body)}</Size></Contents>'
+                           for key, body in sorted(objects.items()))
+        body = (f'<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/"><Name>bkt1</Name>'
+                f'<KeyCount>{len(objects)}</KeyCount><IsTruncated>false</IsTruncated>{contents}</ListBucketResult>')
+        return AWSResponse(request.url, 200, {'Content-Type': 'application/xml'}, _Body(body.encode()))
+
+    def get_object(request, **kwargs):
+        key = request.url.split('/bkt1/', 1)[1].split('?')[0]
+        with lock:
+            first = key not in dropped
+            dropped.add(key)
+        if first:
+            raise ConnectionClosedError(endpoint_url=request.url)
+        body = objects[key]
+        return AWSResponse(request.url, 200, {'Content-Length': str(len(body)), 'ETag': f'"e{len(body)}"'},
+                           _Body(body))
+
+    s3_client.meta.events.register('before-send.s3.ListObjectsV2', list_objects)
+    s3_client.meta.events.register('before-send.s3.GetObject', get_object)
+    return dropped
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_dropped_connections_are_retried_in_a_full_run(tmp_path):
+    objects = {f'reports/report_{i}.txt': b'x' * (i + 1) for i in range(3)}
+    s3_client = create_s3_client('key', 'secret', endpoint_url=f'http://127.0.0.1:{closed_port()}',
+                                 max_workers=2, max_attempts=1)
+    dropped = serve_without_a_server(s3_client, objects)
+
+    stats = run_download('FNBO Prod', {}, str(tmp_path), s3_client, s3_path='s3://bkt1/reports/', max_workers=2,
+                         log=lambda line: None)
+    assert stats['failed'] == {}
+    assert stats['downloaded'] == 3 and len(dropped) == 3
+    assert stats['retries'] == 3
+    assert stats['metrics']['request_errors'] == {'GetObject': 3}
+    for key, body in objects.items():
+        with open(tmp_path / os.path.basename(key), 'rb') as f:
+            assert f.read() == body
@@ -0,0 +1,72 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_s3 import FakeS3, daily_keys
+from listing_index import iter_indexed_files, iter_indexed_objects, open_listing_index, refresh_listing_index
+from object_cache import ObjectCache
+from s3_engine import download_files_concurrently
+
+
+def test_new_file_of_a_family_with_a_numbered_sibling_is_fetched(tmp_path):
+    folder = 'hil/'
+    keys = daily_keys(folder, 'hil_transaction_', 2024, 1, 30) + daily_keys(folder, 'hil_transaction_2_', 2024, 1, 30)
+    s3_client = FakeS3(keys)
+    conn = open_listing_index('bucket', folder, str(tmp_path), date_format='%Y%m%d')
+    assert refresh_listing_index(conn, 'bucket', folder, s3_client) == 60
+
+    s3_client.put(folder + 'hil_transaction_20240131.txt')
+    s3_client.put(folder + 'hil_transaction_2_20240131.txt')
+    assert refresh_listing_index(conn, 'bucket', folder, s3_client) == 2
+    assert folder + 'hil_transaction_20240131.txt' in set(iter_indexed_files(conn))
+    assert folder + 'hil_transaction_2_20240131.txt' in set(iter_indexed_files(conn))
+    conn.close()
+
+
+def test_index_built_with_another_date_format_is_rebuilt(tmp_path):
+    folder = 'nf/'
+    s3_client = FakeS3(daily_keys(folder, 'nf_', 2024, 1, 3, '%Y_%m_%d'))
+    conn = open_listing_index('bucket', folder, str(tmp_path), date_format='%Y%m%d')
+    refresh_listing_index(conn, 'bucket', folder, s3_client)
+    conn.close()
+
+    conn = open_listing_index('bucket', folder, str(tmp_path), date_format='%Y_%m_%d')
+    assert list(iter_indexed_files(conn)) == []
+    assert refresh_listing_index(conn, 'bucket', folder, s3_client) == 3
+    assert conn.execute("SELECT DISTINCT stem FROM objects").fetchall() == [(folder + 'nf_',)]
+    conn.close()
+
+
+def test_a_large_file_overwritten_since_the_refresh_is_downloaded_as_it_is_now(tmp_path):
+    folder = 'hil/'
+    key = folder + 'hil_transaction_20240101.txt'
+    s3_client = FakeS3([])
+    s3_client.put(key, b'a' * 100)
+    conn = open_listing_index('bucket', folder, str(tmp_path / 'index'))
+    refresh_listing_index(conn, 'bucket', folder, s3_client)
+
+    s3_client.put(key, b'b' * 150)
+    stats = download_files_concurrently(iter_indexed_objects(conn), 'bucket', str(tmp_path / 'out'), s3_client,
+                                        max_workers=2, large_object_threshold=64, part_size=32)
+    assert not stats['failed']
+    with open(tmp_path / 'out' / 'hil_transaction_20240101.txt', 'rb') as f:
+        assert f.read() == b'b' * 150
+
+
+def test_a_file_overwritten_since_the_refresh_is_not_served_from_the_cache(tmp_path):
+    folder = 'hil/'
+    key = folder + 'report.txt'
+    s3_client = FakeS3([])
+    s3_client.put(key, b'old')
+    conn = open_listing_index('bucket', folder, str(tmp_path / 'index'))
+    refresh_listing_index(conn, 'bucket', folder, s3_client)
+    cache = ObjectCache(str(tmp_path / 'cache'))
+    download_files_concurrently(iter_indexed_objects(conn), 'bucket', str(tmp_path / 'first'), s3_client, cache=cache)
+
+    s3_client.put(key, b'new')
+    stats = download_files_concurrently(iter_indexed_objects(conn), 'bucket', str(tmp_path / 'second'), s3_client,
+                                        cache=cache)
+    assert stats['cache_hits'] == 0
+    with open(tmp_path / 'second' / 'report.txt', 'rb') as f:
+        assert f.read() == b'new'
@@ -0,0 +1,53 @@
+import os
+import sys
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_s3 import FakeS3
+from manifest import DownloadManifest
+from s3_engine import download_files_concurrently
+
+
+def manifest_parts_done(folder):
+    manifest = DownloadManifest(str(folder))
+    try:
+        return manifest.get('hil/extract.bin')['parts_done']
+    finally:
+        manifest.close()
+
+
+def test_a_partial_large_file_resumes_from_its_completed_parts(tmp_path):
+    body = bytes(range(100))
+    s3_client = FakeS3([])
+    s3_client.put('hil/extract.bin', body)
+    entries = s3_client.list_objects_v2(Bucket='bucket')['Contents']
+    get_object = s3_client.get_object
+
+    def failing_after_two_parts(**request):
+        if int(request['Range'].split('=')[1].split('-')[0]) >= 64:
+            raise ClientError({'Error': {'Code': 'AccessDenied'}, 'ResponseMetadata': {'HTTPStatusCode': 403}},
+                              'GetObject')
+        return get_object(**request)
+
+    manifest = DownloadManifest(str(tmp_path))
+    s3_client.get_object = failing_after_two_parts
+    stats = download_files_concurrently(entries, 'bucket', str(tmp_path), s3_client, max_workers=1,
+                                        large_object_threshold=64, part_size=32, manifest=manifest)
+    manifest.close()
+    assert list(stats['failed']) == ['hil/extract.bin']
+    assert manifest_parts_done(tmp_path) == {0, 1}
+
+    manifest = DownloadManifest(str(tmp_path))
+    s3_client.get_object = get_object
+    s3_client.get_calls = 0
+    stats = download_files_concurrently(manifest.iter_unfinished(), 'bucket', str(tmp_path), s3_client,
+                                        max_workers=2, large_object_threshold=64, part_size=32, manifest=manifest)
+    manifest.close()
+    assert stats['failed'] == {} and stats['downloaded'] == 1
+    # Only bytes 64-95 and 96-99 are fetched again
+    assert s3_client.get_calls == 2
+    with open(tmp_path / 'extract.bin', 'rb') as f:
+        assert f.read() == body
+
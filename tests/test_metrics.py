@@ -0,0 +1,27 @@
+import os
+import socket
+import sys
+
+import pytest
+from botocore.exceptions import EndpointConnectionError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import RunMetrics
+from s3_engine import create_s3_client
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_a_request_with_no_response_keeps_its_own_error():
+    s3_client = create_s3_client('key', 'secret', endpoint_url=f'http://127.0.0.1:{closed_port()}', max_attempts=1)
+    metrics = RunMetrics()
+    with metrics.count_requests(s3_client):
+        with pytest.raises(EndpointConnectionError):
+            s3_client.get_object(Bucket='bkt1', Key='report.txt')
+    assert metrics.requests['GetObject'] == 1
+    assert metrics.request_errors['GetObject'] == 1
@@ -0,0 +1,55 @@
+import itertools
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import object_cache
+from object_cache import ObjectCache
+
+
+def entry(key, size=4):
+    return {'Key': key, 'Size': size, 'ETag': f'"{key}"'}
+
+
+def downloaded(folder, key, body=b'data'):
+    path = os.path.join(folder, key)
+    with open(path, 'wb') as f:
+        f.write(body)
+    return path
+
+
+def test_least_recently_used_objects_are_evicted_first(tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(object_cache, 'time', SimpleNamespace(time=lambda: next(clock)))
+    cache = ObjectCache(str(tmp_path / 'cache'), max_bytes=10)
+    cache.store('bucket', entry('a'), downloaded(tmp_path, 'a'))
+    cache.store('bucket', entry('b'), downloaded(tmp_path, 'b'))
+    assert cache.fetch('bucket', entry('a'), str(tmp_path / 'a_again'))
+
+    cache.store('bucket', entry('c'), downloaded(tmp_path, 'c'))
+    assert cache.stats()['cache_evictions'] == 1
+    assert not cache.fetch('bucket', entry('b'), str(tmp_path / 'b_again'))
+    assert cache.fetch('bucket', entry('a'), str(tmp_path / 'a_again'))
+    assert cache.fetch('bucket', entry('c'), str(tmp_path / 'c_again'))
+
+
+def test_a_cached_copy_changed_since_it_was_stored_is_not_served(tmp_path):
+    cache = ObjectCache(str(tmp_path / 'cache'), link=False)
+    cache.store('bucket', entry('a'), downloaded(tmp_path, 'a'))
+    cached = cache._path(cache._object_id('bucket', entry('a'))[0])
+    stat = os.stat(cached)
+    os.utime(cached, (stat.st_atime, stat.st_mtime + 60))
+
+    assert not cache.fetch('bucket', entry('a'), str(tmp_path / 'a_again'))
+    assert not os.path.exists(cached) and not os.path.exists(tmp_path / 'a_again')
+    assert cache.stats()['cache_misses'] == 1
+
+
+def test_an_entry_of_another_size_is_not_served(tmp_path):
+    cache = ObjectCache(str(tmp_path / 'cache'))
+    cache.store('bucket', entry('a'), downloaded(tmp_path, 'a'))
+
+    assert not cache.fetch('bucket', entry('a', size=5), str(tmp_path / 'a_again'))
+    assert not cache.fetch('bucket', entry('a'), str(tmp_path / 'a_again'))
@@ -0,0 +1,77 @@
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_s3 import FakeS3, daily_keys
+from filters import compile_filter
+from s3_engine import iter_s3_objects_by_date, iter_s3_objects_by_name
+
+
+def listed_by_date(s3_client, folder, start_date, end_date, date_format='%Y%m%d'):
+    matches = compile_filter(start_date=start_date, end_date=end_date, date_format=date_format)
+    keys = [entry['Key'] for entry in iter_s3_objects_by_date('bucket', folder, s3_client, start_date, end_date,
+                                                               date_format)]
+    assert len(keys) == len(set(keys))
+    return sorted(key for key in keys if matches({'Key': key}))
+
+
+def test_sibling_family_after_a_skipped_family_is_still_listed():
+    folder = 'hil/'
+    keys = (daily_keys(folder, 'hil_transaction_', 2024, 1, 31) + daily_keys(folder, 'hil_transaction_', 2024, 2, 29)
+            + daily_keys(folder, 'hil_transaction_2_', 2024, 1, 31)
+            + daily_keys(folder, 'hil_transaction_2_', 2024, 2, 29))
+    s3_client = FakeS3(keys, page_size=10)
+
+    matched = listed_by_date(s3_client, folder, date(2024, 2, 1), date(2024, 2, 29))
+    assert matched == sorted(key for key in keys if '202402' in key)
+    assert len(matched) == 58
+
+
+def test_a_family_spanning_several_years_is_skipped_in_one_jump():
+    folder = 'cp/'
+    keys = [key for year in range(2019, 2025) for key in daily_keys(folder, 'settlement_', year, 3, 31)]
+    keys += daily_keys(folder, 'settlement_b_', 2024, 3, 31)
+    s3_client = FakeS3(keys, page_size=20)
+
+    matched = listed_by_date(s3_client, folder, date(2022, 3, 10), date(2022, 3, 12))
+    assert matched == [folder + f'settlement_202203{day}.txt' for day in (10, 11, 12)]
+    # A page per family, the window's part of the first one's skipped dates, and the end of the folder
+    assert s3_client.list_calls == 4
+
+
+def test_many_small_families_take_no_more_pages_than_the_full_listing():
+    folder = 'hil/'
+    keys = [key for family in range(250) for key in daily_keys(folder, f'm{family:04d}_', 2020, 1, 20)]
+    s3_client = FakeS3(keys)
+
+    assert len(listed_by_date(s3_client, folder, date(2020, 1, 5), date(2020, 1, 8))) == 1000
+    assert s3_client.list_calls == 5
+
+
+def test_undated_files_are_walked_like_the_full_listing():
+    folder = 'nf/'
+    keys = [f"{folder}readme_{i:04d}.txt" for i in range(200)] + daily_keys(folder, 'nf_', 2024, 1, 3, '%Y_%m_%d')
+    s3_client = FakeS3(keys, page_size=50)
+
+    listed = list(iter_s3_objects_by_date('bucket', folder, s3_client, date(2024, 1, 1), date(2024, 1, 3),
+                                          '%Y_%m_%d'))
+    assert len(listed) == len(keys)
+
+
+def test_open_date_window_lists_the_whole_folder():
+    folder = 'fnbo/'
+    keys = daily_keys(folder, 'transaction_', 2024, 1, 10)
+    s3_client = FakeS3(keys)
+
+    assert len(list(iter_s3_objects_by_date('bucket', folder, s3_client, date(2024, 1, 5), None, '%Y%m%d'))) == 10
+    assert len(list(iter_s3_objects_by_date('bucket', folder, s3_client, None, date(2024, 1, 5), '%Y%m%d'))) == 10
+
+
+def test_exact_names_are_looked_up_and_missing_ones_left_out():
+    s3_client = FakeS3(daily_keys('hil/', 'hil_transaction_', 2024, 1, 3))
+    entries = list(iter_s3_objects_by_name('bucket', 'hil', s3_client,
+                                           'hil_transaction_20240102.txt, hil_transaction_20240109.txt'))
+    assert [entry['Key'] for entry in entries] == ['hil/hil_transaction_20240102.txt']
+    assert entries[0]['Size'] == 1 and s3_client.list_calls == 0